@@ -7,18 +7,17 @@
 # Copyright: 2013 Vincent Vande Vyvre
 # Licence: LGPL3
 
+# Only the modules needed by the conversion are imported here, those used by
+# the command line and the directory processing are imported on first use.
 import os
-import glob
 import re
-import shutil
-import argparse
 import sys
 import tokenize
-import subprocess
-import stat
+import time
 
-from datetime import datetime
-from codecs import BOM_UTF8, lookup, open as open_
+from array import array
+from bisect import bisect_right
+from codecs import BOM_UTF8, lookup, getincrementalencoder, open as open_
 
 PY_VERS = sys.version_info[0]
 
@@ -29,23 +28,91 @@ else:
     from io import StringIO
     range_ = range
 
+from io import BytesIO
+
 from .qtclass import MODULES, CLASSES, DISCARDED, QAPP_STATIC_METHODS, QVARIANT_OBSOLETE_METHODS
+from .rules import RULES, UIC_RULES, build_plan, run_plan
+
+
+class LazyPattern(object):
+    """A regular expression compiled on its first use.
+
+    Args:
+    pattern -- the regular expression
+    flags -- the flags of re.compile()
+    """
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+        self._regex = None
+
+    def __getattr__(self, name):
+        # Called only for the attributes of the compiled regex
+        if self._regex is None:
+            self._regex = re.compile(self.pattern, self.flags)
+        return getattr(self._regex, name)
+
 
 L_SEP = os.linesep
 PYEXT = (os.extsep + "py", os.extsep + "pxi")
 PYSHEBANG = ("#!/usr/bin/env python", "#!/usr/bin/python")
-MOD_RE = {'QtGui': re.compile(r'(?<=QtGui\.)(.*?)(?=[.\(\),\]:]|\Z)', re.DOTALL),
-          'QtWebKit': re.compile(r'(?<=QtWebKit\.)(.*?)(?=[.\(\),\]:]|\Z)', re.DOTALL)}
-SIG_RE = {'fun_re': re.compile(r'(?<=\()(.*)(?=\))', re.DOTALL),
-          'sig_re': re.compile(r'''(?<=SIGNAL\(["' ])(.*?)(?=["',])''', re.DOTALL),
-          'slot_re': re.compile(r'''(?<=SLOT\(["'])(.*?)(?=["'])''', re.DOTALL),
-          'pysig_re': re.compile(r'''(?<=["'])(.*?)(?=["'])''', re.DOTALL)}
-DOT_RE = re.compile(r'(?<=\()(.*?)(?=\.NoDotAndDotDot)')
-WHEEL_RE = re.compile(r'(?<=def wheelEvent\(self,)(.*?)(?=\):)')
-LAYOUT_RE = re.compile(r'(.*?)(\=)(.*?)(?=Layout\()')
-DSK_RE = re.compile(r'(.*?)(\=)(.*?)(?=QDesktopServices\()')
-DATE_RE = re.compile(r'(.*?)(\=)(.*?)(?=QDate\()')
-CLS_RE = re.compile(r'(?<=class )(.*?)(?=[\(:])')
+MOD_RE = {'QtGui': LazyPattern(r'(?<=QtGui\.)(.*?)(?=[.\(\),\]:]|\Z)', re.DOTALL),
+          'QtWebKit': LazyPattern(r'(?<=QtWebKit\.)(.*?)(?=[.\(\),\]:]|\Z)', re.DOTALL)}
+SIG_RE = {'fun_re': LazyPattern(r'(?<=\()(.*)(?=\))', re.DOTALL),
+          'sig_re': LazyPattern(r'''(?<=SIGNAL\(["' ])(.*?)(?=["',])''', re.DOTALL),
+          'slot_re': LazyPattern(r'''(?<=SLOT\(["'])(.*?)(?=["'])''', re.DOTALL),
+          'pysig_re': LazyPattern(r'''(?<=["'])(.*?)(?=["'])''', re.DOTALL)}
+DOT_RE = LazyPattern(r'(?<=\()(.*?)(?=\.NoDotAndDotDot)')
+WHEEL_RE = LazyPattern(r'(?<=def wheelEvent\(self,)(.*?)(?=\):)')
+LAYOUT_RE = LazyPattern(r'(.*?)(\=)(.*?)(?=Layout\()')
+DSK_RE = LazyPattern(r'(.*?)(\=)(.*?)(?=QDesktopServices\()')
+DATE_RE = LazyPattern(r'(.*?)(\=)(.*?)(?=QDate\()')
+CLS_RE = LazyPattern(r'(?<=class )(.*?)(?=[\(:])')
+# The items which take a QGraphicsScene in PyQt4, see fix_qgraphicsitem()
+GRAPHICS_ITEMS = ('QAbstractGraphicsShapeItem',
+                  'QGraphicsEllipseItem',
+                  'QGraphicsItem',    # 'QGraphicsItemGroup',
+                  'QGraphicsLineItem',
+                  'QGraphicsPathItem',
+                  'QGraphicsPixmapItem',
+                  'QGraphicsPolygonItem',
+                  'QGraphicsRectItem',
+                  'QGraphicsSimpleTextItem',
+                  'QGraphicsTextItem')
+GRAPHICS_ITEM_RE = LazyPattern('|'.join(GRAPHICS_ITEMS))
+SIGDECL_RE = LazyPattern(r'(\w+)\s*=\s*(?:[\w.]*\.)?pyqtSignal\(')
+INDEX_KINDS = ('layouts', 'dates', 'headers', 'dsks')
+# The header of the modules written by pyuic4
+UIC_HEADER_RE = LazyPattern(r'#.*PyQt4 UI code generator')
+# A class of QtGui followed by a delimiter, the same names as MOD_RE['QtGui']
+QTGUI_CLASS_RE = LazyPattern(r'QtGui\.(\w+)(?=\s*(?:[.\(\),\]:]|\Z))')
+# The header and the only import of the modules written by pyrcc4
+RCC_HEADER = b'Resource Compiler for PyQt'
+RCC_IMPORT_RE = LazyPattern(br'^from PyQt4 import QtCore[ \t]*$', re.M)
+# The string literals of one physical line
+STRING_RE = LazyPattern(r'"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'')
+# The dotted names of the QString.fromUtf8() wrappers
+FROMUTF8_NAMES = (('_fromUtf8',), ('QString', 'fromUtf8'),
+                  ('QtCore', 'QString', 'fromUtf8'), ('Qt', 'QString', 'fromUtf8'),
+                  ('PyQt4', 'QtCore', 'QString', 'fromUtf8'),
+                  ('PyQt4', 'Qt', 'QString', 'fromUtf8'))
+# Files larger than this are read through a memory map, see MappedLines
+MMAP_THRESHOLD = 8 * 1024 * 1024
+LONE_CR_RE = LazyPattern(b'\r(?!\n)')
+CODING_RE = LazyPattern(r"coding[:=]\s*([-\w.]+)")
+MARGIN_RE = LazyPattern(r'[, =\(\-+]')
+# The classes renamed by replace_classnames()
+CLASSNAMES = (('QMatrix', 'QTransform'), ('QIconEngineV2', 'QIconEngine'))
+QAPP_PREFIX = r'(\A|[^a-zA-Z0-9_.\'"]|Qt\.|QtWidgets\.)qApp'
+QAPP_RE = LazyPattern(QAPP_PREFIX + r'(\Z|[^a-zA-Z0-9_])')
+# One regex for each static method of QApplication, see replace_qApp()
+QAPP_STATIC_RES = []
+# The tokens which matter to split the arguments of a call, besides the
+# commas, the strings and the comments are skipped as a whole
+ARG_TOKEN_RE = LazyPattern(r'''[()\[\]{}:]|\blambda\b|#[^\n]*'''
+                           r'''|"""(?:[^"\\]|\\.|"(?!""))*(?:"""|\Z)'''
+                           r"""|'''(?:[^'\\]|\\.|'(?!''))*(?:'''|\Z)"""
+                           r'''|"(?:[^"\\]|\\.)*(?:"|\Z)|'(?:[^'\\]|\\.)*(?:'|\Z)''', re.S)
 
 # Utils
 
@@ -54,34 +121,297 @@ def diff_parenthesis(line):
     closed = line.count(')')
     return opened - closed
 
+def split_arguments(text):
+    """Returns the spans of the arguments of a call, in one scan.
+
+    The commas into brackets, strings, comments and the parameters of a
+    lambda don't split.  A closing bracket without opening one, as left by
+    the callers which cut a line at its last parenthesis, is a character
+    of the last argument.
+
+    Args:
+    text -- the arguments, without the parenthesis of the call
+
+    Returns:
+    list((start, end)) the offsets of the arguments without the blanks
+    around them, [] if there's no argument
+    """
+    # The offsets of the commas which split
+    commas = []
+    depth = 0
+    pos = 0
+    in_lambda = False
+    for match in ARG_TOKEN_RE.finditer(text):
+        if not depth and not in_lambda:
+            comma = text.find(',', pos, match.start())
+            while comma >= 0:
+                commas.append(comma)
+                comma = text.find(',', comma + 1, match.start())
+        pos = match.end()
+
+        token = match.group()
+        if token[0] in '"\'#':
+            # A string or a comment
+            continue
+        elif token in '([{':
+            depth += 1
+        elif token in ')]}':
+            if depth:
+                depth -= 1
+        elif depth:
+            continue
+        elif token == 'lambda':
+            in_lambda = True
+        else:
+            in_lambda = False
+
+    if not depth and not in_lambda:
+        comma = text.find(',', pos)
+        while comma >= 0:
+            commas.append(comma)
+            comma = text.find(',', comma + 1)
+
+    spans = []
+    start = 0
+    for end in commas + [len(text)]:
+        arg = text[start:end]
+        begin = start + len(arg) - len(arg.lstrip())
+        spans.append((begin, max(begin, start + len(arg.rstrip()))))
+        start = end + 1
+
+    if len(spans) == 1 and spans[0][0] == spans[0][1]:
+        return []
+
+    return spans
+
+def clean_signal_args(signal, pyqt5=True):
+    """Returns the C++ types of a signature as the types of pyqtSignal().
+
+    Args:
+    signal -- the signature or its arguments
+    pyqt5 -- False for the option --nopyqt5
+    """
+    if pyqt5:
+        signal = signal.replace('const char*', 'str').replace('const char *', 'str')
+    else:
+        signal = signal.replace('const char*', 'const_char_star_arg')\
+                       .replace('const char *', 'const_char_space_star_arg')
+    signal = signal.replace(' const ', '').replace('const ', '')
+    signal = signal.replace(' * ', '').replace(' *', '').replace('* ', '').replace('*', '')
+    signal = signal.replace(' & ', '').replace(' &', '').replace('& ', '').replace('&', '')
+    signal = signal.replace("PyQt_PyObject", "'PyQt_PyObject'")
+    if pyqt5:
+        # TODO: Convert this to use regular expressions.
+        signal = signal.replace("PyQt4.QtCore.QString", "QString").replace("PyQt4.Qt.QString", "QString")\
+                       .replace("QtCore.QString", "QString").replace("Qt.QString", "QString")\
+                       .replace("QString", "'QString'").replace("'QString'List", "'QStringList'")\
+                       .replace("'QStringList'Model", "QStringListModel")
+    else:
+        signal = signal.replace('const_char_star_arg', '"const char*"')\
+                       .replace('const_char_space_star_arg', '"const char *"')
+    return signal
+
+class Signature(object):
+    """A SIGNAL() or SLOT() declaration parsed.
+
+    Args:
+    name -- the name of the signal or of the slot
+    args -- the list of the types of its arguments
+    warning -- the message printed when the declaration is used, if it
+               can't be parsed
+    """
+    __slots__ = ('name', 'args', 'types', 'warning')
+
+    def __init__(self, name, args=(), warning=None):
+        self.name = name
+        self.args = list(args)
+        # The index of an overloaded signal, i.e. clicked[bool]
+        self.types = ''
+        if self.args and name != 'sslErrors':
+            self.types = ', '.join(self.args).replace('::', '.')
+        self.warning = warning
+
+def parse_signature(declaration, pyqt5=True):
+    """Returns the Signature of a SIGNAL() or SLOT() declaration.
+
+    Args:
+    declaration -- the argument of connect(), i.e. SIGNAL("clicked(bool)")
+    pyqt5 -- False for the option --nopyqt5
+    """
+    if "SIGNAL(" not in declaration and "SLOT(" not in declaration:
+        # Not declared with SIGNAL/SLOT, the name is the whole string
+        return Signature(declaration)
+
+    # Note: This assumes that SIGNAL/SLOT is the first function declared
+    match = SIG_RE['fun_re'].search(declaration)
+    if match is None:
+        return Signature(declaration)
+
+    content = match.groups()[0].strip()
+    if not content.startswith(('"', "'")):
+        # Unusual declaration, not of the form 'name(args)', the name is the
+        # whole declaration
+        return Signature(content, warning='WARNING: Invalid signal/slot '
+                         'declaration syntax:' + content)
+
+    slices = content.strip('\'"').split('(')
+    name = slices[0].lstrip()
+    if len(slices) == 1:
+        return Signature(name)
+
+    args = clean_signal_args(slices[1].replace(')', ''), pyqt5)
+    return Signature(name, [args[b:e] for b, e in split_arguments(args)])
+
+class SignatureCache(object):
+    """Memo of the parsed SIGNAL() and SLOT() declarations, shared by all the
+    files converted by the process: the same signatures, clicked() or
+    valueChanged(int), repeat thousands of times across a project.
+
+    Args:
+    size -- the number of declarations kept, the cache is emptied when full
+    """
+    def __init__(self, size=65536):
+        self.size = size
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, declaration, pyqt5=True):
+        """Returns the Signature of a declaration.
+
+        Args:
+        declaration -- the argument of connect(), i.e. SIGNAL("clicked()")
+        pyqt5 -- False for the option --nopyqt5
+        """
+        key = (declaration, pyqt5)
+        try:
+            signature = self.entries[key]
+            self.hits += 1
+        except KeyError:
+            if len(self.entries) >= self.size:
+                self.entries.clear()
+            signature = self.entries[key] = parse_signature(declaration, pyqt5)
+            self.misses += 1
+
+        if signature.warning:
+            print(signature.warning)
+        return signature
+
+    def add_counts(self, hits, misses):
+        """Count the lookups of another process, i.e. a watchdog worker."""
+        self.hits += hits
+        self.misses += misses
+
+    def report(self):
+        lookups = self.hits + self.misses
+        return ('Signal signatures: %d lookups, %d parsed, %.1f%% cache hits'
+                % (lookups, self.misses, 100.0 * self.hits / max(lookups, 1)))
+
+# The signatures of all the files converted by this process
+SIGNATURES = SignatureCache()
+
+def is_code(line):
+    """Returns True if a line is not empty, nor a comment, nor a string.
+
+    Same rule as PyQt4ToPyQt5.is_code_line(), usable without a converter.
+    """
+    stripped = line.lstrip()
+    return bool(stripped) and not stripped.startswith(('#', '"', "'"))
+
+def is_rcc_data(data):
+    """Returns True if the content of a file has been written by pyrcc4.
+
+    Args:
+    data -- the beginning of the file, bytes
+    """
+    return RCC_HEADER in data[:1024]
+
+def empty_like(lines):
+    """Returns an empty list of lines of the same kind as `lines`."""
+    if isinstance(lines, MappedLines):
+        return lines.new_like()
+
+    return []
+
+def index_file(item):
+    """Map phase of the symbol index, run into the worker processes.
+
+    Args:
+    item -- the file name or a tuple (file name, key in the index)
+
+    Returns:
+    tuple(key, facts, span) facts is None if the file can't be read or is
+    a resource module, span is the tuple (pid, start, end) of the work
+    """
+    start = time.time()
+    path, key = item if isinstance(item, tuple) else (item, item)
+    facts = None
+    try:
+        with open(path, 'rb') as inf:
+            head = inf.read(1024)
+    except (IOError, OSError):
+        head = b''
+    if not is_rcc_data(head):
+        lines = Tools().get_code_lines(path)
+        facts = SymbolIndex.scan(lines) if lines else None
+    return key, facts, (os.getpid(), start, time.time())
+
 
 class PyQt4ToPyQt5(object):
-    def __init__(self, source, dest, log, nopyqt5):
+    def __init__(self, source, dest, log, nopyqt5, index=None, data=None,
+                 tracer=None, rules=None):
         self.log = log
         self.source = source
         self.dest = dest
+        # In memory conversion: the content of the source and of the result
+        self.data = data
+        self.output = None
         self.indent = ' '
         self.tools = Tools()
+        self.index = index if index is not None else SymbolIndex()
+        # The tracing.Tracer of --trace
+        self.tracer = tracer
+        # The sorted rules of the run, see rules.get_rules()
+        self.rules = RULES if rules is None else rules
 
         self._has_qtwidget_import = False
         self._added_pyqtSignal = False
         self._pyqt5 = not nopyqt5
 
+        # Result of the conversion: 'converted', 'unchanged' or 'failed'
+        self.status = None
+        self.fixmes = 0
+        self.error = ''
+        # Number of logical lines read
+        self.num_lines = 0
+
     def setup(self):
         self.print_('Processing file: `%s`' % self.source)
+        if self.tracer is not None:
+            self.tracer.instrument(self)
         self.modified = {'QtGui': False, 'QtWidgets': False,
                          'QtWebKit': False, 'QtWebKitWidgets': False,
                          'QtMultimedia': False, 'QSound': False,
                          'QtCore': False, 'QtPrintSupport': False,
                          'QStandardPaths': False}
-        src = self.tools.get_code_lines(self.source)
-        if src is None:
+        if self.convert_rcc_module():
+            return
+
+        if self.data is None:
+            src = self.tools.get_code_lines(self.source)
+        else:
+            src = self.tools.decode_code_lines(self.data)
+        if src is None or src is False:
             self.print_('  Error: Unable to read the file: %s\n  Reason: %s\n'
                         % (self.source, self.tools.last_error))
+            self.status = 'failed'
+            self.error = self.tools.last_error
             return
 
+        self.num_lines = len(src)
         try:
-            self.indent = self.get_token_indent(''.join(src))[0]
+            # Only the first token is read
+            self.indent = self.get_token_indent(''.join(src[:1]))[0]
         except IndexError:
             # Never seen a PyQt4 script without indentation, but ...
             self.indent = ' '
@@ -90,61 +420,198 @@ class PyQt4ToPyQt5(object):
         qt4, sig, gui, web = self.get_import_lines(src)
         if not any([qt4, sig, gui, web]):
             self.print_('  No changes needed.\n')
+            self.status = 'unchanged'
+            return
+
+        if not self.index.has(self.source):
+            # Not indexed by the map phase, i.e. a single file
+            self.index.add(self.source, self.index.scan(src))
+
+        kinds = set(k for k, found in (('sig', sig), ('gui', gui), ('web', web)) if found)
+        if self._pyqt5 and self.is_uic_module(src):
+            self.finish_process(self.convert_uic_module(src, kinds))
             return
 
-        # call before updating signals and slots
-        if self._pyqt5:
-            self.remove_fromUtf8(src)
-
-        # call before change_module_name
-        if sig:
-            self.fix_emit(src)
-            self.fix_connect(src)
-            self.fix_disconnect(src)
-            self.fix_signal(src)
-            self.fix_slot(src)
-
-        if gui and self._pyqt5:
-            src = self.change_module_name(src, 'QtGui', 'QtCore')
-            src = self.change_module_name(src, 'QtGui', 'QtWidgets')
-            src = self.change_module_name(src, 'QtGui', 'QtPrintSupport')
-
-        if web and self._pyqt5:
-            src = self.change_module_name(src, 'QtWebKit', 'QtWebKitWidgets')
-
-        # call after the signals and slots have been fixed
-        src = self.change_import_lines(src)
-
-        if self._pyqt5:
-            self.fix_qfiledialog(src)
-            self.fix_qdir(src)
-            self.fix_qwidget(src)
-            self.fix_qtscript(src)
-            self.fix_qtxml(src)
-            self.fix_qtdeclarative(src)
-            self.fix_qgraphicsitemanimation(src)
-            self.fix_qtopengl(src)
-            self.fix_translations(src)
-            self.fix_wheelevent(src)
-            self.fix_layoutmargin(src)
-            self.fix_qdesktopservices(src)
-            self.fix_qdate(src)
-            self.fix_qgraphicsitem(src)
-            self.fix_qheader(src)
-            self.fix_qinputdialog(src)
-            self.fix_qchar(src)
-            self.fix_qstring(src)
-            self.fix_qglobal(src)
-            self.fix_qvariant(src)
-            self.replace_classnames(src)
-            self.replace_qApp(src)
-
-        self.finish_process(src)
+        # The order and the conditions of the fixers are declared in rules.RULES
+        self.finish_process(self.run_rules(self.rules, src, kinds))
+
+    def run_rules(self, rules, lines, kinds):
+        """Run the rules which can match the lines, returns the new lines.
+
+        Args:
+        rules -- the sorted rules
+        lines -- source code
+        kinds -- the set of the kinds of code found by get_import_lines(),
+                 'sig', 'gui' and 'web'
+        """
+        return run_plan(self, build_plan(rules, lines, kinds, self._pyqt5), lines)
+
+    def fix_lines(self, lines, funcs, names=None):
+        """Run line-local fixers in one pass over the lines.
+
+        Args:
+        lines -- source code
+        funcs -- the functions which return the new line of a line
+        names -- the names of their rules, an instrumented converter times
+                 each function under its name, see tracing.instrument()
+        """
+        for idx, line in enumerate(lines):
+            new = line
+            for func in funcs:
+                new = func(new)
+            if new is not line:
+                lines[idx] = new
+
+    def convert_rcc_module(self):
+        """Convert a module written by pyrcc4, returns False if the file
+        isn't one.
+
+        Only the import of QtCore changes, the resource data is copied as
+        bytes without being decoded nor tokenized.
+        """
+        data = self.data
+        if data is None:
+            try:
+                with open(self.source, 'rb') as inf:
+                    if not is_rcc_data(inf.read(1024)):
+                        return False
+                    inf.seek(0)
+                    data = inf.read()
+            except (IOError, OSError):
+                # Reported by the general path
+                return False
+
+        if not is_rcc_data(data):
+            return False
+
+        # Same newlines as the universal newlines mode
+        if b'\r' in data:
+            data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        imports = len(RCC_IMPORT_RE.findall(data))
+        if imports != data.count(b'PyQt4'):
+            # Edited by hand
+            return False
+
+        inf = BytesIO(data)
+        self.tools.encoding = self.tools.read_encoding([inf.readline(), inf.readline()])
+        # The physical lines, the data is one logical line by resource
+        self.num_lines = data.count(b'\n')
+        changed = imports and self._pyqt5
+        if not changed:
+            self.print_('  No changes needed.\n')
+            self.status = 'unchanged'
+            if not imports or self.data is not None or self.dest == self.source:
+                return True
+
+        # Else with --nopyqt5, a module which imports PyQt4 converted into
+        # another file, i.e. with -o, is copied: the general path writes it
+        if changed:
+            data = RCC_IMPORT_RE.sub(b'from PyQt5 import QtCore', data)
+        if L_SEP != '\n':
+            data = data.replace(b'\n', L_SEP.encode('ascii'))
+        self.write_output([data])
+        if changed:
+            self.status = 'converted'
+            self.print_('  File updated.\n')
+        return True
+
+    def is_uic_module(self, lines):
+        """Returns True if the lines have been written by pyuic4.
+
+        Args:
+        lines -- source code
+        """
+        for line in lines[:12]:
+            if UIC_HEADER_RE.match(line.lstrip()):
+                return True
+
+        return False
+
+    def convert_uic_module(self, lines, kinds):
+        """Convert a module written by pyuic4, returns the new lines.
+
+        The code of pyuic4 uses only the wrappers of _fromUtf8, the old
+        style connect(), the classes of QtGui, the translations and
+        setMargin(), the other built-in fixers are skipped.
+
+        Args:
+        lines -- source code
+        kinds -- the set of the kinds of code found by get_import_lines()
+        """
+        rules = [r for r in self.rules if r.name in UIC_RULES or r.plugin]
+        # The code of pyuic4 always uses QtGui
+        return self.run_rules(rules, lines, kinds | set(['gui']))
+
+    def change_qtgui_modules(self, lines):
+        """Move the classes of QtGui to QtCore, QtWidgets and QtPrintSupport,
+        returns the new lines.
+
+        Args:
+        lines -- source code
+        """
+        if not self.move_qtgui_classes(lines):
+            # An ambiguous reference to QtGui, one pass by module
+            lines = self.change_module_name(lines, 'QtGui', 'QtCore')
+            lines = self.change_module_name(lines, 'QtGui', 'QtWidgets')
+            lines = self.change_module_name(lines, 'QtGui', 'QtPrintSupport')
+        return lines
+
+    def change_qtwebkit_modules(self, lines):
+        """Move the widgets of QtWebKit to QtWebKitWidgets, returns the new
+        lines.
+
+        Args:
+        lines -- source code
+        """
+        return self.change_module_name(lines, 'QtWebKit', 'QtWebKitWidgets')
+
+    def move_qtgui_classes(self, lines):
+        """Move the classes of QtGui to their new modules in one pass, as
+        change_module_name() for QtCore, QtWidgets and QtPrintSupport.
+
+        Returns False without change if a QtGui isn't followed by a class
+        name into a line which refers to a class of QtGui.
+
+        Args:
+        lines -- source code
+        """
+        found = []
+        for idx, line in enumerate(lines):
+            if 'QtGui.' in line and ' import ' not in line and self.is_code_line(line):
+                if len(QTGUI_CLASS_RE.findall(line)) != line.count('QtGui'):
+                    return False
+                found.append(idx)
+
+        def get_module_name(match):
+            name = match.group(1)
+            if name == 'QSound':
+                self.modified['QtMultimedia'] = True
+                self.modified['QSound'] = True
+                return 'QtMultimedia.QSound'
+
+            if name == 'QStringListModel' or name in CLASSES['QtCore']:
+                self.modified['QtCore'] = True
+                return 'QtCore.' + name
+
+            self.modified['QtGui'] = True
+            for mod in ('QtWidgets', 'QtPrintSupport'):
+                if name in CLASSES[mod]:
+                    self.modified[mod] = True
+                    return mod + '.' + name
+
+            return 'QtGui.' + name
+
+        for idx in found:
+            lines[idx] = QTGUI_CLASS_RE.sub(get_module_name, lines[idx])
+
+        return True
 
     def finish_process(self, src):
         src, fixs = self.clean_file(src)
 
         self.save_changes(src)
+        self.status = 'converted'
+        self.fixmes = len(fixs)
         if fixs:
             if len(fixs) == 1:
                 txt = "  FIXME added:\n%s" % fixs[0][:-1]
@@ -191,7 +658,7 @@ class PyQt4ToPyQt5(object):
         """
         fixme = "# FIXME$ Ambiguous syntax, can't refactor it\n"
         classes = CLASSES[new_mod]
-        news = []
+        news = empty_like(lines)
         count = 0
         def get_module_name(widget):
             if widget == 'QSound':
@@ -299,17 +766,23 @@ class PyQt4ToPyQt5(object):
         Args:
         lines -- source code
         """
-        for idx, line in enumerate(lines):
-            if self.is_code_line(line):
-                if '.NoDotAndDotDot' in line:
-                    inst = DOT_RE.search(line.lstrip())
-                    if inst is not None:
-                        name = inst.group(0).split('|')[-1].lstrip()
-                        rep = '.NoDot | %s.NoDotDot' % name
-                        lines[idx] = line.replace('.NoDotAndDotDot', rep)
+        self.fix_lines(lines, [self.qdir_line])
 
-                if '.convertSeparators(' in line:
-                    lines[idx] = line.replace('convertSeparators', 'toNativeSeparators')
+    def qdir_line(self, line):
+        if self.is_code_line(line):
+            new = line
+            if '.NoDotAndDotDot' in line:
+                inst = DOT_RE.search(line.lstrip())
+                if inst is not None:
+                    name = inst.group(0).split('|')[-1].lstrip()
+                    rep = '.NoDot | %s.NoDotDot' % name
+                    new = line.replace('.NoDotAndDotDot', rep)
+
+            if '.convertSeparators(' in line:
+                new = line.replace('convertSeparators', 'toNativeSeparators')
+            return new
+
+        return line
 
     def fix_qwidget(self, lines):
         """
@@ -440,65 +913,20 @@ class PyQt4ToPyQt5(object):
             count += 1
 
     def split_function(self, function):
-        slices = ['']
-        current = 0
-        i = 0
-        while i < len(function):
-            if function[i] == ',':
-                slices.append('')
-                current += 1
-                i += 1
-                continue
-
-            slices[current] += function[i]
-
-            if function[i] == '(':
-                inside = 1
-                while inside != 0:
-                    i += 1
-                    # Skip over strings (which may contain parentheses).
-                    # TODO: handle triple-quoted strings
-                    if function[i] == '"' or function[i] == "'":
-                        str_delimiter = function[i]
-                        while True:
-                            slices[current] += function[i]
-                            i += 1
-                            if function[i] == str_delimiter:
-                                break
-                    if function[i] == '(':
-                        inside += 1
-                    elif function[i] == ')':
-                        inside -= 1
-                    slices[current] += function[i]
-            i += 1
-
-        result = []
-        i = 0
-        while i < len(slices):
-            if 'lambda ' in slices[i]:
-                lambda_f = ''
-
-                while i < len(slices):
-                    if lambda_f == '':
-                        lambda_f += slices[i]
-                    else:
-                        lambda_f += ',' + slices[i]
-
-                    if ':' in slices[i]:
-                        break
+        """Returns the arguments of a call, see split_arguments().
 
-                    i += 1
-
-                result.append(lambda_f)
-            else:
-                result.append(slices[i])
-
-            i += 1
+        Args:
+        function -- the arguments, without the parenthesis of the call
+        """
+        return [function[start:end] for start, end in split_arguments(function)]
 
-        if len(result) == 1 and result[0].strip() == '':
-            return []
+    def get_args(self, string):
+        """Returns the arguments of a call.
 
-        return [s.strip() for s in result]
+        Args:
+        string -- the arguments with the parenthesis of the call
+        """
+        return self.split_function(string.strip()[1:-1])
 
     def remove_signal_slot(self, el):
         """Removes old-style signal/slot declarations which use the SIGNAL/SLOT nomenclature.
@@ -509,176 +937,179 @@ class PyQt4ToPyQt5(object):
         Returns:
         list -- signal/slot name followed by signal/slot arguments
         """
-        if "SIGNAL(" in el or "SLOT(" in el:
-            # Note: This assumes that SIGNAL/SLOT is the first function declared in el.
-            content = SIG_RE['fun_re'].search(el).groups()[0]
-            content = content.strip()
-            if not content.startswith(('"', "'")):
-                # Unusual signal/slot declaration--not of the form 'name(args)'
-                # Return the entire declaration string as the signal/slot name.
-                print('WARNING: Invalid signal/slot declaration syntax:'+content)
-                return [content]
-            content = content.strip('\'"')
-
-            slices = content.split('(')
-            slices[0] = slices[0].lstrip()
-            if len(slices) == 1:
-                return slices
-
-            return [slices[0]] + self.split_function(self.clean_signal_args(slices[1].replace(')', '')))
-
-        # Signal/slot not declared with SIGNAL/SLOT nomenclature.
-        # Return the entire string as the signal/slot name.
-        return [el]
-
-    def create_signal(self, lines, currentIdx, signal):
+        signature = self.get_signature(el)
+        return [signature.name] + signature.args
+
+    def get_signature(self, declaration):
+        """Returns the Signature of a SIGNAL() or SLOT() declaration, from
+        the cache of the process.
+
+        Args:
+        declaration -- the argument of connect(), i.e. SIGNAL("clicked()")
+        """
+        return SIGNATURES.get(declaration, self._pyqt5)
+
+    def parse_signal_call(self, line, method):
+        """Returns the text before the call of a method and the list of its
+        arguments, None if the call can't be parsed.
+
+        Args:
+        line -- the logical line
+        method -- the name of the method, i.e. 'connect'
+        """
+        parts = line.split('.%s(' % method)
+        function = SIG_RE['fun_re'].search('(' + parts[1])
+        if function is None:
+            return None
+
+        return parts[0], self.split_function(function.groups()[0])
+
+    def rewrite_connection(self, line, method):
+        """Returns the new style connect() or disconnect() of a line and the
+        SIGNAL() declaration of the slot, if a signal is connected to
+        another one.  Returns None if the line can't be converted.
+
+        PyQt4 supports five versions of the connect() method:
+            connect(SIP_QOBJECT, SIP_SIGNAL, SIP_QOBJECT, SIP_SLOT, Qt::ConnectionType=Qt::AutoConnection)
+            connect(SIP_QOBJECT, SIP_SIGNAL, SIP_QOBJECT, SIP_SIGNAL, Qt::ConnectionType=Qt::AutoConnection)
+            connect(SIP_QOBJECT, SIP_SIGNAL, SIP_SLOT, Qt::ConnectionType=Qt::AutoConnection)
+            connect(SIP_QOBJECT, SIP_SIGNAL, SIP_SIGNAL, Qt::ConnectionType=Qt::AutoConnection)
+            connect(SIP_QOBJECT, SIP_SIGNAL, SIP_PYCALLABLE, Qt::ConnectionType=Qt::AutoConnection)
+        and disconnect() the same versions without the connection type.
+
+        Args:
+        line -- the logical line
+        method -- 'connect' or 'disconnect'
+        """
+        call = self.parse_signal_call(line, method)
+        if call is None:
+            return None
+
+        args = call[1]
+        if len(args) < 3 or len(args) > (5 if method == 'connect' else 4) \
+                or "SIGNAL(" not in args[1]:
+            print('WARNING: Invalid %s() syntax:' % method + line)
+            return None
+
+        signal = self.get_signature(args[1])
+
+        # parse slot argument (which could be another signal)
+        slot_obj = ''
+        slot_signal = ''
+        slot = None
+        if "SLOT(" in args[2] or "SIGNAL(" in args[2]:
+            if "SIGNAL(" in args[2]:
+                slot_signal = args[2]
+                slot_obj = 'self'
+            slot = self.get_signature(args[2])
+            other_args = args[3:]
+        elif len(args) > 3 and ("SLOT(" in args[3] or "SIGNAL(" in args[3]):
+            if "SIGNAL(" in args[3]:
+                slot_signal = args[3]
+            slot_obj = args[2]
+            slot = self.get_signature(args[3])
+            other_args = args[4:]
+        elif len(args) > 3 and method == 'disconnect':
+            print('WARNING: Invalid disconnect() syntax:' + line)
+            return None
+        else:
+            other_args = args[3:]
+        if method == 'disconnect':
+            # No connection type
+            other_args = []
+
+        # put everything together
+        new = [self.get_token_indent(line), args[0], '.', signal.name]
+        if signal.types:
+            new.append('[%s]' % signal.types)
+        new.extend(('.', method, '('))
+        if slot_obj:
+            new.append(slot_obj + '.')
+        new.append(args[2] if slot is None else slot.name)
+        if slot_signal and slot.types:
+            new.append('[%s]' % slot.types)
+        if other_args:
+            new.append(', ' + ', '.join(other_args))
+        new.append(')\n')
+        return ''.join(new), slot_signal
+
+    def create_signal(self, lines, currentIdx, signal, scopes=None):
         """Adds the declaration of a new pyqtSignal class member.
 
         Args:
         lines -- the list of source code lines
         currentIdx -- index into lines list where use of signal was detected
+        signal -- the old-style signal
+        scopes -- the ScopeIndex of the lines, updated with the insertions
 
         Returns:
         int -- number of additional lines inserted into lines list
         """
+        if scopes is None:
+            scopes = ScopeIndex(lines)
         module = signal.split('SIGNAL(')[0]
-        signal = self.remove_signal_slot(signal)
-        name = signal[0]
-
-        line = lines[currentIdx]
-        while not self.is_code_line(line) or not 'class ' in line:
-            currentIdx -= 1
-            line = lines[currentIdx]
-        currentIdx += 1
+        signal = self.get_signature(signal)
+        name = signal.name
+
+        header = scopes.get_class(currentIdx)
+        if header is None:
+            # Not into a class
+            return 0
+        if name in self.index.class_signals(self.get_classname(lines[header])):
+            # Already declared, maybe by a base class into another module
+            return 0
+        declared = scopes.signals(header)
+        if name in declared:
+            return 0
+
+        currentIdx = header + 1
         line = lines[currentIdx]
-        while True:
-            if self.is_code_line(line) and name in line:
-                return 0
-            if self.is_code_line(line) and not 'pyqtSignal' in line:
-                break
+        while not self.is_code_line(line) or 'pyqtSignal' in line:
             currentIdx += 1
             line = lines[currentIdx]
 
         indent = self.get_token_indent(line)
         if lines[currentIdx-1] == "\n":
             currentIdx -= 1
-        if len(signal) == 1 or signal[0] == 'sslErrors':
-            lines.insert(currentIdx, "%s = %spyqtSignal()\n" % (indent + name, module))
-        else:
-            type_str = ', '.join(signal[1:]).replace('::', '.')
-            lines.insert(currentIdx, "%s = %spyqtSignal(%s)\n" % (indent + name, module, type_str))
+        lines.insert(currentIdx, "%s = %spyqtSignal(%s)\n" % (indent + name, module,
+                                                               signal.types))
+        scopes.insert(currentIdx)
+        declared.add(name)
         self._added_pyqtSignal = True
 
         currentIdx += 1
         line = lines[currentIdx]
         if line.lstrip().startswith('def '):
             lines.insert(currentIdx, "\n")
+            scopes.insert(currentIdx)
             return 2
         else:
             return 1
 
     def fix_connect(self, lines):
-        """Refactor the pyqtSignal.connect()
-
-        PyQt4 supports five versions of the connect() method:
-            connect(SIP_QOBJECT, SIP_SIGNAL, SIP_QOBJECT, SIP_SLOT, Qt::ConnectionType=Qt::AutoConnection)
-            connect(SIP_QOBJECT, SIP_SIGNAL, SIP_QOBJECT, SIP_SIGNAL, Qt::ConnectionType=Qt::AutoConnection)
-            connect(SIP_QOBJECT, SIP_SIGNAL, SIP_SLOT, Qt::ConnectionType=Qt::AutoConnection)
-            connect(SIP_QOBJECT, SIP_SIGNAL, SIP_SIGNAL, Qt::ConnectionType=Qt::AutoConnection)
-            connect(SIP_QOBJECT, SIP_SIGNAL, SIP_PYCALLABLE, Qt::ConnectionType=Qt::AutoConnection)
+        """Refactor the pyqtSignal.connect(), see rewrite_connection()
 
         Args:
         lines -- source code
         """
+        scopes = None
         count = 0
         while count < len(lines):
             line = lines[count]
-
-            if not self.is_code_line(line) or not '.connect(' in line:
-                count += 1
-                continue
-            if not "SIGNAL(" in line:
-                count += 1
-                continue
-
-            parts = line.split('.connect(')
-            function = SIG_RE['fun_re'].search('('+parts[1])
-            if function is None:
-                count += 1
-                continue
-
-            # parse function arguments
-            args = self.split_function(function.groups()[0])
-            if len(args) < 3 or len(args) > 5:
-                print('WARNING: Invalid connect() syntax:'+line)
-                count += 1
-                continue
-
-            # parse signal argument
-            if not "SIGNAL(" in args[1]:
-                print('WARNING: Invalid connect() syntax:'+line)
-                count += 1
-                continue
-            signal_obj = args[0]
-            signal = self.remove_signal_slot(args[1])
-            signal_fun = signal[0]
-            signal_args = ''
-            if len(signal) > 1 and signal[0] != 'sslErrors':
-                signal_args = ', '.join(signal[1:]).replace('::', '.')
-
-            # parse slot argument (which could be another signal)
-            slot_obj = ''
-            slot_args = ''
-            slot_signal = ''
-            if "SLOT(" in args[2] or "SIGNAL(" in args[2]:
-                if "SIGNAL(" in args[2]:
-                    slot_signal = args[2]
-                    slot_obj = 'self'
-                slot = self.remove_signal_slot(args[2])
-                slot_fun = slot[0]
-                if len(slot) > 1 and slot[0] != 'sslErrors':
-                    slot_args = ', '.join(slot[1:]).replace('::', '.')
-                other_args = ', '.join(args[3:])
-            elif len(args) > 3 and ("SLOT(" in args[3] or "SIGNAL(" in args[3]):
-                if "SIGNAL(" in args[3]:
-                    slot_signal = args[3]
-                slot_obj = args[2]
-                slot = self.remove_signal_slot(args[3])
-                slot_fun = slot[0]
-                if len(slot) > 1 and slot[0] != 'sslErrors':
-                    slot_args = ', '.join(slot[1:]).replace('::', '.')
-                other_args = ', '.join(args[4:])
-            else:
-                slot_fun = args[2]
-                other_args = ', '.join(args[3:])
-
-            # put everything together
-            indent = self.get_token_indent(line)
-            lines[count] = indent + '%s.%s' % (signal_obj, signal_fun)
-            if signal_args:
-                lines[count] += '[%s]' % signal_args
-            lines[count] += '.connect('
-            if slot_obj:
-                lines[count] += '%s.' % slot_obj
-            lines[count] += '%s' % slot_fun
-            if slot_signal and slot_args:
-                lines[count] += '[%s]' % slot_args
-            if other_args:
-                lines[count] += ', %s' % other_args
-            lines[count] += ')\n'
-
-            if slot_signal:
-                count += self.create_signal(lines, count, slot_signal)
+            if '.connect(' in line and "SIGNAL(" in line and self.is_code_line(line):
+                new = self.rewrite_connection(line, 'connect')
+                if new is not None:
+                    lines[count], slot_signal = new
+                    if slot_signal:
+                        if scopes is None:
+                            scopes = ScopeIndex(lines)
+                        count += self.create_signal(lines, count, slot_signal, scopes)
 
             count += 1
 
     def fix_disconnect(self, lines):
-        """Refactor the pyqtSignal.disconnect()
+        """Refactor the pyqtSignal.disconnect(), see rewrite_connection()
 
-        PyQt4 supports three versions of the disconnect() method:
-            disconnect(SIP_QOBJECT, SIP_SIGNAL, SIP_QOBJECT, SIP_SLOT)
-            disconnect(SIP_QOBJECT, SIP_SIGNAL, SIP_QOBJECT, SIP_SIGNAL)
-            disconnect(SIP_QOBJECT, SIP_SIGNAL, SIP_PYCALLABLE)
         PyQt4 does not support these versions of the disconnect() method (but this script does):
             connect(SIP_QOBJECT, SIP_SIGNAL, SIP_SLOT)
             connect(SIP_QOBJECT, SIP_SIGNAL, SIP_SIGNAL)
@@ -686,94 +1117,41 @@ class PyQt4ToPyQt5(object):
         Args:
         lines -- source code
         """
-        for idx, line in enumerate(lines):
-            if not self.is_code_line(line) or not '.disconnect(' in line:
-                continue
-            if not "SIGNAL(" in line:
-                continue
-
-            parts = line.split('.disconnect(')
-            function = SIG_RE['fun_re'].search('('+parts[1])
-            if function is None:
-                continue
+        self.fix_lines(lines, [self.disconnect_line])
 
-            # parse function arguments
-            args = self.split_function(function.groups()[0])
-            if len(args) < 3 or len(args) > 4:
-                print('WARNING: Invalid disconnect() syntax:'+line)
-                continue
-
-            # parse signal argument
-            if not "SIGNAL(" in args[1]:
-                print('WARNING: Invalid disconnect() syntax:'+line)
-                continue
-            signal_obj = args[0]
-            signal = self.remove_signal_slot(args[1])
-            signal_fun = signal[0]
-            signal_args = ''
-            if len(signal) > 1 and signal[0] != 'sslErrors':
-                signal_args = ', '.join(signal[1:]).replace('::', '.')
-
-            # parse slot argument
-            slot_obj = ''
-            slot_args = ''
-            slot_signal = ''
-            if "SLOT(" in args[2] or "SIGNAL(" in args[2]:
-                if "SIGNAL(" in args[2]:
-                    slot_signal = args[2]
-                    slot_obj = 'self'
-                slot = self.remove_signal_slot(args[2])
-                slot_fun = slot[0]
-                if len(slot) > 1 and slot[0] != 'sslErrors':
-                    slot_args = ', '.join(slot[1:]).replace('::', '.')
-            elif len(args) > 3:
-                if "SLOT(" not in args[3] and "SIGNAL(" not in args[3]:
-                    print('WARNING: Invalid disconnect() syntax:'+line)
-                    continue
-                if "SIGNAL(" in args[3]:
-                    slot_signal = args[3]
-                slot_obj = args[2]
-                slot = self.remove_signal_slot(args[3])
-                slot_fun = slot[0]
-                if len(slot) > 1 and slot[0] != 'sslErrors':
-                    slot_args = ', '.join(slot[1:]).replace('::', '.')
-            else:
-                slot_fun = args[2]
+    def disconnect_line(self, line):
+        if '.disconnect(' in line and "SIGNAL(" in line and self.is_code_line(line):
+            new = self.rewrite_connection(line, 'disconnect')
+            if new is not None:
+                return new[0]
 
-            # put everything together
-            indent = self.get_token_indent(line)
-            lines[idx] = indent + '%s.%s' % (signal_obj, signal_fun)
-            if signal_args:
-                lines[idx] += '[%s]' % signal_args
-            lines[idx] += '.disconnect('
-            if slot_obj:
-                lines[idx] += '%s.' % slot_obj
-            lines[idx] += '%s' % slot_fun
-            if slot_signal and slot_args:
-                lines[idx] += '[%s]' % slot_args
-            lines[idx] += ')\n'
+        return line
 
     def fix_signal(self, lines):
         """
         clean decorator arguments
         """
-        for idx, line in enumerate(lines):
-            if '@pyqtSignal' in line:
-                line = self.clean_signal_args(line)
-                line = line.replace("'str'", "str").replace('"str"', 'str')
-            lines[idx] = line
+        self.fix_lines(lines, [self.signal_line])
+
+    def signal_line(self, line):
+        if '@pyqtSignal' in line:
+            line = self.clean_signal_args(line)
+            line = line.replace("'str'", "str").replace('"str"', 'str')
+        return line
 
     def fix_slot(self, lines):
         """
         pyqtSignature decorator changed into pyqtSlot
         clean decorator arguments
         """
-        for idx, line in enumerate(lines):
-            line = line.replace('@pyqtSignature', '@pyqtSlot')
-            if '@pyqtSlot' in line:
-                line = self.clean_signal_args(line)
-                line = line.replace("'str'", "str").replace('"str"', 'str')
-            lines[idx] = line
+        self.fix_lines(lines, [self.slot_line])
+
+    def slot_line(self, line):
+        line = line.replace('@pyqtSignature', '@pyqtSlot')
+        if '@pyqtSlot' in line:
+            line = self.clean_signal_args(line)
+            line = line.replace("'str'", "str").replace('"str"', 'str')
+        return line
 
     def fix_emit(self, lines):
         """
@@ -783,14 +1161,14 @@ class PyQt4ToPyQt5(object):
         Args:
         lines -- the list of source code lines
         """
+        scopes = None
         count = 0
         while count < len(lines):
             line = lines[count]
-            if self.is_code_line(line) and '.emit(' in line and 'SIGNAL(' in line:
-                parts = line.split('.emit(')
-                function = SIG_RE['fun_re'].search('('+parts[1])
-                if function is not None:
-                    args = self.split_function(function.groups()[0])
+            if '.emit(' in line and 'SIGNAL(' in line and self.is_code_line(line):
+                call = self.parse_signal_call(line, 'emit')
+                if call is not None:
+                    head, args = call
                     diff = diff_parenthesis(args[-1])
                     parenthesis = ')' * abs(diff)
                     if diff < 0:
@@ -798,9 +1176,11 @@ class PyQt4ToPyQt5(object):
                         args[-1] = ''.join(li)
                     if len(args) == 2 and args[1] == '()':
                         args.pop()
-                    lines[count] = '%s.%s.emit(%s)%s\n' % (parts[0], self.remove_signal_slot(args[0])[0], \
+                    lines[count] = '%s.%s.emit(%s)%s\n' % (head, self.get_signature(args[0]).name,
                                                            ', '.join(args[1:]), parenthesis)
-                    count += self.create_signal(lines, count, args[0])
+                    if scopes is None:
+                        scopes = ScopeIndex(lines)
+                    count += self.create_signal(lines, count, args[0], scopes)
             count += 1
 
     def fix_translations(self, lines):
@@ -809,48 +1189,50 @@ class PyQt4ToPyQt5(object):
         Args:
         lines -- the list of source code lines
         """
-        count = 0
-        while count < len(lines):
-            line = lines[count]
-            if self.is_code_line(line):
-                if '.translate' in line:
-                    ln = ''
-                    parts = line.split('.translate')
-                    for part in parts:
-                        if part.endswith('QApplication'):
-                            # QtGui has been already changed to QtWidgets
-                            if part.endswith('QtWidgets.QApplication'):
-                                ln += part[:-22] + 'QtCore.QCoreApplication'
+        self.fix_lines(lines, [self.translations_line])
 
-                            else:
-                                ln += part[:-12] + 'QCoreApplication'
+    def translations_line(self, line):
+        if not self.is_code_line(line):
+            return line
 
-                        else:
-                            ln += part
-                        ln = ln + '.translate'
+        if '.translate' in line:
+            ln = ''
+            parts = line.split('.translate')
+            for part in parts:
+                if part.endswith('QApplication'):
+                    # QtGui has been already changed to QtWidgets
+                    if part.endswith('QtWidgets.QApplication'):
+                        ln += part[:-22] + 'QtCore.QCoreApplication'
 
-                    ln = ln[:-11]
-                    if '.UnicodeUTF8' in ln:
-                        parts = ln.split('.UnicodeUTF8')
-                        ln = ''
-                        for part in parts:
-                            if part.endswith('QApplication'):
-                                if part.endswith('QtWidgets.QApplication'):
-                                    part = part[:-22]
+                    else:
+                        ln += part[:-12] + 'QCoreApplication'
 
-                                else:
-                                    part = part[:-12]
+                else:
+                    ln += part
+                ln = ln + '.translate'
+
+            ln = ln[:-11]
+            if '.UnicodeUTF8' in ln:
+                parts = ln.split('.UnicodeUTF8')
+                ln = ''
+                for part in parts:
+                    if part.endswith('QApplication'):
+                        if part.endswith('QtWidgets.QApplication'):
+                            part = part[:-22]
 
-                            # Maintain multilines syntax
-                            part = part.rstrip(',').rstrip().rstrip(',')
-                            ln = ln + part
+                        else:
+                            part = part[:-12]
 
-                    lines[count] = ln + '\n'
+                    # Maintain multilines syntax
+                    part = part.rstrip(',').rstrip().rstrip(',')
+                    ln = ln + part
 
-                elif '.trUtf8(' in line:
-                    lines[count] = line.replace('trUtf8(', 'tr(')
+            return ln + '\n'
 
-            count += 1
+        elif '.trUtf8(' in line:
+            return line.replace('trUtf8(', 'tr(')
+
+        return line
 
     def fix_wheelevent(self, lines):
         """Fix the wheelEvent event.delta() syntax.
@@ -860,28 +1242,23 @@ class PyQt4ToPyQt5(object):
         """
         # The function name must be matched by the re:
         # (?<=def wheelEvent\(self,)(.*?)(?=\):))
+        scopes = None
         count = 0
         while count < len(lines):
             line = lines[count]
-            if self.is_code_line(line):
-                if 'wheelEvent(' in line:
-                    match = WHEEL_RE.search(line)
-                    if match is not None:
-                        indent = self.get_token_indent(line)
-                        string = '%s.delta()' % match.group(0).strip()
-                        count += 1
-
-                        while count < len(lines):
-                            line = lines[count]
-                            if self.is_code_line(line):
-                                if self.get_token_indent(line) <= indent:
-                                    # End of wheelEvent function
-                                    count -= 1
-                                    break
-
-                                if string in line:
-                                    lines[count] = line.replace('.delta()', '.angleDelta().y()')
-                            count += 1
+            if 'wheelEvent(' in line and self.is_code_line(line):
+                match = WHEEL_RE.search(line)
+                if match is not None:
+                    if scopes is None:
+                        scopes = ScopeIndex(lines)
+                    string = '%s.delta()' % match.group(0).strip()
+                    # End of wheelEvent function
+                    end = scopes.get_end(count)
+                    for idx in range_(count + 1, end):
+                        line = lines[idx]
+                        if string in line and self.is_code_line(line):
+                            lines[idx] = line.replace('.delta()', '.angleDelta().y()')
+                    count = end - 1
             count += 1
 
     def fix_layoutmargin(self, lines):
@@ -890,19 +1267,10 @@ class PyQt4ToPyQt5(object):
         Args:
         lines -- the list of source code lines
         """
-        layouts = []
-        m_re = re.compile(r'[, =\(\-+]')
+        # All layouts instanciated in the script or in the project
+        layouts = self.index.names(self.source, 'layouts')
+        m_re = MARGIN_RE
         news = ('.setContentsMargins(', '.getContentsMargins()[0]')
-        for line in lines:
-            # Set the list of all layouts instanciated in the script
-            if 'Layout(' in line:
-                match = LAYOUT_RE.search(line.lstrip())
-                if match is not None:
-                    name = match.group(3)
-                    if name and name.endswith(('QGrid', 'QVBox', 'QHBox')):
-                        # If matched, group(1) is the reference of the layout
-                        layouts.append(match.group(1).strip())
-
         for idx, line in enumerate(lines):
             if self.is_code_line(line):
                 if '.setMargin(' in line:
@@ -927,12 +1295,8 @@ class PyQt4ToPyQt5(object):
         lines -- the list of source code lines
         """
         fixme = "# FIXME$ Ambiguous syntax for QDesktopServices, can't refactor it.\n"
-        dsks = ['QDesktopServices()', 'QtGui.QDesktopServices()']
-        for line in lines:
-            if 'QDesktopServices' in line:
-                match = DSK_RE.search(line.lstrip())
-                if match is not None:
-                    dsks.append(match.group(1).strip())
+        dsks = set(['QDesktopServices()', 'QtGui.QDesktopServices()'])
+        dsks.update(self.index.names(self.source, 'dsks'))
 
         count = 0
         while count < len(lines):
@@ -980,43 +1344,37 @@ class PyQt4ToPyQt5(object):
         Args:
         lines -- the list of source code lines
         """
-        gen = self.find_subclassed_class(lines, 'QDate')
-        while 1:
-            try:
-                num = next(gen)
-                self.fix_instance_qdate(lines, num + 1)
-            except StopIteration:
-                break
+        scopes = None
+        for num in self.find_subclassed_class(lines, 'QDate'):
+            if scopes is None:
+                scopes = ScopeIndex(lines)
+            self.fix_instance_qdate(lines, num + 1, scopes)
 
-        dates = []
+        dates = self.index.names(self.source, 'dates')
         for idx, line in enumerate(lines):
             if not self.is_code_line(line):
                 continue
 
-            if 'QDate(' in line:
-                match = DATE_RE.search(line.lstrip())
-                if match is not None:
-                    dates.append(match.group(1).strip())
-
             if '.setYMD(' in line:
                 inst = line.split('.setYMD')[0].lstrip()
                 if inst in dates:
                     lines[idx] = line.replace('setYMD', 'setDate')
 
-    def fix_instance_qdate(self, code, start):
+    def fix_instance_qdate(self, code, start, scopes=None):
         """Change QDate.setYMD() method to QDate.setDate() into a class wich
         inherits QDate
 
         Args:
         code -- the list of source code lines
         start -- the nummer of the second line of the class
+        scopes -- the ScopeIndex of the lines
         """
-        for idx, line in enumerate(code[start:]):
-            if self.is_class(line):
-                break
-
+        if scopes is None:
+            scopes = ScopeIndex(code)
+        for idx in range_(start, scopes.next_class(start)):
+            line = code[idx]
             if 'self.setYMD(' in line:
-                code[idx+start] = line.replace('setYMD', 'setDate')
+                code[idx] = line.replace('setYMD', 'setDate')
 
     def fix_qgraphicsitem(self, lines):
         """Remove the scene from the arguments of a QGraphicsItem.
@@ -1036,44 +1394,66 @@ class PyQt4ToPyQt5(object):
         """
         # TODO replace scale(float x, float y) to setTransform(QMatrix) or
         # setScale(float) if float x == float y
-        items = ['QAbstractGraphicsShapeItem',
-                 'QGraphicsEllipseItem',
-                 'QGraphicsItem',    # 'QGraphicsItemGroup',
-                 'QGraphicsLineItem',
-                 'QGraphicsPathItem',
-                 'QGraphicsPixmapItem',
-                 'QGraphicsPolygonItem',
-                 'QGraphicsRectItem',
-                 'QGraphicsSimpleTextItem',
-                 'QGraphicsTextItem']
-        for item in items:
-            self.find_graphics_items(lines, item)
-
-    def find_graphics_items(self, code, obj):
+        self.find_graphics_items(lines)
+
+    def find_instantiated_item(self, line):
+        """Returns the name of the first QGraphicsItem instantiated into a line
+        and the parts of the line split by this name, None if there's none.
+
+        Args:
+        line -- the line code
+        """
+        seen = set()
+        for match in GRAPHICS_ITEM_RE.finditer(line):
+            obj = match.group(0)
+            if obj in seen:
+                continue
+
+            seen.add(obj)
+            parts = line.split(obj)
+            if parts[1].startswith('Group'):
+                obj += 'Group'
+                parts = line.split(obj)
+
+            if parts[1].lstrip().startswith('('):
+                return obj, parts
+
+        return None
+
+    def find_graphics_items(self, code, scopes=None):
+        """Remove the scene from the arguments of all the QGraphicsItem
+        instantiated or subclassed, in one pass, see fix_qgraphicsitem().
+
+        Args:
+        code -- the list of source code lines
+        scopes -- the ScopeIndex of the lines, updated with the insertions
+        """
+        if scopes is None:
+            scopes = ScopeIndex(code)
         fixme = "# FIXME$ Can't identify the QGraphicsScene in the arguments "\
                                                         "of the QGraphicsItem"
         count = 0
         while count < len(code):
             scene = False
             line = code[count]
-            if not self.is_code_line(line) or line.lstrip().startswith(('import ', 'from ')):
+            if 'Graphics' not in line or not self.is_code_line(line) \
+                    or line.lstrip().startswith(('import ', 'from ')):
                 count += 1
                 continue
 
-            if obj in line:
+            match = GRAPHICS_ITEM_RE.search(line)
+            if match is not None:
                 if self.is_class(line):
-                    count = self.refactor_qgraphics_subclass(code, count, obj)
+                    count = self.refactor_qgraphics_subclass(code, count, match.group(0),
+                                                             scopes)
                     continue
 
-                parts = line.split(obj)
-                if parts[1].startswith('Group'):
-                    obj += 'Group'
-                    parts = line.split(obj)
-
-                if not parts[1].lstrip().startswith('('):
+                item = self.find_instantiated_item(line)
+                if item is None:
                     # Not instantiated
                     count += 1
                     continue
+                obj, parts = item
 
                 refs = parts[0].split('=')
                 if len(refs) < 2:
@@ -1120,6 +1500,7 @@ class PyQt4ToPyQt5(object):
                             else:
                                 # (object, parent) or (parent, scene)
                                 code.insert(count, '%s%s\n' % (ind, fixme))
+                                scopes.insert(count)
                                 count += 2
                                 continue
 
@@ -1139,6 +1520,7 @@ class PyQt4ToPyQt5(object):
 
                     else:
                         code.insert(count, '%s%s\n' % (ind, fixme))
+                        scopes.insert(count)
                         count += 2
                         continue
 
@@ -1147,28 +1529,39 @@ class PyQt4ToPyQt5(object):
                     string = '%s%s.addItem(%s)\n' % (ind, scene, ref.strip())
                     count += 1
                     code.insert(count, string)
+                    scopes.insert(count)
 
             count += 1
 
-    def refactor_qgraphics_subclass(self, lines, count, item):
+    def refactor_qgraphics_subclass(self, lines, count, item, scopes=None):
+        """Remove the scene from the arguments of the __init__ call of the
+        base class of a QGraphicsItem subclass.
+
+        Returns the position of the line after the class header, the body of
+        the class is then scanned as the rest of the file.
+
+        Args:
+        lines -- the list of source code lines
+        count -- the position of the class header
+        item -- the QGraphicsItem subclassed
+        scopes -- the ScopeIndex of the lines, updated with the insertions
+        """
         fixme = "# FIXME$ Can't identify the QGraphicsScene in arguments of "\
                                                         "the QGraphicsItem"
+        if scopes is None:
+            scopes = ScopeIndex(lines)
         cls = self.get_classname(lines[count])
+        end = scopes.get_end(count)
         count += 1
-        indent = ''
-        while count < len(lines):
+        body = count
+        while count < end:
             scene = False
             line = lines[count]
             if not self.is_code_line(line):
                 count += 1
                 continue
 
-            if line.lstrip().startswith('def __init__'):
-                indent = self.get_token_indent(line)
-                count += 1
-                continue
-
-            elif line.lstrip().startswith('super(%s' % cls):
+            if line.lstrip().startswith('super(%s' % cls):
                 ind = self.get_token_indent(line)
                 parts = line.split('__init__')
                 args = self.get_args(parts[1])
@@ -1178,10 +1571,6 @@ class PyQt4ToPyQt5(object):
                 parts = line.split('__init__')
                 args = self.get_args(parts[1])
 
-            elif self.get_token_indent(line) < indent:
-                # Leaving the class
-                return count + 1
-
             else:
                 count += 1
                 continue
@@ -1192,7 +1581,7 @@ class PyQt4ToPyQt5(object):
                 # 1: (self, parent)
                 # 1: (self, object)
                 if len(args) <= 2:
-                    return count + 1
+                    return body
 
                 # 2: (self, *args, **kwargs)
                 # 2: (self, object, parent)
@@ -1200,7 +1589,7 @@ class PyQt4ToPyQt5(object):
                 elif len(args) == 3:
                     if args[1] in ('*args', '* args') and args[2] in ('**kwargs', '** kwargs'):
                         # (self, *args, **kwargs)
-                        return count + 1
+                        return body
 
                     elif args[-2] == 'None':
                         # (self, parent=None, scene)
@@ -1214,12 +1603,13 @@ class PyQt4ToPyQt5(object):
 
                         elif parent_index == 2:
                             # (self, object, parent)
-                            return count + 1
+                            return body
 
                         else:
                             # (self, object, parent) or (self, parent, scene)
                             lines.insert(count, '%s%s\n' % (ind, fixme))
-                            return count + 2
+                            scopes.insert(count)
+                            return body
 
                 # 3: (self, object, parent, scene)
                 elif len(args) == 4:
@@ -1228,7 +1618,7 @@ class PyQt4ToPyQt5(object):
                 # 4: (self, x, y, w, h)
                 # 5: (self, x, y, w, h, parent)
                 elif len(args) == 5 or len(args) == 6:
-                    return count + 1
+                    return body
 
                 # 6: (self, x, y, w, h, parent, scene)
                 elif len(args) == 7:
@@ -1236,22 +1626,19 @@ class PyQt4ToPyQt5(object):
 
                 else:
                     lines.insert(count, '%s%s\n' % (ind, fixme))
-                    return count + 2
+                    scopes.insert(count)
+                    return body
 
             lines[count] = line.replace(parts[1], '(%s)\n' % ', '.join(args))
             if scene != 'None':
                 count += 1
                 lines.insert(count, '%sif %s is not None: %s.addItem(self)\n' % (ind, scene, scene))
+                scopes.insert(count)
 
-            return count + 1
+            return body
 
-        return count + 1
-
-    def get_args(self, string):
-        # Remove the parenthesis
-        string = string.strip()[1:-1]
-        args = string.split(',')
-        return [arg.strip() for arg in args]
+        # No __init__ call of the base class
+        return body
 
     def find_keyword(self, keyword, args):
         keyarg = False
@@ -1282,14 +1669,7 @@ class PyQt4ToPyQt5(object):
         code -- the list of source code lines
         """
         headers = ['horizontalHeader()', 'verticalHeader()']
-        for line in lines:
-            if '.horizontalHeader()' in line or '.verticalHeader()' in line:
-                try:
-                    ref, _ = line.split('=')
-                    headers.append(ref.strip())
-                except:
-                    pass
-
+        headers.extend(self.index.names(self.source, 'headers'))
         headers = tuple(headers)
         olds = ('.setMovable', '.isMovable',
                 '.setClickable', '.isClickable',
@@ -1315,9 +1695,13 @@ class PyQt4ToPyQt5(object):
         Args:
         code -- the list of source code lines
         """
-        for idx, line in enumerate(lines):
-            if 'QInputDialog.getInteger(' in line:
-                lines[idx] = line.replace('.getInteger(', '.getInt(')
+        self.fix_lines(lines, [self.qinputdialog_line])
+
+    def qinputdialog_line(self, line):
+        if 'QInputDialog.getInteger(' in line:
+            return line.replace('.getInteger(', '.getInt(')
+
+        return line
 
     def fix_qchar(self, lines):
         """Replace QChar() by unichr() for Python 2 and chr() for Python 3.
@@ -1347,7 +1731,7 @@ class PyQt4ToPyQt5(object):
 
                 lines.insert(idx, "\n")
 
-                ind = self.find_next_indent(lines[idx+1:])
+                ind = self.find_next_indent(lines[idx+1:idx+2])
                 if not ind:
                     ind = "    "
                 text = "try:\n%sQChar = unichr\nexcept NameError:\n"\
@@ -1398,7 +1782,7 @@ class PyQt4ToPyQt5(object):
                     lines.insert(idx, text)
 
                 if is_qstring:
-                    ind = self.find_next_indent(lines[idx+1:])
+                    ind = self.find_next_indent(lines[idx+1:idx+2])
                     if not ind:
                         ind = "    "
                     text = "try:\n%sQString = unicode\nexcept NameError:\n"\
@@ -1413,9 +1797,13 @@ class PyQt4ToPyQt5(object):
         Args:
         code -- the list of source code lines
         """
-        for idx, line in enumerate(lines):
-            if self.is_code_line(line):
-                lines[idx] = line.replace('qInstallMsgHandler(', 'qInstallMessageHandler(')
+        self.fix_lines(lines, [self.qglobal_line])
+
+    def qglobal_line(self, line):
+        if self.is_code_line(line):
+            return line.replace('qInstallMsgHandler(', 'qInstallMessageHandler(')
+
+        return line
 
     def fix_qvariant(self, lines):
         """Remove calls to obsolete QVariant conversion functions.
@@ -1423,11 +1811,13 @@ class PyQt4ToPyQt5(object):
         Args:
         code -- the list of source code lines
         """
-        for idx, line in enumerate(lines):
-            if self.is_code_line(line):
-                for method in QVARIANT_OBSOLETE_METHODS:
-                    line = line.replace('.'+method+'()', '')
-                lines[idx] = line
+        self.fix_lines(lines, [self.qvariant_line])
+
+    def qvariant_line(self, line):
+        if self.is_code_line(line):
+            for method in QVARIANT_OBSOLETE_METHODS:
+                line = line.replace('.'+method+'()', '')
+        return line
 
     def find_subclassed_class(self, code, classname):
         """Find a class instanciation wich subclass a Qt class.
@@ -1439,13 +1829,12 @@ class PyQt4ToPyQt5(object):
         Returns:
         int(nummer of class line)
         """
+        # The subclasses defined into the other modules are known by the index
+        classes = self.index.subclasses(classname)
         for idx, line in enumerate(code):
             if self.is_class(line):
-                try:
-                    if classname in line.split('(')[1]:
-                        yield idx
-                except:
-                    pass
+                if not classes.isdisjoint(self.index.get_bases(line)):
+                    yield idx
 
     def find_string(self, code, string):
         """Find a string into a source code.
@@ -1482,23 +1871,24 @@ class PyQt4ToPyQt5(object):
         Args:
         lines -- source code
         """
-        for idx, line in enumerate(lines):
-            if not self.is_code_line(line) or not 'qApp' in line:
-                continue
+        self.fix_lines(lines, [self.qApp_line])
 
-            if line.lstrip().startswith(('import ', 'from ')):
-                line = self.replace_module(line, 'qApp', 'QApplication')
+    def qApp_line(self, line):
+        if not 'qApp' in line or not self.is_code_line(line):
+            return line
 
-            else:
-                # use QtWidgets.qApp since this method is called after change_module_name
-                for func in QAPP_STATIC_METHODS:
-                    line = re.sub(r'(\A|[^a-zA-Z0-9_.\'"]|Qt\.|QtWidgets\.)qApp\.'+func+r'(\Z|[^a-zA-Z0-9_])',
-                                  r'\1QApplication.'+func+r'\2', line)
+        if line.lstrip().startswith(('import ', 'from ')):
+            return self.replace_module(line, 'qApp', 'QApplication')
 
-                line = re.sub(r'(\A|[^a-zA-Z0-9_.\'"]|Qt\.|QtWidgets\.)qApp(\Z|[^a-zA-Z0-9_])',
-                              r'\1QApplication.instance()\2', line)
+        # use QtWidgets.qApp since this method is called after change_module_name
+        if not QAPP_STATIC_RES:
+            QAPP_STATIC_RES.extend((re.compile(QAPP_PREFIX + r'\.' + func + r'(\Z|[^a-zA-Z0-9_])'),
+                                    r'\1QApplication.' + func + r'\2')
+                                   for func in QAPP_STATIC_METHODS)
+        for regex, repl in QAPP_STATIC_RES:
+            line = regex.sub(repl, line)
 
-            lines[idx] = line
+        return QAPP_RE.sub(r'\1QApplication.instance()\2', line)
 
     def replace_classnames(self, lines):
         """Rename some classe's names.
@@ -1509,15 +1899,15 @@ class PyQt4ToPyQt5(object):
         Args:
         lines -- source code
         """
+        self.fix_lines(lines, [self.classnames_line])
+
+    def classnames_line(self, line):
         # TODO: Convert this to use regular expressions like in replace_qApp above,
         #       so that only the appropriate instances of olds are converted.
-        olds = ['QMatrix', 'QIconEngineV2']
-        news = ['QTransform', 'QIconEngine']
-        for idx, line in enumerate(lines):
-            if self.is_code_line(line):
-                for old, new in zip(olds, news):
-                    line = line.replace(old, new)
-                    lines[idx] = line
+        if self.is_code_line(line):
+            for old, new in CLASSNAMES:
+                line = line.replace(old, new)
+        return line
 
     def is_code_line(self, line):
         """Returns True if a line is not empty, nor a comment, nor a docstring.
@@ -1713,20 +2103,66 @@ class PyQt4ToPyQt5(object):
                     lines[count] = indent + '_fromUtf8 = lambda s: s\n'
                     continue
 
-            line = line.replace("PyQt4.QtCore.QString.fromUtf8(", "_fromUtf8(")\
-                       .replace("PyQt4.Qt.QString.fromUtf8(", "_fromUtf8(")\
-                       .replace("QtCore.QString.fromUtf8(", "_fromUtf8(")\
-                       .replace("Qt.QString.fromUtf8(", "_fromUtf8(")\
-                       .replace("QString.fromUtf8(", "_fromUtf8(")
-            while True:
-                open_idx, close_idx = self.find_closing_parenthesis(line, '_fromUtf8')
-                if open_idx >= len(line):
-                    break
-                line = line[:open_idx-9] + line[open_idx+1:close_idx] + line[close_idx+1:]
-
-            lines[count] = line
+            if 'fromUtf8' in line:
+                lines[count] = self.strip_fromUtf8(line)
             count += 1
 
+    def strip_fromUtf8(self, line):
+        """Returns a line without its _fromUtf8() and QString.fromUtf8()
+        wrappers, all of them are removed in one scan of the tokens.
+
+        Args:
+        line -- one logical line of code
+        """
+        # Offset of each physical line into the logical line
+        starts = [0]
+        for physical in line.splitlines(True):
+            starts.append(starts[-1] + len(physical))
+
+        # The ranges to remove, in the order of the line
+        cuts = []
+        # True for each open parenthesis of a wrapper
+        stack = []
+        names, begin, prev, prev_typ = [], 0, None, None
+        tokens = tokenize.generate_tokens(StringIO(line).readline)
+        try:
+            for typ, st, bg, _, _ in tokens:
+                if typ in (tokenize.NL, tokenize.COMMENT):
+                    continue
+
+                pos = starts[bg[0]-1] + bg[1]
+                if typ == tokenize.NAME:
+                    if prev == '.' and names:
+                        names.append(st)
+                    else:
+                        names, begin = [st], pos
+
+                elif st == '(':
+                    wrapper = prev_typ == tokenize.NAME and tuple(names) in FROMUTF8_NAMES
+                    if wrapper:
+                        cuts.append((begin, pos+1))
+                    stack.append(wrapper)
+
+                elif st == ')' and stack:
+                    if stack.pop():
+                        cuts.append((pos, pos+1))
+
+                if typ != tokenize.NAME and st != '.':
+                    names = []
+                prev, prev_typ = st, typ
+        except tokenize.TokenError:
+            pass
+
+        if not cuts:
+            return line
+
+        parts, last = [], 0
+        for start, end in cuts:
+            parts.append(line[last:start])
+            last = end
+        parts.append(line[last:])
+        return ''.join(parts)
+
     def get_signal(self, strings):
         sig = strings.pop(0)
         for idx, s in enumerate(strings):
@@ -1765,25 +2201,7 @@ class PyQt4ToPyQt5(object):
         return slot.strip()
 
     def clean_signal_args(self, signal):
-        if self._pyqt5:
-            signal = signal.replace('const char*', 'str').replace('const char *', 'str')
-        else:
-            signal = signal.replace('const char*', 'const_char_star_arg')\
-                           .replace('const char *', 'const_char_space_star_arg')
-        signal = signal.replace(' const ', '').replace('const ', '')
-        signal = signal.replace(' * ', '').replace(' *', '').replace('* ', '').replace('*', '')
-        signal = signal.replace(' & ', '').replace(' &', '').replace('& ', '').replace('&', '')
-        signal = signal.replace("PyQt_PyObject", "'PyQt_PyObject'")
-        if self._pyqt5:
-            # TODO: Convert this to use regular expressions.
-            signal = signal.replace("PyQt4.QtCore.QString", "QString").replace("PyQt4.Qt.QString", "QString")\
-                           .replace("QtCore.QString", "QString").replace("Qt.QString", "QString")\
-                           .replace("QString", "'QString'").replace("'QString'List", "'QStringList'")\
-                           .replace("'QStringList'Model", "QStringListModel")
-        else:
-            signal = signal.replace('const_char_star_arg', '"const char*"')\
-                           .replace('const_char_space_star_arg', '"const char *"')
-        return signal
+        return clean_signal_args(signal, self._pyqt5)
 
     def clean_signal(self, signal):
         signal = self.clean_signal_args(signal)
@@ -1834,7 +2252,7 @@ class PyQt4ToPyQt5(object):
         Returns:
         list(lines)
         """
-        news = []
+        news = empty_like(lines)
         count = 0
         def set_qstandardpaths(txt):
             if self.modified['QStandardPaths']:
@@ -2201,11 +2619,46 @@ class PyQt4ToPyQt5(object):
 
         return strings
 
+    def encode_lines(self, lines):
+        """Yields the encoded content of the converted file by chunks.
+
+        Args:
+        lines -- the list of lines
+        """
+        encoder = getincrementalencoder(self.tools.encoding)()
+        for start in range_(0, len(lines), 4096):
+            chunk = ''.join(lines[start:start+4096]).replace('\n', L_SEP)
+            yield encoder.encode(chunk)
+        yield encoder.encode('', True)
+
     def save_changes(self, lines):
-        with open(self.dest, 'wb') as outf:
-            outf.write(''.join(lines).replace('\n', L_SEP).encode(self.tools.encoding))
+        self.write_output(self.encode_lines(lines))
+
+    def write_output(self, chunks):
+        """Write the converted file, or keep it in memory for an in memory
+        conversion.
+
+        Args:
+        chunks -- the encoded content
+        """
+        if self.data is not None:
+            self.output = b''.join(chunks)
+            return
 
+        # The source may be the destination and may be memory mapped, so the
+        # file is written aside then renamed
         mode = os.stat(self.source).st_mode
+        tmp = self.dest + '.pyqt5tmp'
+        with open(tmp, 'wb') as outf:
+            for chunk in chunks:
+                outf.write(chunk)
+
+        if hasattr(os, 'replace'):
+            os.replace(tmp, self.dest)
+        else:
+            if os.path.exists(self.dest):
+                os.remove(self.dest)
+            os.rename(tmp, self.dest)
         os.chmod(self.dest, mode)
 
     def print_(self, msg):
@@ -2298,7 +2751,7 @@ class Tools(object):
         return default
 
     def find_comment(self, chain, bom):
-        comment = re.compile(r"coding[:=]\s*([-\w.]+)")
+        comment = CODING_RE
         try:
             string = chain.decode('ascii')
         except UnicodeDecodeError:
@@ -2336,12 +2789,57 @@ class Tools(object):
         return encoding
 
     def get_code_lines(self, filename):
-        count = 0
+        try:
+            if os.path.getsize(filename) >= MMAP_THRESHOLD:
+                lines = self.map_code_lines(filename)
+                if lines is not NotImplemented:
+                    return lines
+        except OSError:
+            pass
+
         source = self.read_python_source(filename)
         if source is None:
             # error reading input file
             return None
 
+        return self.split_logical_lines(source, filename)
+
+    def decode_code_lines(self, data):
+        """Returns the logical lines of a source code read in memory.
+
+        Args:
+        data -- the content of the file, bytes
+
+        Returns:
+        list(lines)
+        """
+        inf = BytesIO(data)
+        self.encoding = self.read_encoding([inf.readline(), inf.readline()])
+        if self.encoding is None:
+            self.last_error = 'Unknown encoding'
+            return None
+
+        try:
+            content = data.decode(self.encoding)
+        except UnicodeDecodeError as why:
+            self.last_error = why
+            return None
+
+        # Same newlines as the universal newlines mode
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+        return self.split_logical_lines(content.split('\n'), None,
+                                        StringIO(content).readline)
+
+    def split_logical_lines(self, source, filename, readline=None):
+        """Join the physical lines of a source code into logical lines.
+
+        Args:
+        source -- the list of physical lines, without newline
+        filename -- the file name
+        readline -- the function which reads the file, see
+                    get_num_physical_lines()
+        """
+        count = 0
         if not source[-1]:
             source.pop()
 
@@ -2350,9 +2848,15 @@ class Tools(object):
             #return None
             return []
 
+        if any(UIC_HEADER_RE.match(l.lstrip()) for l in source[:12]):
+            # pyuic4 writes one statement by line, no need to tokenize
+            lines = self.split_simple_lines(source)
+            if lines is not None:
+                return lines
+
         orig = ['%s\n' % l for l in source]
         lines = []
-        gen = self.get_num_physical_lines(filename)
+        gen = self.get_num_physical_lines(filename, readline)
         while 1:
             try:
                 num = next(gen)
@@ -2365,18 +2869,109 @@ class Tools(object):
 
         return lines
 
-    def get_num_physical_lines(self, filename):
+    def split_simple_lines(self, source):
+        """Returns the logical lines of a source code where each physical
+        line is a logical line, as split_logical_lines() would do, or None
+        if a statement continues on the next line.
+
+        Args:
+        source -- the list of physical lines, without newline
+        """
+        for line in source:
+            if '"""' in line or "'''" in line:
+                return None
+
+            code = line
+            if '"' in code or "'" in code:
+                code = STRING_RE.sub('', code)
+            code = code.split('#', 1)[0]
+            if '"' in code or "'" in code or code.rstrip().endswith('\\'):
+                return None
+
+            if (code.count('(') != code.count(')') or code.count('[') != code.count(']')
+                    or code.count('{') != code.count('}')):
+                return None
+
+        return ['%s\n' % l for l in source] + ['']
+
+    def map_code_lines(self, filename):
+        """Returns the logical lines of a large file as MappedLines.
+
+        The file is tokenized once from a memory map and only the offsets of
+        the logical lines are kept.
+
+        Args:
+        filename -- the file name
+
+        Returns:
+        MappedLines, None if the file can't be read or NotImplemented if it
+        must be read as text
+        """
+        self.encoding = self.get_encoding(filename)
+        if self.encoding is None:
+            return None
+
+        import mmap
+        try:
+            with open(filename, 'rb') as inf:
+                mm = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return NotImplemented
+
+        if LONE_CR_RE.search(mm) is not None:
+            # Old Mac newlines are handled by the universal newlines mode
+            mm.close()
+            return NotImplemented
+
+        codec = self.encoding
+        start = 0
+        if codec.endswith('-sig'):
+            codec = codec[:-4]
+            start = len(BOM_UTF8) if mm[:len(BOM_UTF8)] == BOM_UTF8 else 0
+
+        # The offset of the beginning of each physical line
+        rows = array('l', [start])
+        mm.seek(start)
+        def readline():
+            line = mm.readline()
+            if not line:
+                return ''
+            rows.append(mm.tell())
+            return line.decode(codec).replace('\r\n', '\n')
+
+        offsets = array('l', [start])
+        gen = self.get_num_physical_lines(filename, readline)
+        try:
+            for num in gen:
+                if not num:
+                    return False
+                offsets.append(rows[min(num, len(rows) - 1)])
+        except UnicodeDecodeError as why:
+            self.last_error = why
+            return None
+
+        if len(offsets) == 1:
+            return []
+
+        return MappedLines(mm, offsets, codec)
+
+    def get_num_physical_lines(self, filename, readline=None):
         """Returns the line nummer where a logical line ends.
 
         The converter works with a list of logical lines, not physical lines.
 
         Args:
         filename -- the file name
+        readline -- the function which reads the file, by default the file
+                    is opened
 
         Returns:
         int(lineno)
         """
-        if PY_VERS < 3:
+        if readline is not None:
+            inf = None
+            src = readline
+        elif PY_VERS < 3:
             inf = open_(filename, "r", encoding=self.encoding)
             src = inf.readline
         else:
@@ -2423,18 +3018,526 @@ class Tools(object):
                 else:
                     new = False
 
+        except UnicodeDecodeError:
+            raise
+
         except Exception as why:
             sys.stdout.write('Except: %s\nLine: %s\n%s' %(why, end, ln))
             self.last_error = why
             yield False
 
         finally:
-            inf.close()
+            if inf is not None:
+                inf.close()
+
+
+class MappedLine(str):
+    """A line read from MappedLines, which remembers where it comes from."""
+    pass
+
+
+class MappedLines(object):
+    """The list of the logical lines of a file read through a memory map.
+
+    Only the offsets of the logical lines are kept.  A line is decoded each
+    time it is read and stored only when it is modified or inserted, so the
+    memory used by a large generated module stays close to its size.
+
+    Args:
+    mm -- the memory map of the file
+    offsets -- the offsets of the logical lines followed by the end offset
+    codec -- the encoding of the file
+    """
+    def __init__(self, mm, offsets, codec, items=None):
+        self._mm = mm
+        self._offsets = offsets
+        self._codec = codec
+        # Either the number of a mapped line or a str
+        if items is None:
+            items = list(range_(len(offsets) - 1))
+        self._items = items
+
+    def new_like(self):
+        return MappedLines(self._mm, self._offsets, self._codec, [])
+
+    def _decode(self, num):
+        text = self._mm[self._offsets[num]:self._offsets[num+1]].decode(self._codec)
+        text = text.replace('\r\n', '\n')
+        if text and not text.endswith('\n'):
+            # Last line without newline
+            text += '\n'
+        line = MappedLine(text)
+        line.owner = self._mm
+        line.num = num
+        return line
+
+    def _get(self, item):
+        if isinstance(item, int):
+            return self._decode(item)
+
+        return item
+
+    def _store(self, value):
+        if isinstance(value, MappedLine) and value.owner is self._mm:
+            # Unchanged line, keep only its number
+            return value.num
+
+        return value
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        # Like a list iterator, follow the insertions made while iterating
+        idx = 0
+        while idx < len(self._items):
+            yield self._get(self._items[idx])
+            idx += 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._get(item) for item in self._items[idx]]
+
+        return self._get(self._items[idx])
+
+    def __setitem__(self, idx, value):
+        if isinstance(idx, slice):
+            self._items[idx] = [self._store(v) for v in value]
+        else:
+            self._items[idx] = self._store(value)
+
+    def __delitem__(self, idx):
+        del self._items[idx]
+
+    def insert(self, idx, value):
+        self._items.insert(idx, self._store(value))
+
+    def append(self, value):
+        self._items.append(self._store(value))
+
+    def pop(self, idx=-1):
+        return self._get(self._items.pop(idx))
+
+
+class ScopeIndex(object):
+    """Index of the classes and the functions of a file.
+
+    Built with one pass over the logical lines, it gives the class which
+    encloses a line, the end of a block and the signals declared at the top
+    of a class without scanning the file again for each occurrence.
+
+    The lines inserted by the fixers are counted into a Fenwick tree, the
+    positions indexed stay those of the first pass and are shifted when
+    they are read, so an insertion doesn't have to update the whole index.
+
+    Args:
+    lines -- the list of the logical lines
+    """
+    def __init__(self, lines):
+        # The code lines which contain 'class ', the rule of create_signal()
+        self.headers = []
+        # The class definitions
+        self.classes = []
+        # The first line after the block of each def and class
+        self.ends = {}
+        self.length = len(lines)
+        self._lines = lines
+        self._signals = {}
+        self._inserted = 0
+        self._tree = [0] * (self.length + 2)
+        stack = []
+        for pos, line in enumerate(lines):
+            stripped = line.lstrip()
+            if not stripped or stripped.startswith(('#', '"', "'")):
+                continue
+
+            indent = line[:len(line) - len(stripped)]
+            while stack and stack[-1][0] >= indent:
+                self.ends[stack.pop()[1]] = pos
+            if stripped.startswith(('def ', 'class ')):
+                stack.append((indent, pos))
+                if stripped.startswith('class '):
+                    self.classes.append(pos)
+            if 'class ' in line:
+                self.headers.append(pos)
+
+        for _, pos in stack:
+            self.ends[pos] = self.length
+
+    def position(self, pos):
+        """Returns the current position of a line of the first pass.
+
+        Args:
+        pos -- the position of the line when the index was built
+        """
+        idx = pos + 1
+        while idx > 0:
+            pos += self._tree[idx]
+            idx -= idx & -idx
+
+        return pos
+
+    def original(self, pos):
+        """Returns the first line of the first pass found from a current
+        position, the number of lines of the first pass if there's none.
+
+        Args:
+        pos -- the current position
+        """
+        if not self._inserted:
+            return pos
+
+        tree = self._tree
+        idx = shift = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            nxt = idx + step
+            if nxt < len(tree) and nxt - 1 + shift + tree[nxt] < pos:
+                idx = nxt
+                shift += tree[nxt]
+            step >>= 1
+
+        return idx
+
+    def _search(self, positions, pos):
+        # Number of the positions which are before or at `pos` currently
+        if not self._inserted:
+            return bisect_right(positions, pos)
+
+        low, high = 0, len(positions)
+        while low < high:
+            mid = (low + high) // 2
+            if self.position(positions[mid]) <= pos:
+                low = mid + 1
+            else:
+                high = mid
+
+        return low
+
+    def get_class(self, pos):
+        """Returns the position of the class header which precedes a line or
+        None.
+
+        Args:
+        pos -- the position of the line
+        """
+        idx = self._search(self.headers, pos)
+        if idx:
+            return self.position(self.headers[idx-1])
+
+        return None
+
+    def next_class(self, pos):
+        """Returns the position of the first class definition from a line, the
+        number of lines if there's none.
+
+        Args:
+        pos -- the position of the line
+        """
+        idx = self._search(self.classes, pos - 1)
+        if idx < len(self.classes):
+            return self.position(self.classes[idx])
+
+        return self.length
+
+    def get_end(self, pos):
+        """Returns the position of the first line after a block.
+
+        Args:
+        pos -- the position of the def or class line
+        """
+        orig = self.original(pos)
+        if orig in self.ends and self.position(orig) == pos:
+            return self.position(self.ends[orig])
+
+        # Not a block indexed, i.e. a line inserted
+        line = self._lines[pos]
+        indent = line[:len(line) - len(line.lstrip())]
+        for idx in range_(pos + 1, self.length):
+            line = self._lines[idx]
+            stripped = line.lstrip()
+            if stripped and not stripped.startswith(('#', '"', "'")) \
+                    and line[:len(line) - len(stripped)] <= indent:
+                return idx
+
+        return self.length
+
+    def signals(self, header):
+        """Returns the set of the names of the signals declared after a class
+        header, the set is updated by the caller when it adds a signal.
+
+        Args:
+        header -- the position of the class header
+        """
+        orig = self.original(header)
+        try:
+            return self._signals[orig]
+        except KeyError:
+            pass
+
+        names = set()
+        for idx in range_(header + 1, self.length):
+            line = self._lines[idx]
+            stripped = line.lstrip()
+            if not stripped or stripped.startswith(('#', '"', "'")):
+                continue
+
+            if 'pyqtSignal' not in line:
+                break
+
+            match = SIGDECL_RE.match(stripped)
+            if match is not None:
+                names.add(match.group(1))
+
+        self._signals[orig] = names
+        return names
+
+    def insert(self, pos, count=1):
+        """Count lines inserted, the lines which follow are shifted.
+
+        Args:
+        pos -- the current position of the first line inserted
+        count -- the number of lines inserted
+        """
+        idx = self.original(pos) + 1
+        while idx < len(self._tree):
+            self._tree[idx] += count
+            idx += idx & -idx
+        self._inserted += count
+        self.length += count
+
+
+class SymbolIndex(object):
+    """Project-wide index of the names used by the heuristic fixers.
+
+    The index is filled in two phases: the map phase extracts the facts of
+    each file (see scan()), eventually into worker processes, and the reduce
+    phase merges them into sets.  The fixers query the index instead of
+    scanning again the whole file for each occurrence.
+    """
+    def __init__(self):
+        self.files = {}
+        self.bases = {}
+        self.children = {}
+        self.signals = {}
+        self.exported = dict((kind, set()) for kind in INDEX_KINDS)
+        self._subclasses = {}
+
+    def build(self, files, jobs=1, tracer=None):
+        """Index a list of files.
+
+        Args:
+        files -- the list of file names or of tuples (file name, key)
+        jobs -- the number of worker processes
+        tracer -- the tracing.Tracer which records a span per file
+        """
+        if jobs > 1 and len(files) > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(jobs)
+            try:
+                chunk = max(1, len(files) // (jobs * 4))
+                for path, facts, span in pool.imap_unordered(index_file, files, chunk):
+                    self.reduce(path, facts, span, tracer)
+            finally:
+                pool.close()
+                pool.join()
+            return
+
+        for f in files:
+            self.reduce(*index_file(f), tracer=tracer)
+
+    def reduce(self, path, facts, span, tracer=None):
+        if facts is not None:
+            self.add(path, facts)
+        if tracer is not None:
+            pid, start, end = span
+            tracer.add('index', 'index', start, end, pid, {'file': path})
+
+    def add(self, path, facts):
+        """Reduce phase, merge the facts of one file into the index.
+
+        Args:
+        path -- the file name
+        facts -- the dict returned by scan()
+        """
+        self.files[path] = dict((kind, set(facts[kind])) for kind in INDEX_KINDS)
+        for kind in INDEX_KINDS:
+            self.exported[kind].update(facts['exported'][kind])
+
+        for name, bases, signals in facts['classes']:
+            self.bases.setdefault(name, set()).update(bases)
+            self.signals.setdefault(name, set()).update(signals)
+            for base in bases:
+                self.children.setdefault(base, set()).add(name)
+
+        self._subclasses = {}
+
+    def has(self, path):
+        return path in self.files
+
+    def names(self, path, kind):
+        """Returns the references of a kind known into a file.
+
+        These are the names defined into the file plus the names defined at
+        the module level into the other files of the project.
+
+        Args:
+        path -- the file name
+        kind -- one of INDEX_KINDS
+        """
+        try:
+            return self.files[path][kind] | self.exported[kind]
+        except KeyError:
+            return self.exported[kind]
+
+    def subclasses(self, classname):
+        """Returns the names of the classes which inherit, directly or not,
+        a class, the class itself included.
+
+        Args:
+        classname -- the name of the subclassed class
+        """
+        if classname not in self._subclasses:
+            found = set([classname])
+            todo = [classname]
+            while todo:
+                for child in self.children.get(todo.pop(), ()):
+                    if child not in found:
+                        found.add(child)
+                        todo.append(child)
+            self._subclasses[classname] = frozenset(found)
+
+        return self._subclasses[classname]
+
+    def class_signals(self, classname):
+        """Returns the names of the pyqtSignal declared into a class or into
+        its ancestors.
+
+        Args:
+        classname -- the name of the class
+        """
+        signals = set()
+        seen = set()
+        todo = [classname]
+        while todo:
+            name = todo.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            signals.update(self.signals.get(name, ()))
+            todo.extend(self.bases.get(name, ()))
+
+        return signals
+
+    @staticmethod
+    def scan(lines):
+        """Extract the facts of a source code.
+
+        Args:
+        lines -- the list of logical lines
+
+        Returns:
+        dict(facts) with the keys INDEX_KINDS, `exported` and `classes`
+        """
+        facts = dict((kind, []) for kind in INDEX_KINDS)
+        facts['exported'] = dict((kind, []) for kind in INDEX_KINDS)
+        facts['classes'] = []
+        # (indentation, class entry or None for a function)
+        stack = []
+        for line in lines:
+            if not is_code(line):
+                continue
+
+            stripped = line.lstrip()
+            depth = len(line) - len(stripped)
+            while stack and stack[-1][0] >= depth:
+                stack.pop()
+
+            if stripped.startswith('class '):
+                name = CLS_RE.search(stripped)
+                if name is not None:
+                    entry = (name.group(0).strip(), SymbolIndex.get_bases(stripped), [])
+                    facts['classes'].append(entry)
+                    stack.append((depth, entry))
+                continue
+
+            if stripped.startswith('def '):
+                stack.append((depth, None))
+                continue
+
+            if stack and stack[-1][1] is not None and 'pyqtSignal(' in stripped:
+                match = SIGDECL_RE.match(stripped)
+                if match is not None:
+                    stack[-1][1][2].append(match.group(1))
+
+            for kind, ref in SymbolIndex.get_references(stripped):
+                facts[kind].append(ref)
+                if not depth and ref.replace('_', 'a').isalnum():
+                    # Module level name, may be imported by other modules
+                    facts['exported'][kind].append(ref)
+
+        return facts
+
+    @staticmethod
+    def get_bases(line):
+        """Returns the names of the base classes of a class definition line.
+
+        Args:
+        line -- the class's definition line code
+        """
+        try:
+            chain = line.split('(', 1)[1].rsplit(')', 1)[0]
+        except IndexError:
+            return []
+
+        bases = []
+        for base in chain.replace('\\', '').split(','):
+            base = base.strip()
+            if base and '=' not in base:
+                bases.append(base.split('.')[-1])
+
+        return bases
+
+    @staticmethod
+    def get_references(line):
+        """Yields the layouts, QDates, QHeaderViews and QDesktopServices
+        assigned into a line.
+
+        Args:
+        line -- the line code, without indentation
+        """
+        if 'Layout(' in line:
+            match = LAYOUT_RE.search(line)
+            if match is not None:
+                name = match.group(3)
+                if name and name.endswith(('QGrid', 'QVBox', 'QHBox')):
+                    yield 'layouts', match.group(1).strip()
+
+        if 'QDate(' in line:
+            match = DATE_RE.search(line)
+            if match is not None:
+                yield 'dates', match.group(1).strip()
+
+        if '.horizontalHeader()' in line or '.verticalHeader()' in line:
+            refs = line.split('=')
+            if len(refs) == 2:
+                yield 'headers', refs[0].strip()
+
+        if 'QDesktopServices' in line:
+            match = DSK_RE.search(line)
+            if match is not None:
+                yield 'dsks', match.group(1).strip()
 
 
 class Main(object):
     def __init__(self, args):
         self.copied = {}
+        # The copies to convert, the single list of files used by the run
+        self.files = []
+        # The copies left as is since converted by the run to resume
+        self.skipped = set()
+        # All the files found, converted or not by this run
+        self.candidates = []
         self.path = None
         self.nosubdir = False
         self.followlinks = False
@@ -2443,13 +3546,33 @@ class Main(object):
         self.write_diffs = False
         self.filename_diff = False
         self.nopyqt5 = False
+        self.jobs = 1
+        self.ledger = None
+        self.resume = False
+        self.shard = None
+        self.shard_by_size = False
+        self.since = None
+        self.excludes = []
+        self.gitignore = False
+        self.report_progress = False
+        # The Progress of the run, created by begin_run() with --progress
+        self.progress = None
+        self.tracer = None
+        self.memprofiler = None
+        self.timeout = None
+        self.watchdog = None
+        # The files stopped by the watchdog
+        self.timeouts = []
+        # The fixers run, built-in and plugins, see rules.get_rules()
+        self.rules = None
+        import argparse
         parser = argparse.ArgumentParser(description='Convert a source code '
                         'written for PyQt4 into a valid code for PyQt5')
         parser.add_argument("path",
                         help="Path of a file or a directory.\nThe file may be "
-                        "a source code python or a text file wich contains the "
-                        "names of the files to be converted separated by a new "
-                        "line.")
+                        "a source code python, a tar or zip archive, or a text "
+                        "file wich contains the names of the files to be "
+                        "converted separated by a new line.")
         parser.add_argument("--nosubdir", action="store_true",
                         help="Don't process into sub-directories."
                         "  Default: False")
@@ -2457,7 +3580,9 @@ class Main(object):
                         help="Visit directories pointed to by symlinks."
                         "  Default: False")
         parser.add_argument("-o", nargs=1, help="The name of the generated "
-                        "file or directory if path is a directory."
+                        "file or directory if path is a directory.  An archive "
+                        "is converted into an archive of the format of its "
+                        "extension."
                         "  Default: path_PyQt5 (path_PyQt4 if --nopyqt5)")
         parser.add_argument("--diff", nargs='?', const='same_as',
                         help="Write a diff file. If there's more than one file "
@@ -2476,6 +3601,69 @@ class Main(object):
         parser.add_argument("--nopyqt5", action="store_true",
                         help="Only perform updates that are compatable with PyQt4."
                         "  Default: False")
+        parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes used to index the files "
+                        "before the conversion, 0 for one per CPU."
+                        "  Default: 1")
+        parser.add_argument("--ledger", nargs='?', const='pyqt4_to_pyqt5.ledger',
+                        help="Record the status, duration and FIXMEs of each "
+                        "file into a SQLite database.  Query it with "
+                        "`python -m pyqt4topyqt5.ledger`."
+                        "  Default: pyqt4_to_pyqt5.ledger")
+        parser.add_argument("--resume", action="store_true",
+                        help="Skip the files already converted by a previous "
+                        "run recorded into the ledger.  Implies --ledger."
+                        "  Default: False")
+        parser.add_argument("--shard", metavar='K/N',
+                        help="Convert only the K-th of N parts of the files, the "
+                        "files are assigned by hashing their relative path.  "
+                        "Merge the outputs with `python -m pyqt4topyqt5.shard`."
+                        "  Default: None")
+        parser.add_argument("--shard-by-size", action="store_true",
+                        help="Assign the files to the shards by balancing "
+                        "their sizes.  Default: False")
+        parser.add_argument("--since", metavar='REF',
+                        help="Convert only the files of the directory modified "
+                        "or added since the git revision REF, the other files "
+                        "of the destination are left as is."
+                        "  Default: None")
+        parser.add_argument("--exclude", action="append", default=[],
+                        metavar='PATTERN',
+                        help="Skip the files and dirs matching the glob "
+                        "PATTERN, written as a line of .gitignore.  May be "
+                        "repeated.  Default: None")
+        parser.add_argument("--gitignore", action="store_true",
+                        help="Skip the files and dirs ignored by the .gitignore "
+                        "files of the tree.  Default: False")
+        parser.add_argument("--progress", action="store_true",
+                        help="Report the progress, the throughput and a summary "
+                        "of the run on stderr.  Default: False")
+        parser.add_argument("--trace", metavar='FILE',
+                        help="Write the Chrome trace events of the stages of "
+                        "the conversion of each file into FILE, to be opened "
+                        "with chrome://tracing or Perfetto.  Default: None")
+        parser.add_argument("--memprofile", action="store_true",
+                        help="Record with tracemalloc the peak of memory of each "
+                        "file and of each stage of the conversion, then report "
+                        "the worst ones and the top allocation sites.  Slow, "
+                        "requires Python 3.9.  Default: False")
+        parser.add_argument("--timeout", type=float, metavar='SECONDS',
+                        help="Time budget of a file.  The files are converted "
+                        "into a worker process which is replaced when a file "
+                        "exceeds the budget, the file is then left unchanged "
+                        "with a FIXME.  Default: None")
+        parser.add_argument("--only", action="append", default=[], metavar='RULES',
+                        help="Run only these fixers, names separated by commas, "
+                        "i.e. fix_emit,fix_connect.  The imports are changed "
+                        "only if change_import_lines is given.  May be repeated."
+                        "  Default: all")
+        parser.add_argument("--skip", action="append", default=[], metavar='RULES',
+                        help="Don't run these fixers, names separated by commas."
+                        "  May be repeated.  Default: None")
+        parser.add_argument("--plugins", action="store_true",
+                        help="Run also the fixers of the installed plugins, the "
+                        "entry points of the group pyqt4topyqt5.rules."
+                        "  Default: False")
         arg = parser.parse_args()
 
         if arg.path:
@@ -2483,9 +3671,44 @@ class Main(object):
             if not self.path:
                 sys.exit()
 
+        if arg.since:
+            if not os.path.isdir(self.path):
+                parser.error('--since requires a directory')
+            self.since = arg.since
+
         if arg.nosubdir:
             self.nosubdir = True
 
+        self.excludes = arg.exclude
+        self.gitignore = arg.gitignore
+        self.report_progress = arg.progress
+        if arg.trace:
+            from .tracing import Tracer
+            self.tracer = Tracer()
+
+        if arg.timeout is not None:
+            if arg.timeout <= 0:
+                parser.error('--timeout must be positive')
+            if arg.memprofile:
+                parser.error("--memprofile can't be used with --timeout")
+            self.timeout = arg.timeout
+
+        if arg.memprofile:
+            try:
+                from .memprofile import MemProfiler
+                self.memprofiler = MemProfiler(self.tracer)
+            except (ImportError, RuntimeError) as why:
+                parser.error(str(why))
+
+        from .rules import get_rules
+        try:
+            self.rules = get_rules(self.split_names(arg.only), self.split_names(arg.skip),
+                                   arg.plugins)
+        except ValueError as why:
+            if not arg.plugins:
+                why = '%s, the fixers of the plugins require --plugins' % why
+            parser.error(str(why))
+
         if arg.followlinks:
             self.followlinks = True
 
@@ -2498,6 +3721,25 @@ class Main(object):
         if arg.nopyqt5:
             self.nopyqt5 = True
 
+        if arg.jobs < 1:
+            import multiprocessing
+            self.jobs = multiprocessing.cpu_count()
+        else:
+            self.jobs = arg.jobs
+
+        if arg.resume:
+            self.resume = True
+            if not arg.ledger:
+                arg.ledger = 'pyqt4_to_pyqt5.ledger'
+
+        if arg.shard:
+            from .shard import parse_shard
+            try:
+                self.shard = parse_shard(arg.shard)
+            except ValueError as why:
+                parser.error(str(why))
+            self.shard_by_size = arg.shard_by_size
+
         if arg.o:
             self.destdir = self.check_path(arg.o[0], True)
             if not self.destdir:
@@ -2509,10 +3751,43 @@ class Main(object):
             self.log = None
         else:
             self.log = 'pyqt4_to_pyqt4.log' if self.nopyqt5 else 'pyqt4_to_pyqt5.log'
+            if self.shard is not None:
+                self.log = self.log.replace('.log', '.%s-of-%s.log' % self.shard)
+            from datetime import datetime
             date = datetime.now().strftime("%A %d. %B %Y %H:%M")
             self.print_('**  %s  %s  **\nArgs: %s\n' % (self.log, date, sys.argv))
 
-        self.prepare_changes(self.followlinks)
+        # Opened once the arguments are checked
+        if arg.ledger:
+            from .ledger import Ledger
+            self.ledger = Ledger(arg.ledger)
+            self.ledger.begin(sys.argv)
+
+        try:
+            self.prepare_changes(self.followlinks)
+        finally:
+            if self.ledger is not None:
+                self.ledger.close()
+            if self.tracer is not None:
+                self.tracer.write(arg.trace)
+            if self.memprofiler is not None:
+                self.memprofiler.stop()
+                self.memprofiler.report()
+
+        if self.timeouts:
+            msg = 'Stopped after %gs, left unchanged with a FIXME:\n%s\n' % (
+                    self.timeout, ''.join('    %s\n' % f for f in self.timeouts))
+            sys.stdout.write(msg)
+            self.print_(msg)
+
+    def split_names(self, values):
+        """Returns the names given to an option repeated and separated by
+        commas.
+
+        Args:
+        values -- the values of the option
+        """
+        return [n.strip() for v in values for n in v.split(',') if n.strip()]
 
     def is_python_file(self, path):
         """Checks if the given path is a Python file or not.
@@ -2524,31 +3799,17 @@ class Main(object):
         bool -- True if the path is a Python file and False otherwise
         """
 
-        # check if file is a regular file
-        mode = os.stat(path).st_mode
-        if not stat.S_ISREG(mode):
-            return False
-
-        # check if file has a Python extension
-        ext = os.path.splitext(path)[1]
-        if ext in PYEXT:
-            return True
-
-        # check if file is executable and contains a Python shebang
-        if mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH):
-            try:
-                with open(path, 'r') as inf:
-                    line = inf.readline().strip()
-                    if line in PYSHEBANG:
-                        return True
-            except UnicodeDecodeError:
-                return False
-        return False
+        from .discover import is_python
+        return is_python(path, os.stat(path).st_mode)
 
     def prepare_changes(self, followlinks=False):
         ver = "PyQt4" if self.nopyqt5 else "PyQt5"
 
-        if os.path.isdir(self.path):
+        from .archive import is_archive
+        if os.path.isfile(self.path) and is_archive(self.path):
+            self.convert_archive(ver)
+
+        elif os.path.isdir(self.path):
             if self.destdir == self.path:
                 self.destdir = self.path + "_" + ver
 
@@ -2574,48 +3835,310 @@ class Main(object):
 
                 if self.write_diff:
                     self.set_diff_option('file')
-                cnv = PyQt4ToPyQt5(self.path, self.destdir, self.log, self.nopyqt5)
-                cnv.setup()
-                self.write_diff_file(self.destdir, self.path)
+                if self.resume and self.ledger.is_done(self.destdir, self.path):
+                    return
+                if not self.select_shard([self.path], os.path.dirname(self.path)):
+                    return
+                self.begin_run(1)
+                try:
+                    self.convert_file(self.path, self.destdir, self.path)
+                finally:
+                    self.end_run()
+
+    def convert_archive(self, ver):
+        """Convert a tar or zip archive into an archive."""
+        from .archive import ArchiveConverter, default_dest, is_archive
+        if self.destdir == self.path:
+            self.destdir = default_dest(self.path, ver)
+
+        elif not is_archive(self.destdir):
+            sys.stdout.write('The destination of an archive must be a .tar(.gz, '
+                             '.xz, .bz2) or .zip file: `%s`\n' % self.destdir)
+            sys.exit()
+
+        ArchiveConverter(self, self.path, self.destdir).convert()
 
     def process_from_dir(self, fld, followlinks=False):
         self.print_('Beginning into: %s\n' % fld)
-        for root, _, files in os.walk(fld, followlinks=followlinks):
-            files.sort()
-            for f in files:
-                fname = os.path.join(root, f)
-                cnv = PyQt4ToPyQt5(fname, fname, self.log, self.nopyqt5)
-                cnv.setup()
-                self.write_diff_file(fname)
+        # The copies, sorted as a walk of the destination
+        from .shard import walk_order
+        fnames = sorted(self.files, key=lambda f: walk_order(os.path.relpath(f, fld)))
+
+        # The originals of all the files are indexed, even those skipped by
+        # --shard or --resume, to keep the cross-module facts
+        index = SymbolIndex()
+        index.build([(src, cp) for cp, src in self.candidates] or fnames, self.jobs,
+                    self.tracer)
+        fnames = [f for f in fnames if f not in self.skipped]
+        self.begin_run(len(fnames), index)
+        try:
+            for fname in fnames:
+                self.convert_file(fname, fname, self.copied.get(fname), index)
+        finally:
+            self.end_run()
+
+    def convert_file(self, source, dest, orig, index=None):
+        """Convert one file and write its diff.
+
+        Args:
+        source -- the file to read
+        dest -- the file to write
+        orig -- the original file, None if unknown
+        index -- the SymbolIndex of the project
+        """
+        start = time.time()
+        self.begin_file(source)
+        try:
+            cnv = self.run_converter(source, dest, index)
+        except Exception as why:
+            self.record(dest, orig, 'failed', time.time() - start, error=why)
+            self.end_file(source, None, start)
+            raise
+
+        if cnv.status == 'timeout':
+            from .watchdog import write_timed_out
+            write_timed_out(orig or source, dest, self.timeout)
+        self.record(dest, orig, cnv.status, time.time() - start, cnv.fixmes, cnv.error)
+        if self.tracer is not None:
+            with self.tracer.span('write_diff_file', 'diff'):
+                self.write_diff_file(dest, orig)
+        else:
+            self.write_diff_file(dest, orig)
+        self.end_file(source, cnv, start)
+
+    def run_converter(self, source, dest, index=None, data=None):
+        """Convert a file into this process, or into the worker of the
+        watchdog with --timeout.  Returns the PyQt4ToPyQt5 instance or the
+        watchdog.Result.
+
+        Args:
+        source -- the file to read
+        dest -- the file to write
+        index -- the SymbolIndex of the project
+        data -- the content of the file for an in memory conversion
+        """
+        if self.watchdog is None:
+            cnv = PyQt4ToPyQt5(source, dest, self.log, self.nopyqt5, index, data,
+                               self.get_tracer(), self.rules)
+            cnv.setup()
+            return cnv
+
+        cnv = self.watchdog.convert(source, dest, data)
+        SIGNATURES.add_counts(*cnv.signatures)
+        if self.tracer is not None:
+            self.tracer.merge(cnv.events)
+        if cnv.exception is not None:
+            raise RuntimeError('Unable to convert `%s`\n%s' % (source, cnv.exception))
+        if cnv.status == 'timeout':
+            self.timeouts.append(source)
+            msg = '  Stopped after %gs, file left unchanged with a FIXME.\n' % self.timeout
+            sys.stdout.write(msg + '\n')
+            self.print_(msg)
+        return cnv
+
+    def get_tracer(self):
+        """Returns the object which instruments the converters, None if
+        neither --trace nor --memprofile is used.
+        """
+        return self.memprofiler or self.tracer
+
+    def begin_file(self, source):
+        if self.progress is not None:
+            self.progress.begin(source)
+        if self.memprofiler is not None:
+            self.memprofiler.begin(source)
+
+    def end_file(self, source, cnv, start, size=None):
+        """Count a converted file into the reports of --progress, --trace
+        and --memprofile.
+
+        Args:
+        source -- the file
+        cnv -- its PyQt4ToPyQt5 instance, None if it raised an exception
+        start -- the beginning of the conversion
+        size -- its size, None to read it from the file
+        """
+        if self.memprofiler is not None:
+            self.memprofiler.end(source)
+
+        status = getattr(cnv, 'status', None) or 'failed'
+        lines = getattr(cnv, 'num_lines', 0)
+        fixmes = getattr(cnv, 'fixmes', 0)
+        if self.tracer is not None:
+            self.tracer.add(os.path.basename(source), 'file', start, time.time(),
+                            args={'file': source, 'status': status,
+                                  'lines': lines, 'fixmes': fixmes})
+
+        if self.progress is not None:
+            if size is None:
+                try:
+                    size = os.path.getsize(source)
+                except OSError:
+                    size = 0
+            self.progress.end(source, status, size, lines, fixmes)
+
+    def begin_run(self, total, index=None):
+        """Start the report of --progress and the watchdog of --timeout.
+
+        Args:
+        total -- the number of files to convert
+        index -- the SymbolIndex given to the worker of the watchdog
+        """
+        if self.report_progress:
+            from .progress import Progress
+            self.progress = Progress(total)
+            self.progress.start()
+
+        if self.timeout is not None:
+            from .watchdog import Watchdog
+            self.watchdog = Watchdog(self.timeout, self.log, self.nopyqt5, index,
+                                     self.tracer is not None, self.rules)
+
+    def end_run(self):
+        if self.watchdog is not None:
+            self.watchdog.close()
+            self.watchdog = None
+        report = None
+        if SIGNATURES.hits or SIGNATURES.misses:
+            report = SIGNATURES.report()
+            self.print_(report)
+        if self.progress is not None:
+            self.progress.close()
+            self.progress = None
+            if report is not None:
+                sys.stderr.write(report + '\n')
+
+    def record(self, dest, orig, status, duration, fixmes=0, error=''):
+        if self.ledger is not None:
+            self.ledger.record(dest, orig or dest, status, duration, fixmes, error)
 
     def copy_dir(self, dest, orig, followlinks=False):
         self.copied = {}
+        self.files = []
+        self.candidates = []
         try:
-            os.makedirs(dest)
+            if not ((self.resume or self.since) and os.path.isdir(dest)):
+                os.makedirs(dest)
         except Exception as why:
             sys.stdout.write("Can't create the dir: `%s`\nReason: %s\n" % (dest, why))
             sys.exit()
 
+        if self.since is not None:
+            self.copy_changed_files(dest, orig)
+            return
+
+        ignore = self.get_ignore(orig)
         if self.nosubdir:
+            import glob
             files = glob.glob(os.path.join(orig, '*.py'))
-            for f in files:
-                shutil.copy(f, dest)
-                self.copied[dest] = f
+            if ignore is not None:
+                files = [f for f in files if not ignore.excluded(f)]
+            self.candidates = [(os.path.join(dest, os.path.basename(f)), f) for f in files]
+            for f in self.select_shard(files, orig):
+                cp = os.path.join(dest, os.path.basename(f))
+                self.copy_file(f, cp)
             return
 
-        for root, dirs, files in os.walk(orig, followlinks=followlinks):
-            dirs[:] = [d for d in dirs if d not in ('__pycache__', '.git')]
-
+        from .discover import walk
+        pairs = []
+        for root, dirs, files in walk(orig, followlinks, ignore):
             target = root.replace(orig, dest)
             for name in dirs:
-                os.makedirs(os.path.join(target, name))
+                path = os.path.join(target, name)
+                if not (self.resume and os.path.isdir(path)):
+                    os.makedirs(path)
 
             for name in files:
-                src = os.path.join(root, name)
-                if self.is_python_file(src):
-                    cp = os.path.join(target, name)
-                    shutil.copy(src, cp)
-                    self.copied[cp] = src
+                pairs.append((os.path.join(root, name), os.path.join(target, name)))
+
+        self.candidates = [(cp, src) for src, cp in pairs]
+        for src, cp in self.select_shard(pairs, orig):
+            self.copy_file(src, cp)
+
+    def copy_changed_files(self, dest, orig):
+        """Copy the files modified since the revision given by --since.
+
+        Args:
+        dest -- the destination dir
+        orig -- the original dir
+        """
+        from .vcs import changed_files, work_tree_files
+        try:
+            changed = set(changed_files(orig, self.since))
+            files = work_tree_files(orig)
+        except ValueError as why:
+            sys.stdout.write("Can't list the files changed since `%s`\nReason: %s\n"
+                             % (self.since, why))
+            sys.exit()
+
+        # The unchanged files are still indexed to keep the cross-module facts
+        ignore = self.get_ignore(orig)
+        pairs = []
+        for src in files:
+            rel = os.path.relpath(src, orig)
+            if self.nosubdir and os.path.dirname(rel):
+                continue
+            if ignore is not None and ignore.excluded(src):
+                continue
+            if os.path.isfile(src) and self.is_python_file(src):
+                pairs.append((src, os.path.join(dest, rel)))
+
+        self.candidates = [(cp, src) for src, cp in pairs]
+        pairs = [(src, cp) for src, cp in pairs if src in changed]
+        for src, cp in self.select_shard(pairs, orig):
+            target = os.path.dirname(cp)
+            if not os.path.isdir(target):
+                os.makedirs(target)
+            self.copy_file(src, cp)
+
+    def get_ignore(self, root):
+        """Returns the Ignore instance given by --exclude and --gitignore,
+        None if nothing is excluded.
+
+        Args:
+        root -- the top dir
+        """
+        if not (self.excludes or self.gitignore):
+            return None
+
+        from .discover import Ignore
+        return Ignore(root, self.excludes, self.gitignore)
+
+    def select_shard(self, items, root):
+        """Returns the files to convert by this shard.
+
+        Args:
+        items -- the list of files or of tuples (file, copy)
+        root -- the dir relative to which the files are hashed
+        """
+        if self.shard is None:
+            return items
+
+        from .shard import select
+        files = [i[0] if isinstance(i, tuple) else i for i in items]
+        keys = [os.path.relpath(f, root) for f in files]
+        sizes = None
+        if self.shard_by_size:
+            sizes = [os.path.getsize(f) for f in files]
+
+        return select(items, keys, self.shard[0], self.shard[1], sizes)
+
+    def copy_file(self, src, cp):
+        """Copy a file to convert, except if it has already been converted
+        by the run to resume.
+
+        Args:
+        src -- the original file
+        cp -- the copy
+        """
+        self.copied[cp] = src
+        self.files.append(cp)
+        if self.resume and self.ledger.is_done(cp, src):
+            self.skipped.add(cp)
+            return
+
+        import shutil
+        shutil.copy(src, cp)
 
     def read_filenames(self, path):
         try:
@@ -2638,6 +4161,9 @@ class Main(object):
 
     def copy_files(self, dest, dirs, files):
         self.copied = {}
+        self.files = []
+        self.candidates = [(os.path.join(dest, os.path.basename(f)), f)
+                           for f in files if os.path.isfile(f)]
         if not os.path.exists(dest):
             try:
                 os.makedirs(dest)
@@ -2645,13 +4171,12 @@ class Main(object):
                 sys.stdout.write("Can't create the dir: `%s`\nReason: %s\n" % (dest, why))
                 sys.exit()
 
-        for f in files:
+        for f in self.select_shard(files, os.getcwd()):
             if not os.path.isfile(f):
                 sys.stdout.write('File `%s` not found, ignored\n' % f)
                 continue
             cp = os.path.join(dest, os.path.basename(f))
-            shutil.copy(f, cp)
-            self.copied[cp] = f
+            self.copy_file(f, cp)
 
     def check_path(self, path, writable=False):
         if not os.path.isabs(path):
@@ -2736,6 +4261,7 @@ class Main(object):
         if orig is None:
             orig = self.copied[dest]
 
+        import subprocess
         cmd = ['diff', '-u', orig, dest]
         with open(diffname, 'a') as outf:
             reply = subprocess.Popen(cmd, stdout=subprocess.PIPE)
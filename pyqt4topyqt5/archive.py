@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of pyqt4topyqt5
+
+import os
+import io
+import stat
+import time
+import difflib
+import tarfile
+import zipfile
+
+from contextlib import closing
+from functools import partial
+
+from . import SymbolIndex, Tools, PYEXT, PYSHEBANG
+
+# Extension -> tarfile mode suffix, zip
+FORMATS = (('.tar.gz', 'gz'), ('.tgz', 'gz'),
+           ('.tar.xz', 'xz'), ('.txz', 'xz'),
+           ('.tar.bz2', 'bz2'), ('.tbz2', 'bz2'),
+           ('.tar', ''), ('.zip', 'zip'))
+
+
+def get_format(path):
+    """Returns the format of an archive, None if the path isn't an archive.
+
+    Args:
+    path -- the file name
+    """
+    lower = path.lower()
+    for ext, fmt in FORMATS:
+        if lower.endswith(ext):
+            return ext, fmt
+
+    return None
+
+
+def is_archive(path):
+    return get_format(path) is not None
+
+
+def default_dest(path, ver):
+    """Returns the name of the converted archive, i.e. foo_PyQt5.tar.gz
+
+    Args:
+    path -- the archive
+    ver -- PyQt4 or PyQt5
+    """
+    ext = get_format(path)[0]
+    return path[:-len(ext)] + '_' + ver + path[-len(ext):]
+
+
+def is_python_member(name, mode, head):
+    """Returns True if a member of an archive is a Python file.
+
+    Same rules as Main.is_python_file().
+
+    Args:
+    name -- the name of the member
+    mode -- its permissions
+    head -- a function which returns its first line
+    """
+    ext = os.path.splitext(name)[1]
+    if ext in PYEXT:
+        return True
+
+    if not ext and mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH):
+        try:
+            return head().decode('utf-8').strip() in PYSHEBANG
+        except UnicodeDecodeError:
+            return False
+
+    return False
+
+
+class Reader(object):
+    """Iterate over the members of a tar or zip archive.
+
+    The members are yielded as tuples (name, info, is_file, is_python) and
+    read() returns the content of a file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fmt = get_format(path)[1]
+        if self.fmt == 'zip':
+            self.arch = zipfile.ZipFile(path, 'r')
+        else:
+            self.arch = tarfile.open(path, 'r:*')
+
+    def members(self):
+        if self.fmt == 'zip':
+            for info in self.arch.infolist():
+                is_file = not info.filename.endswith('/')
+                mode = info.external_attr >> 16
+                head = partial(self.readline, info)
+                yield (info.filename, info, is_file,
+                       is_file and is_python_member(info.filename, mode, head))
+        else:
+            for info in self.arch.getmembers():
+                head = partial(self.readline, info)
+                yield (info.name, info, info.isfile(),
+                       info.isfile() and is_python_member(info.name, info.mode, head))
+
+    def readline(self, info):
+        """Returns the first line of a file, the member is closed.
+
+        Args:
+        info -- the ZipInfo or TarInfo of the file
+        """
+        with closing(self.open(info)) as f:
+            return f.readline()
+
+    def read(self, info):
+        if self.fmt == 'zip':
+            return self.arch.read(info)
+
+        return self.arch.extractfile(info).read()
+
+    def open(self, info):
+        if self.fmt == 'zip':
+            return self.arch.open(info)
+
+        return self.arch.extractfile(info)
+
+    def close(self):
+        self.arch.close()
+
+
+class Writer(object):
+    """Write the members of a tar or zip archive.
+
+    Args:
+    path -- the file name, its extension gives the format
+    """
+    def __init__(self, path):
+        self.fmt = get_format(path)[1]
+        if self.fmt == 'zip':
+            self.arch = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            self.arch = tarfile.open(path, 'w:' + self.fmt)
+
+    def add(self, info, data=None, fileobj=None):
+        """Add a member, converting its info if the formats differ.
+
+        Args:
+        info -- the TarInfo or ZipInfo of the original member
+        data -- the new content of a file
+        fileobj -- the original content to copy
+        """
+        if self.fmt == 'zip':
+            if not isinstance(info, zipfile.ZipInfo):
+                info = self.zipinfo(info)
+            if data is None and fileobj is not None:
+                data = fileobj.read()
+            self.arch.writestr(info, data if data is not None else b'')
+        else:
+            if not isinstance(info, tarfile.TarInfo):
+                info = self.tarinfo(info)
+            if data is not None:
+                info.size = len(data)
+                fileobj = io.BytesIO(data)
+            self.arch.addfile(info, fileobj)
+
+    def zipinfo(self, tinfo):
+        name = tinfo.name + ('/' if tinfo.isdir() else '')
+        info = zipfile.ZipInfo(name, time.localtime(tinfo.mtime)[:6])
+        info.external_attr = (tinfo.mode & 0xFFFF) << 16
+        info.compress_type = zipfile.ZIP_DEFLATED
+        return info
+
+    def tarinfo(self, zinfo):
+        info = tarfile.TarInfo(zinfo.filename.rstrip('/'))
+        info.mtime = time.mktime(zinfo.date_time + (0, 0, -1))
+        info.mode = (zinfo.external_attr >> 16) & 0o7777 or 0o644
+        if zinfo.filename.endswith('/'):
+            info.type = tarfile.DIRTYPE
+        else:
+            info.size = zinfo.file_size
+        return info
+
+    def close(self):
+        self.arch.close()
+
+
+class ArchiveConverter(object):
+    """Convert the Python files of an archive into a new archive.
+
+    The members are streamed from the source archive to the destination
+    without being extracted, the other members are copied byte for byte.
+
+    Args:
+    main -- the Main instance which gives the options
+    source -- the source archive
+    dest -- the converted archive
+    """
+    def __init__(self, main, source, dest):
+        self.main = main
+        self.source = source
+        self.dest = dest
+        self.diffs = []
+        # Number of Python members
+        self.count = 0
+
+    def key(self, name):
+        # Name of a member into the index and the messages
+        return '%s:%s' % (self.source, name)
+
+    def build_index(self, reader):
+        index = SymbolIndex()
+        for name, info, _, is_python in reader.members():
+            if is_python:
+                self.count += 1
+                lines = Tools().decode_code_lines(reader.read(info))
+                if lines:
+                    index.add(self.key(name), index.scan(lines))
+
+        return index
+
+    def convert(self):
+        main = self.main
+        main.print_('Beginning into: %s\n' % self.source)
+        reader = Reader(self.source)
+        try:
+            index = self.build_index(reader)
+            writer = Writer(self.dest)
+            main.begin_run(self.count, index)
+            try:
+                for name, info, is_file, is_python in reader.members():
+                    if not is_file:
+                        writer.add(info)
+                    elif not is_python:
+                        writer.add(info, fileobj=reader.open(info))
+                    else:
+                        writer.add(info, data=self.convert_member(name, reader.read(info), index))
+            finally:
+                main.end_run()
+                writer.close()
+        finally:
+            reader.close()
+
+        self.write_diff()
+
+    def convert_member(self, name, data, index):
+        """Returns the converted content of a Python member.
+
+        Args:
+        name -- the name of the member
+        data -- its content
+        index -- the SymbolIndex of the archive
+        """
+        key = self.key(name)
+        start = time.time()
+        self.main.begin_file(key)
+        cnv = self.main.run_converter(key, key, index, data)
+        self.main.record(key, self.source, cnv.status, time.time() - start,
+                         cnv.fixmes, cnv.error)
+        self.main.end_file(key, cnv, start, len(data))
+        if cnv.status == 'timeout':
+            from .watchdog import add_fixme_header
+            cnv.output = add_fixme_header(data, self.main.timeout)
+        if cnv.output is None:
+            return data
+
+        if self.main.write_diff or self.main.write_diffs:
+            # A watchdog.Result gives the encoding without the tools
+            encoding = getattr(cnv, 'encoding', None) or cnv.tools.encoding
+            self.add_diff(name, data, cnv.output, encoding)
+
+        return cnv.output
+
+    def add_diff(self, name, old, new, encoding):
+        try:
+            old = old.decode(encoding).splitlines(True)
+            new = new.decode(encoding).splitlines(True)
+        except UnicodeDecodeError:
+            return
+
+        self.diffs.extend(difflib.unified_diff(old, new, 'a/' + name, 'b/' + name))
+
+    def write_diff(self):
+        if not self.diffs:
+            return
+
+        diff = self.main.write_diff
+        if not diff or diff == 'same_as':
+            diff = self.dest[:-len(get_format(self.dest)[0])] + '.diff'
+        elif os.path.isdir(diff):
+            diff = os.path.join(diff, os.path.basename(self.dest) + '.diff')
+
+        with io.open(diff, 'a', encoding='utf-8') as outf:
+            for line in self.diffs:
+                if not line.endswith('\n'):
+                    line += '\n\\ No newline at end of file\n'
+                outf.write(line)
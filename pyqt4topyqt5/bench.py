@@ -0,0 +1,868 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of pyqt4topyqt5
+
+"""Benchmarks of the converter.
+
+    python -m pyqt4topyqt5.bench startup
+    python -m pyqt4topyqt5.bench e2e --files 2000
+    python -m pyqt4topyqt5.bench gate
+    python -m pyqt4topyqt5.bench scale --max-lines 1000000
+"""
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import compileall
+import tempfile
+import subprocess
+
+PY3 = sys.version_info[0] > 2
+
+# Time added by `import pyqt4topyqt5` to the startup of the interpreter
+STARTUP_TARGET = 0.025
+# Maximum time added by the conversion of one small file with the command
+# line, in seconds
+STARTUP_CLI_TARGET = 0.120
+
+# Regression accepted by the gate, as a share of the baseline
+GATE_THRESHOLD = 0.25
+# Smallest regression reported, in calibration units, below this the noise
+# of the fast fixers dominates
+GATE_MIN_DELTA = 1.0
+# Growth exponent accepted by the scaling benchmark, above it a stage isn't
+# linear in the length of the file
+SCALE_MAX_EXPONENT = 1.3
+# Times below this, in calibration units, are left out of the fit when a
+# stage has three longer times, a stage whose last time is below it is too
+# fast to be checked
+SCALE_MIN_TIME = 1.0
+BASELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'benchmarks', 'baseline.json')
+
+# Modules which must not be imported to convert a file without --plugins,
+# they read the entry points of all the installed distributions
+PLUGIN_MODULES = ('importlib.metadata', 'pkg_resources')
+# Modules which must not be imported to convert a file
+HEAVY_MODULES = ('argparse', 'subprocess', 'glob', 'shutil', 'multiprocessing',
+                 'datetime', 'sqlite3', 'mmap')
+
+
+PYQT4_HEADER = """#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+from PyQt4 import QtCore, QtGui
+from PyQt4 import QtDeclarative, QtOpenGL, QtScript, QtXml
+from PyQt4.QtCore import SIGNAL, SLOT, pyqtSignature
+
+try:
+    _fromUtf8 = QtCore.QString.fromUtf8
+except AttributeError:
+    _fromUtf8 = lambda s: s
+
+"""
+PYQT4_BLOCK = """
+class Window%(n)d(QtGui.QMainWindow):
+    def __init__(self, parent=None):
+        super(Window%(n)d, self).__init__(parent)
+        self.button = QtGui.QPushButton(_fromUtf8("Button %(n)d"), self)
+        self.connect(self.button, SIGNAL("clicked()"), self.on_click)
+        self.connect(self.spin, SIGNAL("valueChanged(int)"), self, SLOT("setValue(int)"))
+        self.layout = QtGui.QVBoxLayout(self)
+        self.layout.setMargin(%(n)d)
+        self.date = QtCore.QDate(2000, 1, 1)
+        self.date.setYMD(2001, 2, 3)
+        name = QtGui.QFileDialog.getOpenFileName(self, "Open")
+        self.emit(SIGNAL("finished(int)"), %(n)d)
+        t = self.trUtf8("x")
+
+    @pyqtSignature("QString")
+    def on_click(self, text):
+        item = QtGui.QGraphicsRectItem(0, 0, 10, 10, None, self.scene)
+        return text
+
+    @pyqtSignal("QString")
+    def refresh(self, path):
+        path = QtCore.QDir.convertSeparators(path)
+        size, ok = QtGui.QInputDialog.getInteger(self, "Size", "Size")
+        value = self.settings.value("size").toPyObject()
+        matrix = QtGui.QMatrix()
+        QtGui.qApp.processEvents()
+        self.header.setResizeMode(QtGui.QHeaderView.Stretch)
+        data = QtGui.QDesktopServices.storageLocation(QtGui.QDesktopServices.DataLocation)
+        char = QtCore.QChar(65)
+        QtCore.qInstallMsgHandler(self.handler)
+        self.anim = QtGui.QGraphicsItemAnimation()
+        self.view = QtOpenGL.QGLWidget(self)
+        engine = QtScript.QScriptEngine()
+        doc = QtXml.QDomDocument()
+        view = QtDeclarative.QDeclarativeView()
+        self.disconnect(self.button, SIGNAL("clicked()"), self.on_click)
+        return data
+
+    def wheelEvent(self, event):
+        self.zoom(event.delta() / 120)
+"""
+# One class which grows with the file, the worst case of the fixers which
+# look for the class of a line
+PYQT4_CLASS = """
+class Window(QtGui.QWidget):
+    def __init__(self, parent=None):
+        super(Window, self).__init__(parent)
+"""
+PYQT4_METHOD = """
+    def method_%(n)d(self, value):
+        self.emit(SIGNAL("changed%(m)d(int)"), value)
+        self.layout.setMargin(%(n)d)
+        label = QtGui.QLabel(_fromUtf8("Label %(n)d"), self)
+        return value
+"""
+PLAIN_HEADER = """# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+"""
+PLAIN_BLOCK = """
+def function_%(n)d(path, values):
+    total = 0
+    for value in values:
+        total += value * %(n)d
+    return os.path.join(path, str(total))
+"""
+NOISE_EXT = ('.txt', '.json', '.png', '.ui', '.qrc')
+
+
+def make_module(size, header, block):
+    """Returns a Python module of about size bytes.
+
+    Args:
+    size -- the size in bytes
+    header -- the beginning of the module
+    block -- the code repeated, formatted with its number
+    """
+    parts = [header]
+    length = len(header)
+    num = 0
+    while length < size:
+        part = block % {'n': num}
+        parts.append(part)
+        length += len(part)
+        num += 1
+
+    return ''.join(parts)
+
+
+def make_lines(num_lines, header, block):
+    """Returns a Python module of about num_lines lines.
+
+    Args:
+    num_lines -- the number of lines
+    header -- the beginning of the module
+    block -- the code repeated, formatted with its number n and n % 20
+    """
+    parts = [header]
+    length = header.count('\n')
+    num = 0
+    while length < num_lines:
+        part = block % {'n': num, 'm': num % 20}
+        parts.append(part)
+        length += part.count('\n')
+        num += 1
+
+    return ''.join(parts)
+
+
+def generate_tree(root, files=1000, median_size=8192, pyqt4_share=0.6,
+                  noise_share=0.2, per_dir=20, seed=0):
+    """Write a synthetic project, returns the number of bytes written.
+
+    The sizes follow a log-normal distribution, so a few files are much
+    larger than the median as in the real projects.
+
+    Args:
+    root -- the dir to create
+    files -- the number of files
+    median_size -- the median size of a file in bytes
+    pyqt4_share -- the share of the Python files which use PyQt4
+    noise_share -- the share of the files which aren't Python files
+    per_dir -- the number of files by dir
+    seed -- the seed of the random generator
+    """
+    rng = random.Random(seed)
+    total = 0
+    for num in range(files):
+        parts = ['pkg%d' % (num // per_dir // per_dir), 'sub%d' % (num // per_dir)]
+        folder = os.path.join(root, *parts)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        size = int(rng.lognormvariate(0, 1) * median_size)
+        kind = rng.random()
+        if kind < noise_share:
+            name = 'data%d%s' % (num, rng.choice(NOISE_EXT))
+            data = os.urandom(size)
+        elif kind < noise_share + (1 - noise_share) * pyqt4_share:
+            name = 'module%d.py' % num
+            data = make_module(size, PYQT4_HEADER, PYQT4_BLOCK).encode('utf-8')
+        else:
+            name = 'module%d.py' % num
+            data = make_module(size, PLAIN_HEADER, PLAIN_BLOCK).encode('utf-8')
+
+        with open(os.path.join(folder, name), 'wb') as outf:
+            outf.write(data)
+        total += len(data)
+
+    return total
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+
+    return (values[mid-1] + values[mid]) / 2.0
+
+
+def run_python(code, env=None):
+    """Run a Python code into a new interpreter, returns the elapsed time
+    and the output.
+
+    Args:
+    code -- the source code
+    env -- the environment
+    """
+    start = time.time()
+    out = subprocess.check_output([sys.executable, '-c', code], env=env)
+    return time.time() - start, out.decode('utf-8')
+
+
+def package_env():
+    """Returns the environment which imports this copy of the package."""
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([root, env.get('PYTHONPATH', '')])
+    # Else each interpreter compiles the package again
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return env
+
+
+def measure_startup(runs=15):
+    """Returns the median time added by the import of the package.
+
+    Args:
+    runs -- the number of interpreters started
+    """
+    env = package_env()
+    # Compile the package once, out of the measure
+    compileall.compile_dir(os.path.dirname(os.path.abspath(__file__)), quiet=1)
+    run_python('import pyqt4topyqt5', env)
+    bare = [run_python('pass', env)[0] for _ in range(runs)]
+    full = [run_python('import pyqt4topyqt5', env)[0] for _ in range(runs)]
+    return max(0.0, median(full) - median(bare))
+
+
+# Run by the child processes of measure_cli()
+CLI_CODE = """
+import sys
+sys.argv = %(argv)r
+import pyqt4topyqt5
+pyqt4topyqt5.cli()
+print('modules: ' + ' '.join(m for m in %(modules)r if m in sys.modules))
+"""
+
+
+def measure_cli(runs=15):
+    """Returns the median time added by the conversion of one small file
+    with the command line, and the modules of PLUGIN_MODULES it imported.
+
+    Args:
+    runs -- the number of interpreters started
+    """
+    env = package_env()
+    tmp = tempfile.mkdtemp(prefix='pyqt4topyqt5-cli-')
+    try:
+        source = os.path.join(tmp, 'small.py')
+        with open(source, 'w') as outf:
+            outf.write(make_module(2048, PYQT4_HEADER, PYQT4_BLOCK))
+        dest = os.path.join(tmp, 'small_PyQt5.py')
+        argv = ['pyqt4topyqt5', source, '--nolog', '-o', dest]
+        code = CLI_CODE % {'argv': argv, 'modules': PLUGIN_MODULES}
+        # The package is compiled by measure_startup()
+        out = run_python(code, env)[1]
+        imported = [line.split()[1:] for line in out.splitlines()
+                    if line.startswith('modules:')][-1]
+        bare = [run_python('pass', env)[0] for _ in range(runs)]
+        full = [run_python(code, env)[0] for _ in range(runs)]
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return max(0.0, median(full) - median(bare)), imported
+
+
+def imported_heavy_modules():
+    """Returns the heavy modules imported by `import pyqt4topyqt5`."""
+    code = ('import sys, pyqt4topyqt5\n'
+            'print(" ".join(m for m in %r if m in sys.modules))' % (HEAVY_MODULES,))
+    return run_python(code, package_env())[1].split()
+
+
+def check_startup(runs=15, target=STARTUP_TARGET, cli_target=STARTUP_CLI_TARGET):
+    """Print the startup time and the time of the conversion of one small
+    file, returns 0 if the targets are met.
+
+    Args:
+    runs -- the number of interpreters started
+    target -- the maximum time of the import in seconds
+    cli_target -- the maximum time of the conversion in seconds
+    """
+    status = 0
+    heavy = imported_heavy_modules()
+    if heavy:
+        sys.stdout.write('FAIL: modules imported at startup: %s\n' % ', '.join(heavy))
+        status = 1
+
+    elapsed = measure_startup(runs)
+    if elapsed > target:
+        sys.stdout.write('FAIL: ')
+        status = 1
+    sys.stdout.write('import pyqt4topyqt5: %.1f ms (target %.1f ms)\n'
+                     % (elapsed * 1000, target * 1000))
+
+    elapsed, plugins = measure_cli(runs)
+    if plugins:
+        sys.stdout.write('FAIL: modules imported without --plugins: %s\n'
+                         % ', '.join(plugins))
+        status = 1
+    if elapsed > cli_target:
+        sys.stdout.write('FAIL: ')
+        status = 1
+    sys.stdout.write('pyqt4topyqt5 on one small file: %.1f ms (target %.1f ms)\n'
+                     % (elapsed * 1000, cli_target * 1000))
+    return status
+
+
+# Run by the child process of run_e2e(), the I/O counters of Linux are read
+# at the end of the run
+E2E_CODE = """
+import sys, json
+sys.argv = %(argv)r
+import pyqt4topyqt5
+pyqt4topyqt5.cli()
+counters = {}
+try:
+    with open('/proc/self/io') as inf:
+        for line in inf:
+            key, value = line.split(':')
+            counters[key] = int(value)
+except (IOError, OSError):
+    pass
+with open(%(report)r, 'w') as outf:
+    json.dump(counters, outf)
+"""
+
+
+def cpu_time():
+    """Returns the CPU time of the terminated child processes."""
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_e2e(files=1000, median_size=8192, pyqt4_share=0.6, noise_share=0.2,
+            seed=0, options=()):
+    """Convert a synthetic project with the whole command line flow, copy,
+    conversion, diff and log, into a new interpreter.  Returns the dict of
+    the measures.
+
+    The I/O counters come from /proc/self/io and are None elsewhere than
+    on Linux, they don't include the worker processes of -j.
+
+    Args:
+    files -- the number of files of the project
+    median_size -- the median size of a file in bytes
+    pyqt4_share -- the share of the Python files which use PyQt4
+    noise_share -- the share of the files which aren't Python files
+    seed -- the seed of the random generator
+    options -- the extra options of the command line
+    """
+    tmp = tempfile.mkdtemp(prefix='pyqt4topyqt5-bench-')
+    try:
+        src = os.path.join(tmp, 'project')
+        size = generate_tree(src, files, median_size, pyqt4_share, noise_share,
+                             seed=seed)
+        report = os.path.join(tmp, 'io.json')
+        argv = ['pyqt4topyqt5', src, '-o', os.path.join(tmp, 'converted'),
+                '--diff'] + list(options)
+        code = E2E_CODE % {'argv': argv, 'report': report}
+        cpu = cpu_time()
+        start = time.time()
+        with open(os.devnull, 'w') as null:
+            subprocess.check_call([sys.executable, '-c', code], cwd=tmp,
+                                  env=package_env(), stdout=null)
+        wall = time.time() - start
+        if cpu is not None:
+            cpu = cpu_time() - cpu
+        with open(report) as inf:
+            counters = json.load(inf)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return {'files': files, 'bytes': size, 'wall': wall, 'cpu': cpu,
+            'files_per_s': files / wall,
+            'read_bytes': counters.get('rchar'),
+            'written_bytes': counters.get('wchar'),
+            'read_calls': counters.get('syscr'),
+            'write_calls': counters.get('syscw')}
+
+
+def format_e2e(result):
+    """Returns the report of run_e2e().
+
+    Args:
+    result -- the dict of the measures
+    """
+    def value(key, fmt):
+        return 'n/a' if result[key] is None else fmt % result[key]
+
+    return ('files         %d (%.1f MB)\n'
+            'wall time     %.2f s\n'
+            'CPU time      %s\n'
+            'throughput    %.1f files/s\n'
+            'read          %s\n'
+            'written       %s\n'
+            'syscalls      %s read, %s write\n'
+            % (result['files'], result['bytes'] / 1048576.0, result['wall'],
+               value('cpu', '%.2f s'), result['files_per_s'],
+               value('read_bytes', '%d bytes'), value('written_bytes', '%d bytes'),
+               value('read_calls', '%d'), value('write_calls', '%d')))
+
+
+def calibrate(runs=3):
+    """Returns the median time of a fixed pure Python loop, the unit of the
+    times stored by the gate so the baseline doesn't depend on the speed
+    of the machine.  It is measured again before each run, a change of the
+    clock frequency during the benchmarks is also cancelled.
+
+    Args:
+    runs -- the number of runs
+    """
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        total = 0
+        for num in range(200000):
+            total += num % 7
+        times.append(time.time() - start)
+
+    return median(times)
+
+
+def measure_stages(data, runs=7):
+    """Convert a module in memory and returns the times of each stage of
+    the conversion, the fix_* methods, the imports rewriting, the loading
+    and the whole conversion.
+
+    Args:
+    data -- the content of the module
+    runs -- the number of conversions
+
+    Returns:
+    dict(name: list of times in calibration units), list of the calibrations
+    """
+    from . import PyQt4ToPyQt5
+    from .tracing import instrument
+
+    times = {}
+    units = []
+
+    def wrap(func, name, cat):
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                current[name] = current.get(name, 0.0) + time.time() - start
+        return timed
+
+    stdout = sys.stdout
+    try:
+        for _ in range(runs):
+            current = {}
+            units.append(calibrate())
+            cnv = PyQt4ToPyQt5('bench.py', 'bench.py', None, False, data=data)
+            instrument(cnv, wrap)
+            # The messages of the converter
+            sys.stdout = io.StringIO() if PY3 else io.BytesIO()
+            start = time.time()
+            cnv.setup()
+            current['convert'] = time.time() - start
+            sys.stdout = stdout
+            for name, elapsed in current.items():
+                times.setdefault(name, []).append(elapsed / units[-1])
+    finally:
+        sys.stdout = stdout
+
+    return times, units
+
+
+def confidence_interval(values, level=0.95, resamples=1000):
+    """Returns the bootstrap confidence interval of the median.
+
+    Args:
+    values -- the measures
+    level -- the confidence level
+    resamples -- the number of resamples
+    """
+    rng = random.Random(0)
+    medians = sorted(median([rng.choice(values) for _ in values])
+                     for _ in range(resamples))
+    low = int(resamples * (1 - level) / 2)
+    return medians[low], medians[resamples - 1 - low]
+
+
+def summarize(values):
+    """Returns the statistics of the measures of a benchmark.
+
+    Args:
+    values -- the times in calibration units
+    """
+    low, high = confidence_interval(values)
+    return {'median': median(values), 'ci': [low, high], 'runs': len(values)}
+
+
+def run_gate_benchmarks(runs=7, module_size=300000, e2e_runs=3, e2e_files=100):
+    """Run the benchmarks of the gate, returns the results in calibration
+    units.
+
+    Args:
+    runs -- the number of conversions of the module
+    module_size -- the size of the PyQt4 module converted
+    e2e_runs -- the number of runs of the end-to-end benchmark, 0 to skip it
+    e2e_files -- the number of files of the end-to-end project
+    """
+    data = make_module(module_size, PYQT4_HEADER, PYQT4_BLOCK).encode('utf-8')
+    # Warm up the caches and the clock frequency
+    measure_stages(data, 1)
+    times, units = measure_stages(data, runs)
+    results = dict((name, summarize(values)) for name, values in times.items())
+
+    if e2e_runs:
+        walls = []
+        for num in range(e2e_runs):
+            unit = calibrate()
+            units.append(unit)
+            walls.append(run_e2e(e2e_files, 4096, seed=num)['wall'] / unit)
+        results['e2e'] = summarize(walls)
+
+    return {'calibration': median(units), 'python': sys.version.split()[0],
+            'module_size': module_size, 'e2e_files': e2e_files,
+            'benchmarks': results}
+
+
+def compare(baseline, current, threshold=GATE_THRESHOLD, min_delta=GATE_MIN_DELTA):
+    """Returns the lines of the report and the names of the benchmarks
+    which regress.
+
+    A benchmark regresses when the whole confidence interval of its median
+    is above the baseline plus the threshold, and the difference is larger
+    than the noise of the fast stages.
+
+    Args:
+    baseline -- the results stored
+    current -- the results of this run
+    threshold -- the regression accepted, as a share of the baseline
+    min_delta -- the smallest difference reported, in calibration units
+    """
+    lines, failed = [], []
+    base, cur = baseline['benchmarks'], current['benchmarks']
+    for name in sorted(set(base) | set(cur)):
+        if name not in cur or name not in base:
+            lines.append('%-28s %s' % (name, 'new' if name in cur else 'missing'))
+            continue
+
+        old, new = base[name]['median'], cur[name]
+        ratio = new['median'] / old if old else float('inf')
+        regress = (new['ci'][0] > old * (1 + threshold) and
+                   new['median'] - old > min_delta)
+        if regress:
+            failed.append(name)
+        lines.append('%-28s %9.3f %9.3f  [%7.3f, %7.3f]  %+6.1f%%  %s'
+                     % (name, old, new['median'], new['ci'][0], new['ci'][1],
+                        (ratio - 1) * 100, 'REGRESSION' if regress else 'ok'))
+
+    return lines, failed
+
+
+def check_gate(path=BASELINE, update=False, threshold=GATE_THRESHOLD, runs=7,
+               e2e_runs=3):
+    """Run the benchmarks and compare them to the baseline, or store them
+    as the new baseline.  Returns 0 if nothing regresses.
+
+    Args:
+    path -- the baseline file
+    update -- write the results as the new baseline
+    threshold -- the regression accepted, as a share of the baseline
+    runs -- the number of runs of each benchmark
+    e2e_runs -- the number of runs of the end-to-end benchmark
+    """
+    current = run_gate_benchmarks(runs, e2e_runs=e2e_runs)
+    if update:
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(path, 'w') as outf:
+            json.dump(current, outf, indent=2, sort_keys=True)
+            outf.write('\n')
+        sys.stdout.write('Baseline written: %s\n' % path)
+        return 0
+
+    if not os.path.isfile(path):
+        sys.stdout.write('No such baseline: `%s`, create it with --update\n' % path)
+        return 2
+
+    with open(path) as inf:
+        baseline = json.load(inf)
+
+    lines, failed = compare(baseline, current, threshold)
+    sys.stdout.write('%-28s %9s %9s  %18s  %7s\n'
+                     % ('benchmark', 'baseline', 'median', '95% interval', 'change'))
+    sys.stdout.write('\n'.join(lines) + '\n')
+    sys.stdout.write('Times in units of %.1f ms, threshold %d%%\n'
+                     % (current['calibration'] * 1000, threshold * 100))
+    if failed:
+        sys.stdout.write('FAIL: %s\n' % ', '.join(failed))
+        return 1
+
+    return 0
+
+
+# The inputs of the scaling benchmark: name, header, block
+SCALE_SHAPES = (('classes', PYQT4_HEADER, PYQT4_BLOCK),
+                ('one-class', PYQT4_HEADER + PYQT4_CLASS, PYQT4_METHOD))
+
+
+def fit_exponent(points):
+    """Returns the slope of the least squares line of log(time) by
+    log(lines), the growth exponent of a stage.
+
+    Args:
+    points -- list of (lines, time)
+    """
+    xs = [math.log(n) for n, _ in points]
+    ys = [math.log(t) for _, t in points]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    var = sum((x - mean_x) ** 2 for x in xs)
+    cov = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    return cov / var
+
+
+def measure_scaling(header, block, min_lines=1000, max_lines=1000000, factor=4,
+                    runs=3, budget=120.0):
+    """Convert generated modules of growing length, returns the best time
+    of each stage by number of lines.
+
+    The growth stops before a module which would take longer than the
+    budget, according to the growth of the previous sizes, so a quadratic
+    stage doesn't run for hours.
+
+    Args:
+    header -- the beginning of the modules
+    block -- the code repeated
+    min_lines -- the length of the first module
+    max_lines -- the length of the last module
+    factor -- the ratio between two lengths
+    runs -- the number of conversions of a module
+    budget -- the maximum time of a conversion in seconds
+
+    Returns:
+    dict(name: list of (lines, time in calibration units))
+    """
+    points = {}
+    previous = None
+    num_lines = min_lines
+    while num_lines <= max_lines:
+        data = make_lines(num_lines, header, block).encode('utf-8')
+        lines = data.count(b'\n')
+        times, units = measure_stages(data, 1)
+        elapsed = times['convert'][0] * units[0]
+        if runs > 1 and elapsed < 1.0:
+            more, _ = measure_stages(data, runs - 1)
+            for name, values in more.items():
+                times.setdefault(name, []).extend(values)
+        for name, values in times.items():
+            points.setdefault(name, []).append((lines, min(values)))
+
+        growth = elapsed / previous if previous else factor
+        if elapsed * max(growth, factor) > budget:
+            break
+        previous = elapsed
+        num_lines *= factor
+
+    return points
+
+
+def check_scaling(min_lines=1000, max_lines=1000000, max_exponent=SCALE_MAX_EXPONENT,
+                  runs=3, budget=120.0, json_path=None):
+    """Print the growth exponent of each stage for each shape of input and
+    returns 0 if all of them are near linear.
+
+    Args:
+    min_lines -- the length of the first module
+    max_lines -- the length of the last module
+    max_exponent -- the growth exponent accepted
+    runs -- the number of conversions of a module
+    budget -- the maximum time of a conversion in seconds
+    json_path -- also write the measures into this file
+    """
+    failed = []
+    results = {}
+    for shape, header, block in SCALE_SHAPES:
+        points = measure_scaling(header, block, min_lines, max_lines, runs=runs,
+                                 budget=budget)
+        sizes = [n for n, _ in points['convert']]
+        sys.stdout.write('\n%s: %s lines, times in calibration units\n'
+                         % (shape, ', '.join(str(n) for n in sizes)))
+        sys.stdout.write('%-28s %10s %10s %9s\n'
+                         % ('stage', 'first', 'last', 'exponent'))
+        results[shape] = {}
+        for name in sorted(points):
+            fast = points[name][-1][1] < SCALE_MIN_TIME
+            values = [(n, t) for n, t in points[name] if t >= SCALE_MIN_TIME]
+            if len(values) < 3:
+                # The budget stopped the growth after one or two long times,
+                # the sizes before them widen the fit
+                values = points[name][-3:]
+            exponent = None
+            if not fast and len(values) >= 2:
+                exponent = fit_exponent(values)
+            results[shape][name] = {'points': points[name], 'exponent': exponent}
+            status = ''
+            if fast:
+                status = 'too fast'
+            elif exponent is None:
+                # Only one size converted
+                status = 'NOT MEASURED'
+                failed.append('%s (%s)' % (name, shape))
+            elif exponent > max_exponent:
+                status = 'NOT LINEAR'
+                failed.append('%s (%s)' % (name, shape))
+            sys.stdout.write('%-28s %10.3f %10.3f %9s  %s\n'
+                             % (name, points[name][0][1], points[name][-1][1],
+                                '-' if exponent is None else '%.2f' % exponent,
+                                status))
+
+    if json_path:
+        with open(json_path, 'w') as outf:
+            json.dump(results, outf, indent=2, sort_keys=True)
+
+    if failed:
+        sys.stdout.write('FAIL: growth exponent above %.2f or unknown: %s\n'
+                         % (max_exponent, ', '.join(failed)))
+        return 1
+
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of pyqt4topyqt5.')
+    sub = parser.add_subparsers(dest='command')
+    startup = sub.add_parser('startup', help="Check the time of the import of "
+                        "the converter and of the conversion of one small file.")
+    startup.add_argument("--runs", type=int, default=15,
+                        help="Number of interpreters started.  Default: 15")
+    startup.add_argument("--target", type=float, default=STARTUP_TARGET * 1000,
+                        help="Maximum time in ms.  Default: %d" % (STARTUP_TARGET * 1000))
+    startup.add_argument("--cli-target", type=float, default=STARTUP_CLI_TARGET * 1000,
+                        help="Maximum time of the conversion of one small file in ms."
+                        "  Default: %d" % (STARTUP_CLI_TARGET * 1000))
+    e2e = sub.add_parser('e2e', help="Convert a synthetic project with the "
+                        "whole command line flow.")
+    e2e.add_argument("--files", type=int, default=1000,
+                        help="Number of files of the project.  Default: 1000")
+    e2e.add_argument("--median-size", type=int, default=8192,
+                        help="Median size of a file in bytes.  Default: 8192")
+    e2e.add_argument("--pyqt4-share", type=float, default=0.6,
+                        help="Share of the Python files which use PyQt4.  "
+                        "Default: 0.6")
+    e2e.add_argument("--noise-share", type=float, default=0.2,
+                        help="Share of the files which aren't Python files.  "
+                        "Default: 0.2")
+    e2e.add_argument("--seed", type=int, default=0,
+                        help="Seed of the generator of the project.  Default: 0")
+    e2e.add_argument("--json", metavar='FILE',
+                        help="Also write the measures into FILE.")
+    e2e.add_argument("options", nargs=argparse.REMAINDER,
+                        help="Options of pyqt4topyqt5, after `--`.")
+    gate = sub.add_parser('gate', help="Compare the fixers and the end-to-end "
+                        "flow to the baseline, fails on a regression.")
+    gate.add_argument("--baseline", default=BASELINE,
+                        help="The baseline file.  Default: benchmarks/baseline.json")
+    gate.add_argument("--update", action="store_true",
+                        help="Store the results as the new baseline.")
+    gate.add_argument("--threshold", type=float, default=GATE_THRESHOLD * 100,
+                        help="Regression accepted in percent.  Default: %d"
+                        % (GATE_THRESHOLD * 100))
+    gate.add_argument("--runs", type=int, default=7,
+                        help="Number of runs of each benchmark.  Default: 7")
+    gate.add_argument("--e2e-runs", type=int, default=3,
+                        help="Number of runs of the end-to-end benchmark, 0 to "
+                        "skip it.  Default: 3")
+    scale = sub.add_parser('scale', help="Fit the growth of each stage with the "
+                        "length of a file, fails if one isn't near linear.")
+    scale.add_argument("--min-lines", type=int, default=1000,
+                        help="Length of the first module.  Default: 1000")
+    scale.add_argument("--max-lines", type=int, default=1000000,
+                        help="Length of the last module.  Default: 1000000")
+    scale.add_argument("--max-exponent", type=float, default=SCALE_MAX_EXPONENT,
+                        help="Growth exponent accepted.  Default: %.1f"
+                        % SCALE_MAX_EXPONENT)
+    scale.add_argument("--runs", type=int, default=3,
+                        help="Number of conversions of the short modules.  "
+                        "Default: 3")
+    scale.add_argument("--budget", type=float, default=120.0,
+                        help="Maximum time of a conversion in seconds, the "
+                        "longer modules are skipped.  Default: 120")
+    scale.add_argument("--json", metavar='FILE',
+                        help="Also write the measures into FILE.")
+    arg = parser.parse_args(argv)
+
+    if arg.command == 'scale':
+        return check_scaling(arg.min_lines, arg.max_lines, arg.max_exponent,
+                             arg.runs, arg.budget, arg.json)
+
+    if arg.command == 'gate':
+        return check_gate(arg.baseline, arg.update, arg.threshold / 100.0,
+                          arg.runs, arg.e2e_runs)
+
+    if arg.command == 'startup':
+        return check_startup(arg.runs, arg.target / 1000.0, arg.cli_target / 1000.0)
+
+    if arg.command == 'e2e':
+        options = [o for o in arg.options if o != '--']
+        result = run_e2e(arg.files, arg.median_size, arg.pyqt4_share,
+                         arg.noise_share, arg.seed, options)
+        sys.stdout.write(format_e2e(result))
+        if arg.json:
+            with open(arg.json, 'w') as outf:
+                json.dump(result, outf, indent=2, sort_keys=True)
+        return 0
+
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of pyqt4topyqt5
+
+import io
+import os
+import re
+import stat
+
+from . import PYEXT, PYSHEBANG
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# Dirs never visited
+SKIP_DIRS = ('__pycache__', '.git')
+
+EXEC_MODE = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+
+
+class Entry(object):
+    """Minimal os.DirEntry used when scandir isn't available."""
+    def __init__(self, root, name):
+        self.name = name
+        self.path = os.path.join(root, name)
+        self._stat = None
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_dir(self):
+        try:
+            return stat.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
+
+    def is_file(self):
+        try:
+            return stat.S_ISREG(self.stat().st_mode)
+        except OSError:
+            return False
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+
+def list_dir(path):
+    """Returns the entries of a dir, an empty list if it can't be read.
+
+    Args:
+    path -- the dir
+    """
+    try:
+        if scandir is not None:
+            it = scandir(path)
+            try:
+                return list(it)
+            finally:
+                # The iterator of Python 2 and 3.5 can't be closed
+                getattr(it, 'close', lambda: None)()
+
+        return [Entry(path, name) for name in os.listdir(path)]
+    except OSError:
+        return []
+
+
+def has_shebang(path):
+    """Returns True if the first line of a file is a Python shebang.
+
+    Args:
+    path -- the file name
+    """
+    try:
+        with open(path, 'rb') as inf:
+            line = inf.readline(256)
+    except (IOError, OSError):
+        return False
+
+    try:
+        return line.decode('utf-8').strip() in PYSHEBANG
+    except UnicodeDecodeError:
+        return False
+
+
+def is_python(path, mode):
+    """Returns True if a file is a Python file, a regular file with a Python
+    extension, or without extension, executable and with a Python shebang.
+
+    Args:
+    path -- the file name
+    mode -- its st_mode
+    """
+    if not stat.S_ISREG(mode):
+        return False
+
+    ext = os.path.splitext(path)[1]
+    if ext in PYEXT:
+        return True
+
+    return not ext and bool(mode & EXEC_MODE) and has_shebang(path)
+
+
+def is_python_entry(entry):
+    """Same as is_python() for a DirEntry, its stat is only read for the
+    files without extension.
+
+    Args:
+    entry -- the DirEntry
+    """
+    ext = os.path.splitext(entry.name)[1]
+    if ext in PYEXT:
+        return entry.is_file()
+
+    if ext or not entry.is_file():
+        return False
+
+    return bool(entry.stat().st_mode & EXEC_MODE) and has_shebang(entry.path)
+
+
+def translate(pattern):
+    """Returns the regex of a glob written with the syntax of .gitignore,
+    matched against a path relative to the dir of the pattern.
+
+    A pattern without slash matches at any depth, `**` matches any number
+    of dirs.
+
+    Args:
+    pattern -- the glob, without `!` and trailing slash
+    """
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    regex = [] if anchored else ['(?:.*/)?']
+    idx, end = 0, len(pattern)
+    while idx < end:
+        char = pattern[idx]
+        if pattern.startswith('**/', idx):
+            regex.append('(?:.*/)?')
+            idx += 3
+            continue
+        elif pattern.startswith('**', idx):
+            regex.append('.*')
+            idx += 2
+            continue
+        elif char == '*':
+            regex.append('[^/]*')
+        elif char == '?':
+            regex.append('[^/]')
+        elif char == '[' and pattern.find(']', idx + 2) > 0:
+            close = pattern.find(']', idx + 2)
+            chars = pattern[idx+1:close].replace('\\', '\\\\')
+            if chars[0] == '!':
+                chars = '^' + chars[1:]
+            regex.append('[%s]' % chars)
+            idx = close
+        elif char == '\\' and idx + 1 < end:
+            idx += 1
+            regex.append(re.escape(pattern[idx]))
+        else:
+            regex.append(re.escape(char))
+        idx += 1
+
+    return re.compile(''.join(regex) + '$')
+
+
+def parse_rules(lines, base):
+    """Returns the rules of the lines of a .gitignore file, the tuples
+    (base, regex, negate, dir_only).
+
+    Args:
+    lines -- the patterns
+    base -- the dir relative to which the patterns are matched
+    """
+    rules = []
+    for line in lines:
+        line = line.rstrip('\n\r')
+        if not line.endswith('\\ '):
+            line = line.rstrip(' ')
+        if not line or line.startswith('#'):
+            continue
+
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        elif line.startswith(('\\#', '\\!')):
+            line = line[1:]
+
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if line:
+            rules.append((base, translate(line), negate, dir_only))
+
+    return tuple(rules)
+
+
+def match_rules(rules, path, is_dir):
+    """Returns True if the last rule matching a path excludes it.
+
+    Args:
+    rules -- the tuples (base, regex, negate, dir_only)
+    path -- the path, into the base dir of all the rules
+    is_dir -- True if the path is a dir
+    """
+    ignored = False
+    for base, regex, negate, dir_only in rules:
+        if dir_only and not is_dir:
+            continue
+        rel = path[len(base)+1:].replace(os.sep, '/')
+        if regex.match(rel):
+            ignored = not negate
+
+    return ignored
+
+
+class Ignore(object):
+    """The files and dirs excluded from the conversion.
+
+    Args:
+    root -- the top dir
+    patterns -- the globs given with --exclude, relative to the top dir
+    gitignore -- also exclude what the .gitignore files ignore
+    """
+    def __init__(self, root, patterns=(), gitignore=False):
+        self.root = root
+        self.excludes = parse_rules(patterns, root)
+        self.gitignore = gitignore
+        self.cache = {}
+
+    def rules(self, path, parent=()):
+        """Returns the .gitignore rules applied into a dir.
+
+        Args:
+        path -- the dir
+        parent -- the rules of its parent dir
+        """
+        if not self.gitignore:
+            return ()
+
+        fname = os.path.join(path, '.gitignore')
+        try:
+            with io.open(fname, 'r', encoding='utf-8', errors='replace') as inf:
+                return parent + parse_rules(inf, path)
+        except (IOError, OSError):
+            return parent
+
+    def is_ignored(self, path, is_dir, rules=()):
+        """Returns True if a path is excluded.
+
+        Args:
+        path -- the path
+        is_dir -- True if the path is a dir
+        rules -- the .gitignore rules of its dir
+        """
+        return (match_rules(self.excludes, path, is_dir) or
+                match_rules(rules, path, is_dir))
+
+    def excluded(self, path):
+        """Same as is_ignored() for a file found without walking the tree,
+        the file is excluded if it or one of its dirs is ignored.
+
+        Args:
+        path -- the file, into the top dir
+        """
+        parts = os.path.relpath(path, self.root).split(os.sep)
+        current = self.root
+        rules = self.dir_rules(current, ())
+        for idx, part in enumerate(parts):
+            current = os.path.join(current, part)
+            is_dir = idx < len(parts) - 1
+            if self.is_ignored(current, is_dir, rules):
+                return True
+            if is_dir:
+                rules = self.dir_rules(current, rules)
+
+        return False
+
+    def dir_rules(self, path, parent):
+        if path not in self.cache:
+            self.cache[path] = self.rules(path, parent)
+        return self.cache[path]
+
+
+def walk(root, followlinks=False, ignore=None):
+    """Walk a tree in one pass and yields the tuples (dirpath, dirnames,
+    pyfiles) in the order of os.walk() with sorted names, where pyfiles
+    are the names of the Python files.
+
+    The dirs pointed to by symlinks are listed into dirnames but only
+    visited with followlinks, then a dir or a file reached twice is
+    skipped.  The ignored dirs are pruned, nothing below them is read.
+
+    Args:
+    root -- the top dir
+    followlinks -- visit the dirs pointed to by symlinks
+    ignore -- the Ignore instance, None to visit all the files
+    """
+    seen = set()
+    if followlinks:
+        st = os.stat(root)
+        seen.add((st.st_dev, st.st_ino))
+
+    stack = [(root, ())]
+    while stack:
+        top, rules = stack.pop()
+        if ignore is not None:
+            rules = ignore.rules(top, rules)
+        dirs, files, visit = [], [], []
+        for entry in sorted(list_dir(top), key=lambda e: e.name):
+            if entry.is_dir():
+                if entry.name in SKIP_DIRS:
+                    continue
+                if ignore is not None and ignore.is_ignored(entry.path, True, rules):
+                    continue
+                dirs.append(entry.name)
+                if entry.is_symlink() and not followlinks:
+                    continue
+                if followlinks:
+                    st = entry.stat()
+                    if (st.st_dev, st.st_ino) in seen:
+                        continue
+                    seen.add((st.st_dev, st.st_ino))
+                visit.append((entry.path, rules))
+
+            elif ignore is not None and ignore.is_ignored(entry.path, False, rules):
+                continue
+
+            elif is_python_entry(entry):
+                if followlinks:
+                    st = entry.stat()
+                    if (st.st_dev, st.st_ino) in seen:
+                        continue
+                    seen.add((st.st_dev, st.st_ino))
+                files.append(entry.name)
+
+        yield top, dirs, files
+        stack.extend(reversed(visit))
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of pyqt4topyqt5
+
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import argparse
+
+from datetime import datetime
+
+# The status of the files which don't need to be converted again
+DONE = ('converted', 'unchanged')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started TEXT,
+    finished TEXT,
+    args TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    source TEXT,
+    status TEXT,
+    duration REAL,
+    hash TEXT,
+    fixmes INTEGER,
+    error TEXT,
+    run INTEGER,
+    stamp REAL);
+"""
+
+
+def file_hash(path):
+    """Returns the sha1 of the content of a file, None if it can't be read.
+
+    Args:
+    path -- the file name
+    """
+    sha = hashlib.sha1()
+    try:
+        with open(path, 'rb') as inf:
+            for chunk in iter(lambda: inf.read(65536), b''):
+                sha.update(chunk)
+    except (IOError, OSError):
+        return None
+
+    return sha.hexdigest()
+
+
+class Ledger(object):
+    """Record of the files processed by the conversions, stored into a
+    SQLite database.
+
+    Each file is committed as soon as it is converted, so a conversion
+    killed halfway can be resumed and the database can be queried after
+    the run.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.run = None
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def begin(self, args):
+        """Register a new run.
+
+        Args:
+        args -- the command line
+        """
+        cur = self.db.execute('INSERT INTO runs (started, args) VALUES (?, ?)',
+                              (datetime.now().isoformat(), ' '.join(args)))
+        self.db.commit()
+        self.run = cur.lastrowid
+
+    def finish(self):
+        if self.run is not None:
+            self.db.execute('UPDATE runs SET finished = ? WHERE id = ?',
+                            (datetime.now().isoformat(), self.run))
+            self.db.commit()
+
+    def close(self):
+        self.finish()
+        self.db.close()
+
+    def record(self, path, source, status, duration, fixmes=0, error=''):
+        """Record the result of the conversion of a file.
+
+        Args:
+        path -- the converted file
+        source -- the original file
+        status -- 'converted', 'unchanged', 'failed' or 'timeout'
+        duration -- the time of the conversion in seconds
+        fixmes -- the number of FIXMEs added
+        error -- the reason of a failure
+        """
+        self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (path, source, status, duration, file_hash(source),
+                         fixmes, str(error or ''), self.run, time.time()))
+        self.db.commit()
+
+    def is_done(self, path, source):
+        """Returns True if a file has been converted and its source has not
+        been modified since.
+
+        Args:
+        path -- the converted file
+        source -- the original file
+        """
+        row = self.db.execute('SELECT status, hash FROM files WHERE path = ?',
+                              (path,)).fetchone()
+        if row is None or row[0] not in DONE or not os.path.exists(path):
+            return False
+
+        return row[1] == file_hash(source)
+
+    def slowest(self, num=10):
+        return self.db.execute('SELECT path, duration FROM files '
+                               'ORDER BY duration DESC LIMIT ?', (num,)).fetchall()
+
+    def most_fixmes(self, num=10):
+        return self.db.execute('SELECT path, fixmes FROM files WHERE fixmes > 0 '
+                               'ORDER BY fixmes DESC LIMIT ?', (num,)).fetchall()
+
+    def failed(self):
+        return self.db.execute("SELECT path, error FROM files WHERE status = 'failed' "
+                               "ORDER BY path").fetchall()
+
+    def summary(self):
+        return self.db.execute('SELECT status, COUNT(*), SUM(duration), SUM(fixmes) '
+                               'FROM files GROUP BY status ORDER BY status').fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query the ledger of the '
+                        'conversions.')
+    parser.add_argument("ledger", help="The ledger file.")
+    parser.add_argument("--slowest", type=int, metavar='N',
+                        help="List the N slowest files.")
+    parser.add_argument("--fixmes", type=int, metavar='N',
+                        help="List the N files with the most FIXMEs.")
+    parser.add_argument("--failed", action="store_true",
+                        help="List the files which can't be converted.")
+    arg = parser.parse_args(argv)
+
+    if not os.path.isfile(arg.ledger):
+        sys.stdout.write('No such file: `%s`\n' % arg.ledger)
+        return 1
+
+    ledger = Ledger(arg.ledger)
+    if arg.slowest:
+        for path, duration in ledger.slowest(arg.slowest):
+            sys.stdout.write('%9.3fs  %s\n' % (duration, path))
+
+    elif arg.fixmes:
+        for path, fixmes in ledger.most_fixmes(arg.fixmes):
+            sys.stdout.write('%6d  %s\n' % (fixmes, path))
+
+    elif arg.failed:
+        for path, error in ledger.failed():
+            sys.stdout.write('%s\n    %s\n' % (path, error))
+
+    else:
+        for status, num, duration, fixmes in ledger.summary():
+            sys.stdout.write('%-10s %6d files  %9.3fs  %6d FIXMEs\n'
+                             % (status, num, duration or 0, fixmes or 0))
+
+    ledger.db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
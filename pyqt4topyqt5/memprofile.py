@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of pyqt4topyqt5
+
+import sys
+import tracemalloc
+
+from . import tracing
+from .tracing import instrument
+
+MB = 1024.0 * 1024.0
+
+
+class MemProfiler(object):
+    """Record with tracemalloc the peak of the memory allocated by the
+    conversion of each file and by each of its stages.
+
+    The peak of a stage is the memory allocated above what was allocated
+    when the stage began.  A snapshot is taken each time the allocated
+    memory reaches a new maximum at the end of a stage, it gives the
+    allocation sites which hold the memory.
+
+    Args:
+    inner -- the tracing.Tracer of --trace, None if not used
+    frames -- the number of frames stored by allocation
+    """
+    def __init__(self, inner=None, frames=1):
+        if not hasattr(tracemalloc, 'reset_peak'):
+            raise RuntimeError('--memprofile requires Python 3.9 or later')
+
+        self.inner = inner
+        self.files = []
+        # stage -> (peak, file)
+        self.stages = {}
+        # Running peaks of the file and of the stages being run
+        self.stack = []
+        self.current = None
+        self.highest = 0
+        self.snapshot = None
+        self.snapshot_at = None
+        tracemalloc.start(frames)
+
+    def instrument(self, cnv):
+        """Measure the stages of a conversion.
+
+        Args:
+        cnv -- the PyQt4ToPyQt5 instance
+        """
+        if self.inner is not None:
+            self.inner.instrument(cnv)
+        instrument(cnv, self.wrap)
+
+    def enter(self):
+        current, peak = tracemalloc.get_traced_memory()
+        if self.stack:
+            self.stack[-1][1] = max(self.stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        self.stack.append([current, current])
+
+    def leave(self):
+        """Returns the peak allocated since the matching enter()."""
+        current, peak = tracemalloc.get_traced_memory()
+        start, peak_seen = self.stack.pop()
+        peak = max(peak, peak_seen)
+        if self.stack:
+            self.stack[-1][1] = max(self.stack[-1][1], peak)
+        return peak - start, current
+
+    def wrap(self, func, name, cat):
+        def measured(*args, **kwargs):
+            self.enter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                peak, current = self.leave()
+                if peak > self.stages.get(name, (-1,))[0]:
+                    self.stages[name] = (peak, self.current)
+                if current > self.highest:
+                    self.highest = current
+                    self.snapshot = tracemalloc.take_snapshot()
+                    self.snapshot_at = (self.current, name)
+        return measured
+
+    def begin(self, path):
+        """The conversion of a file begins.
+
+        Args:
+        path -- the file
+        """
+        self.current = path
+        self.enter()
+
+    def end(self, path):
+        self.files.append((self.leave()[0], path))
+        self.current = None
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def report(self, num=10, stream=None):
+        """Write the worst files, the worst stages and the top allocation
+        sites.
+
+        Args:
+        num -- the number of lines of each table
+        stream -- the output, default stdout
+        """
+        out = stream or sys.stdout
+        out.write('\nPeak memory by file:\n')
+        for peak, path in sorted(self.files, reverse=True)[:num]:
+            out.write('%10.1f MB  %s\n' % (peak / MB, path))
+
+        out.write('\nPeak memory by stage:\n')
+        stages = sorted(self.stages.items(), key=lambda i: i[1][0], reverse=True)
+        for name, (peak, path) in stages[:num]:
+            out.write('%10.1f MB  %-28s %s\n' % (peak / MB, name, path))
+
+        if self.snapshot is None:
+            return
+
+        out.write('\nTop allocation sites at %.1f MB, after %s of %s:\n'
+                  % (self.highest / MB, self.snapshot_at[1], self.snapshot_at[0]))
+        # The allocations of the profiling itself are hidden
+        snapshot = self.snapshot.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, tracing.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>')))
+        for stat in snapshot.statistics('lineno')[:num]:
+            frame = stat.traceback[0]
+            out.write('%10.1f MB  %8d blocks  %s:%d\n'
+                      % (stat.size / MB, stat.count, frame.filename, frame.lineno))
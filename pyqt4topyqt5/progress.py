@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of pyqt4topyqt5
+
+import sys
+import time
+import threading
+
+# Statuses counted by the summary, in this order
+STATUSES = ('converted', 'unchanged', 'failed', 'timeout')
+
+
+def format_size(num):
+    for unit in ('B', 'KB', 'MB'):
+        if num < 1024:
+            return '%.1f %s' % (num, unit)
+        num /= 1024.0
+
+    return '%.1f GB' % num
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class Progress(object):
+    """Report the progress of a run on stderr.
+
+    The conversion loop only updates the counters, the line is written by
+    a thread at a fixed rate so the report doesn't slow down the loop.
+
+    Args:
+    total -- the number of files to convert
+    stream -- the output, default stderr
+    interval -- the time between two updates in seconds
+    """
+    def __init__(self, total, stream=None, interval=0.5):
+        self.total = total
+        self.stream = stream or sys.stderr
+        self.tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        # A log file gets a line from time to time, not a line per update
+        self.interval = interval if self.tty else max(interval, 10.0)
+        self.done = 0
+        self.bytes = 0
+        self.lines = 0
+        self.fixmes = 0
+        self.counts = dict((s, 0) for s in STATUSES)
+        self.inflight = {}
+        self.started = None
+        self.width = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.started = time.time()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write(self.status_line())
+
+    def begin(self, path):
+        """A file is being converted.
+
+        Args:
+        path -- the file
+        """
+        with self.lock:
+            self.inflight[path] = time.time()
+
+    def end(self, path, status, size=0, lines=0, fixmes=0):
+        """A file has been converted.
+
+        Args:
+        path -- the file
+        status -- 'converted', 'unchanged', 'failed' or 'timeout'
+        size -- its size in bytes
+        lines -- its number of logical lines
+        fixmes -- the number of FIXMEs added
+        """
+        with self.lock:
+            self.inflight.pop(path, None)
+            self.done += 1
+            self.bytes += size
+            self.lines += lines
+            self.fixmes += fixmes
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+    def status_line(self):
+        with self.lock:
+            now = time.time()
+            elapsed = max(now - self.started, 1e-6)
+            line = '%d/%d files  %s/s  %d lines/s' % (self.done, self.total,
+                    format_size(self.bytes / elapsed), self.lines / elapsed)
+            if self.done:
+                eta = elapsed / self.done * (self.total - self.done)
+                line += '  ETA %s' % format_duration(eta)
+            if self.inflight:
+                path, start = min(self.inflight.items(), key=lambda i: i[1])
+                line += '  slowest: %s (%.1fs)' % (path, now - start)
+
+        return line
+
+    def write(self, line):
+        if self.tty:
+            # Overwrite the previous line
+            pad = max(0, self.width - len(line))
+            self.width = len(line)
+            self.stream.write('\r' + line + ' ' * pad)
+        else:
+            self.stream.write(line + '\n')
+        self.stream.flush()
+
+    def close(self):
+        """Stop the updates and write the summary."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.inflight.clear()
+        self.write(self.status_line())
+        if self.tty:
+            self.stream.write('\n')
+        self.stream.write(self.summary() + '\n')
+        self.stream.flush()
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        parts = ['%d %s' % (self.counts[s], s) for s in STATUSES]
+        return ('%d files in %s: %s, %d FIXMEs'
+                % (self.done, format_duration(elapsed), ', '.join(parts), self.fixmes))
@@ -824,3 +824,10 @@ QVARIANT_OBSOLETE_METHODS = [
     # 'toTime',         # used by QLocale
     # 'toUInt',         # used by QByteArray, QLocale and QJSValue
     ]
+
+# The class tables are only used for membership tests, they are frozen once
+# when this module is imported
+CLASSES = dict((module, frozenset(names)) for module, names in CLASSES.items())
+DISCARDED = dict((module, frozenset(names)) for module, names in DISCARDED.items())
+QAPP_STATIC_METHODS = tuple(QAPP_STATIC_METHODS)
+QVARIANT_OBSOLETE_METHODS = tuple(QVARIANT_OBSOLETE_METHODS)
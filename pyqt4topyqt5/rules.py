@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of pyqt4topyqt5
+
+"""The registry of the fixers and the plan of the conversion of a file.
+
+A fixer is declared by a Rule, the built-in ones are in RULES and the
+plugins are found through the entry points of the group `pyqt4topyqt5.rules`,
+with the option --plugins only since reading the entry points of all the
+installed distributions costs more than a small conversion.  An entry point
+refers to a Rule or to a list of Rules, i.e.
+
+    # setup.cfg of the plugin
+    [options.entry_points]
+    pyqt4topyqt5.rules =
+        inhouse = inhouse_port:RULES
+
+    # inhouse_port.py
+    from pyqt4topyqt5.rules import Rule
+
+    def rename_api(cnv, line):
+        return line.replace('.oldName(', '.newName(')
+
+    RULES = [Rule('inhouse_rename_api', rename_api, triggers=('.oldName(',),
+                  line_local=True, after=('change_import_lines',))]
+"""
+
+from .qtclass import QVARIANT_OBSOLETE_METHODS
+
+ENTRY_POINTS = 'pyqt4topyqt5.rules'
+# The lines joined to look for the triggers of the rules
+TRIGGER_BLOCK = 4096
+
+
+class Rule(object):
+    """A fixer of the conversion.
+
+    Args:
+    name -- the name given to --only and --skip
+    func -- the name of a method of PyQt4ToPyQt5, or a function
+            func(converter, lines) for a plugin
+    triggers -- the rule is skipped if none of these strings is into the
+                file, empty to run it always
+    requires -- the kinds of code found by get_import_lines() needed by the
+                rule, among 'sig', 'gui' and 'web'
+    after -- the names of the rules which must run before this one
+    before -- the names of the rules which must run after this one
+    line_local -- True if the rule changes each line independently of the
+                  others and never inserts a line, `func` then takes a line
+                  and returns the new line.  The consecutive line-local rules
+                  are run in one pass over the lines
+    nopyqt5 -- True if the rule runs also with the option --nopyqt5
+
+    A rule which is not line-local changes the list of the lines in place,
+    or returns a new list.
+    """
+    def __init__(self, name, func, triggers=(), requires=(), after=(), before=(),
+                 line_local=False, nopyqt5=False):
+        self.name = name
+        self.func = func
+        self.triggers = tuple(triggers)
+        self.requires = tuple(requires)
+        self.after = tuple(after)
+        self.before = tuple(before)
+        self.line_local = line_local
+        self.nopyqt5 = nopyqt5
+        # The entry point of a plugin, None for a built-in rule
+        self.plugin = None
+
+    def __repr__(self):
+        return 'Rule(%r)' % self.name
+
+    def bind(self, cnv):
+        """Returns the function of the rule for a converter.
+
+        Args:
+        cnv -- the PyQt4ToPyQt5 instance
+        """
+        if isinstance(self.func, str):
+            return getattr(cnv, self.func)
+
+        func = self.func
+        return lambda arg: func(cnv, arg)
+
+
+SIG_TRIGGERS = ('SIGNAL(',)
+
+# The built-in fixers, in the order of the conversion
+RULES = (
+    Rule('remove_fromUtf8', 'remove_fromUtf8', triggers=('fromUtf8',)),
+    Rule('fix_emit', 'fix_emit', SIG_TRIGGERS, ('sig',), after=('remove_fromUtf8',),
+         nopyqt5=True),
+    Rule('fix_connect', 'fix_connect', SIG_TRIGGERS, ('sig',), after=('remove_fromUtf8',),
+         nopyqt5=True),
+    Rule('fix_disconnect', 'disconnect_line', SIG_TRIGGERS, ('sig',),
+         after=('remove_fromUtf8',), line_local=True, nopyqt5=True),
+    Rule('fix_signal', 'signal_line', ('@pyqtSignal',), ('sig',), line_local=True,
+         nopyqt5=True),
+    Rule('fix_slot', 'slot_line', ('@pyqtSignature', '@pyqtSlot'), ('sig',),
+         line_local=True, nopyqt5=True),
+    Rule('change_qtgui_modules', 'change_qtgui_modules', requires=('gui',),
+         after=('fix_emit', 'fix_connect', 'fix_disconnect', 'fix_signal', 'fix_slot')),
+    Rule('change_qtwebkit_modules', 'change_qtwebkit_modules', requires=('web',),
+         after=('fix_emit', 'fix_connect', 'fix_disconnect', 'fix_signal', 'fix_slot')),
+    Rule('change_import_lines', 'change_import_lines',
+         after=('fix_emit', 'fix_connect', 'fix_disconnect', 'fix_signal', 'fix_slot',
+                'change_qtgui_modules', 'change_qtwebkit_modules'),
+         nopyqt5=True),
+    Rule('fix_qfiledialog', 'fix_qfiledialog', ('AndFilter', 'FileName')),
+    Rule('fix_qdir', 'qdir_line', ('.NoDotAndDotDot', '.convertSeparators('),
+         line_local=True),
+    Rule('fix_qwidget', 'fix_qwidget', after=('change_import_lines',)),
+    Rule('fix_qtscript', 'fix_qtscript', ('QtScript', 'QScript')),
+    Rule('fix_qtxml', 'fix_qtxml', ('QtXml',)),
+    Rule('fix_qtdeclarative', 'fix_qtdeclarative',
+         ('QtDeclarative', 'QDeclarative', 'QPyDeclarative')),
+    Rule('fix_qgraphicsitemanimation', 'fix_qgraphicsitemanimation',
+         ('QGraphicsItemAnimation',)),
+    Rule('fix_qtopengl', 'fix_qtopengl', ('QGL',)),
+    Rule('fix_translations', 'translations_line', ('.translate', '.trUtf8('),
+         after=('change_qtgui_modules',), line_local=True),
+    Rule('fix_wheelevent', 'fix_wheelevent', ('wheelEvent(',)),
+    Rule('fix_layoutmargin', 'fix_layoutmargin', ('.setMargin(', '.margin(')),
+    Rule('fix_qdesktopservices', 'fix_qdesktopservices',
+         ('.displayName(', '.storageLocation(')),
+    Rule('fix_qdate', 'fix_qdate', ('setYMD(',)),
+    Rule('fix_qgraphicsitem', 'fix_qgraphicsitem', ('Graphics',)),
+    Rule('fix_qheader', 'fix_qheader', ('.setMovable', '.isMovable', '.setClickable',
+                                        '.isClickable', '.setResizeMode', '.resizeMode')),
+    Rule('fix_qinputdialog', 'qinputdialog_line', ('QInputDialog.getInteger(',),
+         line_local=True),
+    Rule('fix_qchar', 'fix_qchar', ('QChar',), after=('change_import_lines',)),
+    Rule('fix_qstring', 'fix_qstring', ('QString',), after=('change_import_lines',)),
+    Rule('fix_qglobal', 'qglobal_line', ('qInstallMsgHandler(',), line_local=True),
+    Rule('fix_qvariant', 'qvariant_line', ['.%s()' % m for m in QVARIANT_OBSOLETE_METHODS],
+         line_local=True),
+    Rule('replace_classnames', 'classnames_line', ('QMatrix', 'QIconEngineV2'),
+         line_local=True),
+    Rule('replace_qApp', 'qApp_line', ('qApp',), after=('change_qtgui_modules',),
+         line_local=True),
+)
+
+# The rules run on the modules written by pyuic4, besides the plugins
+UIC_RULES = ('remove_fromUtf8', 'fix_connect', 'change_qtgui_modules',
+             'change_qtwebkit_modules', 'change_import_lines', 'fix_translations',
+             'fix_layoutmargin')
+
+
+def entry_points(group):
+    """Returns the entry points of a group, empty if neither importlib.metadata
+    nor pkg_resources is available.
+
+    Args:
+    group -- the name of the group
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return []
+        return list(pkg_resources.iter_entry_points(group))
+
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return list(eps.select(group=group))
+
+    # Python < 3.10
+    return list(eps.get(group, []))
+
+
+def load_plugins(group=ENTRY_POINTS):
+    """Returns the rules of the installed plugins.
+
+    Args:
+    group -- the group of the entry points
+    """
+    rules = []
+    for ep in entry_points(group):
+        obj = ep.load()
+        for rule in [obj] if isinstance(obj, Rule) else list(obj):
+            if not isinstance(rule, Rule):
+                raise ValueError('The plugin %s gives %r, not a Rule' % (ep.name, rule))
+            rule.plugin = ep.name
+            rules.append(rule)
+
+    return rules
+
+
+def order_rules(rules):
+    """Returns the rules sorted by their dependencies, the order of the list
+    is kept when the rules are independent.
+
+    Args:
+    rules -- the list of the rules
+    """
+    names = {}
+    for rule in rules:
+        if rule.name in names:
+            raise ValueError('Two rules are named %s' % rule.name)
+        names[rule.name] = rule
+
+    # The rules which must run before each rule, unknown names are skipped
+    deps = dict((rule.name, set(n for n in rule.after if n in names)) for rule in rules)
+    for rule in rules:
+        for name in rule.before:
+            if name in names:
+                deps[name].add(rule.name)
+
+    # A rule is moved just before the first rule which depends on it
+    position = dict((rule.name, idx) for idx, rule in enumerate(rules))
+    ordered = []
+    state = {}
+
+    def visit(rule, path):
+        if state.get(rule.name) == 'done':
+            return
+        if state.get(rule.name) == 'visiting':
+            raise ValueError('Circular dependencies between the rules: %s'
+                             % ' -> '.join(path + [rule.name]))
+
+        state[rule.name] = 'visiting'
+        for name in sorted(deps[rule.name], key=position.get):
+            visit(names[name], path + [rule.name])
+        state[rule.name] = 'done'
+        ordered.append(rule)
+
+    for rule in rules:
+        visit(rule, [])
+
+    return ordered
+
+
+def select_rules(rules, only=(), skip=()):
+    """Returns the rules selected by the options --only and --skip.
+
+    Args:
+    rules -- the list of the rules
+    only -- the names of the rules to run, empty for all
+    skip -- the names of the rules to skip
+    """
+    names = [r.name for r in rules]
+    unknown = [n for n in list(only) + list(skip) if n not in names]
+    if unknown:
+        raise ValueError('Unknown rule: %s, the rules are: %s'
+                         % (', '.join(unknown), ', '.join(names)))
+
+    return [r for r in rules if (not only or r.name in only) and r.name not in skip]
+
+
+def get_rules(only=(), skip=(), plugins=False):
+    """Returns the rules of a run, sorted.
+
+    Args:
+    only -- the names of the rules to run, empty for all
+    skip -- the names of the rules to skip
+    plugins -- True to add the rules of the installed plugins
+    """
+    rules = list(RULES)
+    if plugins:
+        rules.extend(load_plugins())
+    return select_rules(order_rules(rules), only, skip)
+
+
+def find_triggers(lines, triggers):
+    """Returns the set of the triggers found into the lines.
+
+    The lines are joined by blocks, a trigger is never split across two
+    lines.
+
+    Args:
+    lines -- the list of the logical lines
+    triggers -- the strings searched
+    """
+    remaining = set(triggers)
+    found = set()
+    for start in range(0, len(lines), TRIGGER_BLOCK):
+        if not remaining:
+            break
+
+        text = ''.join(lines[start:start + TRIGGER_BLOCK])
+        for trigger in list(remaining):
+            if trigger in text:
+                found.add(trigger)
+                remaining.discard(trigger)
+
+    return found
+
+
+def build_plan(rules, lines, kinds, pyqt5=True):
+    """Returns the steps of the conversion of a file.
+
+    The rules which can't match are dropped and the consecutive line-local
+    rules are fused, a step is a Rule or a list of line-local Rules.
+
+    Args:
+    rules -- the sorted rules of the run
+    lines -- the list of the logical lines
+    kinds -- the set of the kinds of code found, see Rule
+    pyqt5 -- False for the option --nopyqt5
+    """
+    rules = [r for r in rules if (pyqt5 or r.nopyqt5) and kinds.issuperset(r.requires)]
+    found = find_triggers(lines, set(t for r in rules for t in r.triggers))
+    steps = []
+    for rule in rules:
+        if rule.triggers and found.isdisjoint(rule.triggers):
+            continue
+
+        if not rule.line_local:
+            steps.append(rule)
+        elif steps and isinstance(steps[-1], list):
+            steps[-1].append(rule)
+        else:
+            steps.append([rule])
+
+    return steps
+
+
+def run_plan(cnv, steps, lines):
+    """Run the steps of a plan on the lines, returns the new lines.
+
+    Args:
+    cnv -- the PyQt4ToPyQt5 instance
+    steps -- the steps given by build_plan()
+    lines -- the list of the logical lines
+    """
+    for step in steps:
+        if isinstance(step, list):
+            cnv.fix_lines(lines, [rule.bind(cnv) for rule in step],
+                          [rule.name for rule in step])
+            continue
+
+        new = step.bind(cnv)(lines)
+        if new is not None:
+            lines = new
+
+    return lines
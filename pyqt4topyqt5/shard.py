@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of pyqt4topyqt5
+
+import os
+import re
+import sys
+import zlib
+import shutil
+import argparse
+
+from datetime import datetime
+
+SHARD_RE = re.compile(r'^(\d+)/(\d+)$')
+DIFF_NAME = 'DIFFs.diff'
+
+
+def parse_shard(spec):
+    """Returns the tuple (K, N) of a shard specification `K/N`.
+
+    Args:
+    spec -- the string K/N, 1 <= K <= N
+
+    Raises ValueError if the specification is invalid
+    """
+    match = SHARD_RE.match(spec.strip())
+    if match is None:
+        raise ValueError('Invalid shard `%s`, expected K/N' % spec)
+
+    num, count = int(match.group(1)), int(match.group(2))
+    if not 1 <= num <= count:
+        raise ValueError('Invalid shard `%s`, K must be between 1 and N' % spec)
+
+    return num, count
+
+
+def shard_key(relpath):
+    """Returns the key used to sort and to hash a path.
+
+    The key doesn't depend on the platform nor on the location of the tree.
+
+    Args:
+    relpath -- the path relative to the root of the tree
+    """
+    key = relpath.replace(os.sep, '/')
+    while key.startswith('./'):
+        key = key[2:]
+
+    return key
+
+
+def select(items, keys, num, count, sizes=None):
+    """Returns the items assigned to a shard.
+
+    Without sizes, a path is assigned by its hash.  With sizes, the files
+    are dealt to the lightest shard from the largest one, which gives the
+    same assignment on each machine since all of them see the same tree.
+
+    Args:
+    items -- the list of items to dispatch
+    keys -- the relative paths of the items
+    num -- the shard number, from 1
+    count -- the number of shards
+    sizes -- the sizes of the items, None for the hash assignment
+    """
+    keys = [shard_key(k) for k in keys]
+    if sizes is None:
+        return [item for item, key in zip(items, keys)
+                if zlib.crc32(key.encode('utf-8')) % count == num - 1]
+
+    loads = [0] * count
+    selected = set()
+    order = sorted(range(len(items)), key=lambda i: (-sizes[i], keys[i]))
+    for i in order:
+        shard = loads.index(min(loads))
+        loads[shard] += sizes[i]
+        if shard == num - 1:
+            selected.add(i)
+
+    return [item for i, item in enumerate(items) if i in selected]
+
+
+def walk_order(relpath):
+    """Sort key giving the order of a single run, the files of a dir before
+    its sub-dirs.
+
+    Args:
+    relpath -- the path relative to the root of the tree
+    """
+    parts = shard_key(relpath).split('/')
+    return tuple((1, p) for p in parts[:-1]) + ((0, parts[-1]),)
+
+
+class Merger(object):
+    """Combine the outputs of the shards into the artifacts of a single run.
+
+    Args:
+    dest -- the dir of the merged conversion
+    shards -- the destination dirs of the shards
+    """
+    def __init__(self, dest, shards):
+        self.dest = os.path.abspath(dest)
+        self.shards = [os.path.abspath(s) for s in shards]
+
+    def relocate(self, text):
+        """Replace the paths of the shards by the path of the merged dir.
+
+        Args:
+        text -- the string
+        """
+        for shard in self.shards:
+            text = text.replace(shard + os.sep, self.dest + os.sep)
+
+        return text
+
+    def merge_trees(self):
+        """Copy the converted files of all the shards into the destination."""
+        for shard in self.shards:
+            for root, dirs, files in os.walk(shard):
+                target = os.path.join(self.dest, os.path.relpath(root, shard))
+                if not os.path.isdir(target):
+                    os.makedirs(target)
+
+                for name in files:
+                    if root == shard and name == DIFF_NAME:
+                        continue
+
+                    src = os.path.join(root, name)
+                    cp = os.path.join(target, name)
+                    if name.endswith('.diff'):
+                        with open(src, 'r') as inf:
+                            content = inf.read()
+                        with open(cp, 'w') as outf:
+                            outf.write(self.relocate(content))
+                    else:
+                        shutil.copy2(src, cp)
+
+    def merge_diffs(self, diffs):
+        """Merge the diffs of the shards into one file sorted as a single run.
+
+        Args:
+        diffs -- the list of diff files
+        """
+        sections = []
+        for diff in diffs:
+            with open(diff, 'r') as inf:
+                lines = self.relocate(inf.read()).splitlines(True)
+            current = None
+            for idx, line in enumerate(lines):
+                if line.startswith('--- ') and idx + 1 < len(lines) \
+                        and lines[idx+1].startswith('+++ '):
+                    path = lines[idx+1][4:].split('\t')[0].strip()
+                    current = [path, []]
+                    sections.append(current)
+                if current is not None:
+                    current[1].append(line)
+
+        sections.sort(key=lambda s: walk_order(os.path.relpath(s[0], self.dest)))
+        with open(os.path.join(self.dest, DIFF_NAME), 'w') as outf:
+            for _, lines in sections:
+                outf.write(''.join(lines))
+
+    def merge_logs(self, logs, output):
+        """Merge the logs of the shards, the files ordered as a single run.
+
+        Args:
+        logs -- the list of log files
+        output -- the merged log
+        """
+        blocks = []
+        for log in logs:
+            with open(log, 'r') as inf:
+                lines = self.relocate(inf.read()).splitlines(True)
+            current = None
+            for line in lines:
+                if line.startswith('Processing file: `'):
+                    path = line.split('`')[1]
+                    current = [path, []]
+                    blocks.append(current)
+                # The header of each log is replaced by the merged one
+                if current is not None:
+                    current[1].append(line)
+
+        blocks.sort(key=lambda b: walk_order(os.path.relpath(b[0], self.dest)))
+        date = datetime.now().strftime("%A %d. %B %Y %H:%M")
+        with open(output, 'w') as outf:
+            outf.write('**  %s  %s  **\nMerged from: %s\n\n'
+                       % (os.path.basename(output), date, ' '.join(logs)))
+            outf.write('Beginning into: %s\n\n' % self.dest)
+            for _, lines in blocks:
+                outf.write(''.join(lines))
+
+    def merge_ledgers(self, ledgers, output):
+        """Merge the ledgers of the shards.
+
+        Args:
+        ledgers -- the list of ledger files
+        output -- the merged ledger
+        """
+        from .ledger import Ledger
+        merged = Ledger(output)
+        merged.begin(['merge'] + ledgers)
+        for path in ledgers:
+            shard = Ledger(path)
+            for row in shard.db.execute('SELECT * FROM files'):
+                row = (self.relocate(row[0]),) + tuple(row[1:7]) + (merged.run, row[8])
+                merged.db.execute('INSERT OR REPLACE INTO files VALUES '
+                                  '(?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+            shard.db.close()
+        merged.db.commit()
+        merged.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Merge the outputs of the '
+                        'conversions made with --shard K/N.')
+    parser.add_argument("shards", nargs='+',
+                        help="The destination dirs of the shards.")
+    parser.add_argument("-o", required=True,
+                        help="The dir of the merged conversion.")
+    parser.add_argument("--logs", nargs='*', default=[],
+                        help="The logs of the shards.")
+    parser.add_argument("--log", default='pyqt4_to_pyqt5.log',
+                        help="The merged log.  Default: pyqt4_to_pyqt5.log")
+    parser.add_argument("--diffs", nargs='*', default=[],
+                        help="The diff files of the shards written outside "
+                        "of their destination dir.")
+    parser.add_argument("--ledgers", nargs='*', default=[],
+                        help="The ledgers of the shards.")
+    parser.add_argument("--ledger", default='pyqt4_to_pyqt5.ledger',
+                        help="The merged ledger.  Default: pyqt4_to_pyqt5.ledger")
+    arg = parser.parse_args(argv)
+
+    for shard in arg.shards:
+        if not os.path.isdir(shard):
+            sys.stdout.write('No such directory: `%s`\n' % shard)
+            return 1
+
+    merger = Merger(arg.o, arg.shards)
+    merger.merge_trees()
+
+    diffs = [os.path.join(s, DIFF_NAME) for s in merger.shards
+             if os.path.isfile(os.path.join(s, DIFF_NAME))] + arg.diffs
+    if diffs:
+        merger.merge_diffs(diffs)
+
+    if arg.logs:
+        merger.merge_logs(arg.logs, arg.log)
+
+    if arg.ledgers:
+        merger.merge_ledgers(arg.ledgers, arg.ledger)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
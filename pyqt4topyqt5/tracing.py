@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of pyqt4topyqt5
+
+"""Chrome trace events of a run, open the file with chrome://tracing or
+https://ui.perfetto.dev
+"""
+
+import os
+import json
+import time
+
+from contextlib import contextmanager
+
+# Methods of the converter traced besides the fix_* ones, by category
+CONVERTER_SPANS = (('convert_rcc_module', 'load'),
+                   ('remove_fromUtf8', 'fix'),
+                   ('get_import_lines', 'imports'),
+                   ('change_module_name', 'imports'),
+                   ('move_qtgui_classes', 'imports'),
+                   ('change_import_lines', 'imports'),
+                   ('replace_classnames', 'fix'),
+                   ('replace_qApp', 'fix'),
+                   ('clean_file', 'save'),
+                   ('save_changes', 'save'))
+TOOLS_SPANS = (('get_code_lines', 'load'),
+               ('map_code_lines', 'load'),
+               ('decode_code_lines', 'load'),
+               ('split_logical_lines', 'tokenize'))
+
+
+def instrument(cnv, wrap):
+    """Wrap the stages of a conversion, the fix_* methods, the line-local
+    rules, the imports rewriting, the loading and the saving.
+
+    Args:
+    cnv -- the PyQt4ToPyQt5 instance
+    wrap -- the function wrap(method, name, category) which returns the
+            wrapped method
+    """
+    names = [(n, 'fix') for n in dir(cnv) if n.startswith('fix_') and n != 'fix_lines']
+    for name, cat in names + list(CONVERTER_SPANS):
+        setattr(cnv, name, wrap(getattr(cnv, name), name, cat))
+    for name, cat in TOOLS_SPANS:
+        setattr(cnv.tools, name, wrap(getattr(cnv.tools, name), name, cat))
+    cnv.fix_lines = split_line_rules(cnv.fix_lines, wrap)
+
+
+def split_line_rules(fix_lines, wrap):
+    """Returns a fix_lines() which runs each line-local rule in its own
+    pass, wrapped under the name of the rule.
+
+    The rules change each line independently of the others, so the lines
+    are the same as with the fused pass.
+
+    Args:
+    fix_lines -- the fix_lines method of the converter
+    wrap -- the function given to instrument()
+    """
+    def fix_each(lines, funcs, names=None):
+        if names is None:
+            names = [getattr(func, '__name__', 'fix_lines') for func in funcs]
+        for func, name in zip(funcs, names):
+            wrap(fix_lines, name, 'fix')(lines, [func])
+    return fix_each
+
+
+class Tracer(object):
+    """Collect the spans of a run and write them as Chrome trace events.
+
+    The spans of the main process are recorded directly, those of the
+    worker processes are sent back with their results.
+    """
+    def __init__(self):
+        self.pid = os.getpid()
+        self.events = []
+        self.workers = {}
+
+    def add(self, name, cat, start, end, pid=None, args=None):
+        """Add a complete span.
+
+        Args:
+        name -- the name of the span
+        cat -- its category
+        start, end -- the times given by time.time()
+        pid -- the process which ran it, None for the main process
+        args -- a dict shown with the span
+        """
+        pid = self.pid if pid is None else pid
+        if pid != self.pid and pid not in self.workers:
+            self.workers[pid] = len(self.workers) + 1
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'pid': pid, 'tid': pid,
+                 'ts': start * 1e6, 'dur': (end - start) * 1e6}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def merge(self, events):
+        """Add the spans recorded by a worker process.
+
+        Args:
+        events -- the events of the Tracer of the worker
+        """
+        for event in events:
+            if event['pid'] != self.pid and event['pid'] not in self.workers:
+                self.workers[event['pid']] = len(self.workers) + 1
+        self.events.extend(events)
+
+    @contextmanager
+    def span(self, name, cat, args=None):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, cat, start, time.time(), args=args)
+
+    def wrap(self, func, name, cat):
+        def traced(*args, **kwargs):
+            with self.span(name, cat):
+                return func(*args, **kwargs)
+        return traced
+
+    def instrument(self, cnv):
+        """Trace the stages of a conversion.
+
+        Args:
+        cnv -- the PyQt4ToPyQt5 instance
+        """
+        instrument(cnv, self.wrap)
+
+    def metadata(self):
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': self.pid,
+                   'tid': self.pid, 'args': {'name': 'main'}}]
+        for pid, num in sorted(self.workers.items(), key=lambda i: i[1]):
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                           'tid': pid, 'args': {'name': 'worker %d' % num}})
+        return events
+
+    def write(self, path):
+        """Write the trace file.
+
+        Args:
+        path -- the file name
+        """
+        with open(path, 'w') as outf:
+            json.dump({'traceEvents': self.metadata() + self.events,
+                       'displayTimeUnit': 'ms'}, outf)
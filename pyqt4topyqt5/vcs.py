@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of pyqt4topyqt5
+
+import os
+import sys
+import subprocess
+
+
+def git(root, args):
+    """Run a git command into a dir and returns the list of the paths
+    written by the command, separated by NUL.
+
+    Args:
+    root -- the dir
+    args -- the arguments of git
+
+    Raises ValueError if git fails
+    """
+    cmd = ['git', '-C', root] + args
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as why:
+        raise ValueError("Can't run git: %s" % why)
+
+    out, err = proc.communicate()
+    encoding = sys.getfilesystemencoding() or 'utf-8'
+    if proc.returncode:
+        raise ValueError(err.decode(encoding, 'replace').strip())
+
+    return [p for p in out.decode(encoding).split('\0') if p]
+
+
+def work_tree_files(root):
+    """Returns the files of a dir tracked by git, or untracked and not
+    ignored.  The list is sorted and the paths are absolute.
+
+    Args:
+    root -- a dir into a git work tree
+    """
+    paths = git(root, ['ls-files', '--cached', '--others', '--exclude-standard', '-z'])
+    return sorted(set(os.path.join(root, p) for p in paths))
+
+
+def changed_files(root, ref):
+    """Returns the files of a dir modified or added since a git revision.
+
+    The files are compared between the revision and the working tree, the
+    untracked files which aren't ignored are included, the deleted files
+    are not.  The list is sorted and the paths are absolute.
+
+    Args:
+    root -- a dir into a git work tree
+    ref -- the revision, i.e. a commit, a tag or a branch
+
+    Raises ValueError if the dir isn't into a work tree or the revision
+    is unknown
+    """
+    try:
+        git(root, ['rev-parse', '--verify', ref + '^{commit}'])
+    except ValueError as why:
+        raise ValueError('Invalid revision `%s`: %s' % (ref, why))
+
+    paths = set(git(root, ['diff', '--name-only', '--relative', '-z',
+                           '--diff-filter=d', ref, '--']))
+    paths.update(git(root, ['ls-files', '--others', '--exclude-standard', '-z']))
+    return sorted(os.path.join(root, p) for p in paths)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of pyqt4topyqt5
+
+import os
+import sys
+import traceback
+import multiprocessing
+
+from codecs import BOM_UTF8
+
+from . import PyQt4ToPyQt5, SIGNATURES
+
+TIMEOUT_FIXME = ('# FIXME pyqt4topyqt5: the conversion has been stopped after '
+                 '%ss, this file is unchanged.')
+
+
+class Result(object):
+    """Result of the conversion of a file into the worker, with the
+    attributes of PyQt4ToPyQt5 read by Main.
+    """
+    def __init__(self, status=None, fixmes=0, error='', num_lines=0, output=None):
+        self.status = status
+        self.fixmes = fixmes
+        self.error = error
+        self.num_lines = num_lines
+        self.output = output
+        self.encoding = 'utf-8'
+        # The trace events of the worker
+        self.events = []
+        # The traceback of an unexpected exception
+        self.exception = None
+        # The hits and misses of the cache of the signatures of the worker
+        self.signatures = (0, 0)
+
+
+def work(conn, log, nopyqt5, index, trace, rules=None):
+    """Loop of the worker process, convert the files received until None.
+
+    Args:
+    conn -- the end of the pipe of the worker
+    log -- the log file
+    nopyqt5 -- the option --nopyqt5
+    index -- the SymbolIndex of the project
+    trace -- True to send back the trace events of each file
+    rules -- the fixers run, None for the built-in ones
+    """
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        source, dest, data = job
+        tracer = None
+        if trace:
+            from .tracing import Tracer
+            tracer = Tracer()
+        cnv = PyQt4ToPyQt5(source, dest, log, nopyqt5, index, data, tracer, rules)
+        result = Result()
+        hits, misses = SIGNATURES.hits, SIGNATURES.misses
+        try:
+            cnv.setup()
+        except Exception:
+            result.exception = traceback.format_exc()
+        result.status = cnv.status
+        result.fixmes = cnv.fixmes
+        result.error = str(cnv.error or '')
+        result.num_lines = cnv.num_lines
+        result.output = cnv.output
+        result.encoding = cnv.tools.encoding
+        result.signatures = (SIGNATURES.hits - hits, SIGNATURES.misses - misses)
+        if tracer is not None:
+            result.events = tracer.events
+        sys.stdout.flush()
+        conn.send(result)
+
+
+def add_fixme_header(data, timeout):
+    """Returns the content of a file with the FIXME of a timeout, written
+    after the shebang and the encoding declaration.
+
+    Args:
+    data -- the content
+    timeout -- the time budget in seconds
+    """
+    bom = BOM_UTF8 if data.startswith(BOM_UTF8) else b''
+    lines = data[len(bom):].splitlines(True)
+    newline = b'\r\n' if lines and lines[0].endswith(b'\r\n') else b'\n'
+    fixme = (TIMEOUT_FIXME % ('%g' % timeout)).encode('ascii') + newline
+    pos = 1 if lines and lines[0].startswith(b'#!') else 0
+    if pos < len(lines) and lines[pos].lstrip().startswith(b'#') \
+            and b'coding' in lines[pos]:
+        pos += 1
+
+    if pos and not lines[pos-1].endswith((b'\n', b'\r')):
+        lines[pos-1] += newline
+    return bom + b''.join(lines[:pos]) + fixme + b''.join(lines[pos:])
+
+
+def write_timed_out(source, dest, timeout):
+    """Write the file stopped by the watchdog, unchanged with a FIXME.
+
+    Args:
+    source -- the original file
+    dest -- the file to write, may be the same
+    timeout -- the time budget in seconds
+    """
+    with open(source, 'rb') as inf:
+        data = inf.read()
+
+    # Left by a worker killed while saving
+    tmp = dest + '.pyqt5tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    with open(dest, 'wb') as outf:
+        outf.write(add_fixme_header(data, timeout))
+
+
+class Watchdog(object):
+    """Convert the files into a worker process, the worker is killed and
+    replaced when a file takes longer than the time budget.
+
+    Args:
+    timeout -- the time budget of a file in seconds
+    log -- the log file
+    nopyqt5 -- the option --nopyqt5
+    index -- the SymbolIndex of the project
+    trace -- True to collect the trace events of the worker
+    rules -- the fixers run, None for the built-in ones
+    """
+    def __init__(self, timeout, log, nopyqt5, index, trace=False, rules=None):
+        self.timeout = timeout
+        self.log = log
+        self.nopyqt5 = nopyqt5
+        self.index = index
+        self.trace = trace
+        self.rules = rules
+        self.proc = None
+        self.conn = None
+
+    def start(self):
+        # The buffered output would be written again by the child
+        sys.stdout.flush()
+        self.conn, child = multiprocessing.Pipe()
+        self.proc = multiprocessing.Process(target=work, args=(child, self.log,
+                                            self.nopyqt5, self.index, self.trace,
+                                            self.rules))
+        self.proc.daemon = True
+        self.proc.start()
+        child.close()
+
+    def convert(self, source, dest, data=None):
+        """Returns the Result of the conversion of a file, its status is
+        'timeout' if the time budget is exceeded.
+
+        Args:
+        source -- the file to read
+        dest -- the file to write
+        data -- the content of the file for an in memory conversion
+        """
+        if self.proc is None or not self.proc.is_alive():
+            self.start()
+
+        self.conn.send((source, dest, data))
+        if self.conn.poll(self.timeout):
+            try:
+                return self.conn.recv()
+            except EOFError:
+                # The worker died, i.e. killed by the OOM killer
+                self.stop()
+                return Result('failed', error='The worker process died')
+
+        self.stop()
+        return Result('timeout', 1, 'Stopped after %gs' % self.timeout)
+
+    def stop(self):
+        """Kill the worker, a new one will be started for the next file."""
+        if self.proc is not None:
+            self.proc.terminate()
+            self.proc.join()
+            self.conn.close()
+            self.proc = None
+
+    def close(self):
+        if self.proc is not None:
+            try:
+                self.conn.send(None)
+            except (IOError, OSError):
+                pass
+            self.proc.join(self.timeout)
+            self.stop()